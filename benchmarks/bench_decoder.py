@@ -0,0 +1,98 @@
+"""
+Micro-benchmark of the connector decoder.
+
+Compares the single-pass AWSConnectorHanlder.xml_to_objects decoder with the previous two-step path (xml_to_dict
+followed by dict_to_object, reproduced below) over a synthetic search response.
+
+Usage:
+    python benchmarks/bench_decoder.py [--connectors 10000] [--repeat 5]
+"""
+from os.path import abspath, dirname
+import argparse
+import sys
+import time
+import xml.etree.ElementTree as StdET
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from benchmarks.synthetic import search_response_xml  # noqa: E402
+from connectors.aws import AWSConnector  # noqa: E402
+from handlers.aws import AWSConnectorHanlder, ET  # noqa: E402
+
+
+def legacy_xml_to_dict(connectors_as_xml):
+    all_connectors = []
+    root = StdET.ElementTree(StdET.fromstring(connectors_as_xml)).getroot()
+    for connector in root.findall('.//AwsAssetDataConnector'):
+        all_connectors.append({
+            "id": connector.find("id").text,
+            "name": connector.find("name").text,
+            "awsAccountId": connector.find("awsAccountId").text if connector.find("awsAccountId") else None,
+            "lastSync": connector.find("lastSync").text if connector.find("lastSync") else None,
+            "lastError": connector.find("lastError").text if connector.find("lastError") else None,
+            "connectorState": connector.find("connectorState").text,
+            "type": connector.find("type").text,
+            "defaultTags": {
+                "list": {
+                    "TagSimple": {
+                        "id": connector.find("defaultTags/list/TagSimple/id").text,
+                        "name": connector.find("defaultTags/list/TagSimple/name").text
+                    }
+                }
+            } if connector.find("defaultTags") else None,
+            "disabled": connector.find("disabled").text,
+            "isGovCloudConfigured": connector.find("isGovCloudConfigured").text,
+            "isChinaConfigured": connector.find("isChinaConfigured").text,
+            "isDeleted": connector.find("isDeleted").text if connector.find("isDeleted") else None,
+            "arn": connector.find("arn").text if connector.find("arn") else None,
+            "externalId": connector.find("externalId").text,
+            "qualysAwsAccountId": connector.find("qualysAwsAccountId").text if connector.find("qualysAwsAccountId") else None,
+            "authRecord": connector.find("authRecord").text if connector.find("authRecord") else None,
+            "allRegions": connector.find("allRegions").text
+        })
+    return all_connectors
+
+
+def legacy_dict_to_object(connectors_dicts):
+    return [AWSConnector(dictionary["id"], dictionary["name"], dictionary["awsAccountId"], dictionary["lastSync"],
+                         dictionary["lastError"], dictionary["connectorState"], dictionary["type"],
+                         dictionary["defaultTags"], dictionary["disabled"], dictionary["isGovCloudConfigured"],
+                         dictionary["isChinaConfigured"], dictionary["isDeleted"], dictionary["arn"],
+                         dictionary["externalId"], dictionary["qualysAwsAccountId"], dictionary["authRecord"],
+                         dictionary["allRegions"])
+            for dictionary in connectors_dicts]
+
+
+def legacy_decode(connectors_as_xml):
+    return legacy_dict_to_object(legacy_xml_to_dict(connectors_as_xml))
+
+
+def best_of(function, payload, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decoded = function(payload)
+        timings.append(time.perf_counter() - started)
+    return min(timings), len(decoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connectors", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = search_response_xml(args.connectors)
+    print(f"{args.connectors} connectors, {len(payload) / 1024 / 1024:.1f} MiB, parser: {ET.__name__}")
+    results = [
+        ("xml_to_dict + dict_to_object", best_of(legacy_decode, payload, args.repeat)),
+        ("xml_to_objects", best_of(AWSConnectorHanlder.xml_to_objects, payload, args.repeat)),
+    ]
+    baseline = results[0][1][0]
+    for label, (elapsed, decoded) in results:
+        print(f"{label:<30} {elapsed * 1000:9.1f} ms  {decoded / elapsed:12,.0f} connectors/s  "
+              f"x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+End-to-end benchmark of the client and the Lambda handlers against the local Qualys emulator.
+
+Starts the emulator (see qualys_emulator.py), points QualysClient and the Slack notifier at it, and stubs AWS: STS
+through botocore's Stubber and IAM through an in-memory account registered on the client's before-call event, which
+is what the Stubber uses too (its queue of expected calls can't be used for IAM, since setup_iam makes its calls
+concurrently, in no fixed order). Then it drives each stage and reports its latency percentiles and throughput:
+- search_all: listing every connector of the subscription, page by page.
+- get_by_name: looking up one connector by name, bypassing the connector index.
+- create, activate, delete: the connector calls made by the provisioning.
+- setup_iam: the IAM setup of an account (stubbed, so it measures the client side only).
+- lambda_handler: one account creation event, from the event to the flushed Slack notification, including the
+  wait for the activated connector to leave its transitional states (see --activation-delay).
+- batch_handler: one batch of account creation events, provisioned concurrently (one sample per batch).
+
+Usage:
+    python benchmarks/bench_e2e.py [--connectors 1000] [--iterations 50] [--latency-ms 20] [--error-rate 0]
+        [--batch-size 20] [--rate-limit 300 --rate-window 60] [--concurrency-limit 4] [--json results.json]
+
+With --rate-limit or --concurrency-limit, the emulator enforces the Qualys API limits, and the requests it rejected
+are reported as 'throttled'. With --json, the results are also written as JSON, so they can be compared between runs
+in CI.
+"""
+from os.path import abspath, dirname
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from benchmarks.qualys_emulator import QualysEmulator  # noqa: E402
+
+os.environ.setdefault("QUALYS_API_USER", "benchmark")
+os.environ.setdefault("QUALYS_API_PASSWORD", "benchmark")
+os.environ.setdefault("QUALYS_BASE_ACCOUNT_ID", "000000000000")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class Stage:
+    """
+    Class that represents the measurements of one benchmark stage.
+
+    Attributes:
+        name (str): Name of the stage.
+        samples (list): Duration, in seconds, of each operation.
+        items (int): Number of items processed (eg: connectors listed), used for the throughput.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.items = 0
+
+    def measure(self, function, *args, items=1, **kwargs):
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.samples.append(time.perf_counter() - started)
+        self.items += items
+        return result
+
+    def summary(self):
+        total = sum(self.samples)
+        return {
+            "stage": self.name,
+            "samples": len(self.samples),
+            "p50_ms": percentile(self.samples, 0.5) * 1000,
+            "p99_ms": percentile(self.samples, 0.99) * 1000,
+            "mean_ms": total / len(self.samples) * 1000,
+            "throughput_per_s": self.items / total if total else 0,
+        }
+
+
+class InMemoryIAM:
+    """
+    Class that represents the IAM service of one stubbed account. It answers the calls of an IAM client from its
+     before-call event, keeping the roles, policies and attachments created, so a second setup of the same account
+     only reads them, as it would on AWS.
+    """
+
+    def __init__(self, account_id):
+        self.__account_id = account_id
+        self.__roles = {}
+        self.__policies = {}
+        self.__attachments = set()
+
+    def install(self, iam_client):
+        iam_client.meta.events.register("before-call.iam", self.__answer)
+
+    def __answer(self, model, params, **kwargs):
+        from botocore.awsrequest import AWSResponse
+        try:
+            parsed = getattr(self, f"_{model.name}")(params["body"])
+        except LookupError as err:
+            return AWSResponse(None, 404, {}, None), {"Error": {"Code": "NoSuchEntity", "Message": str(err)}}
+        return AWSResponse(None, 200, {}, None), dict(parsed, ResponseMetadata={"HTTPStatusCode": 200})
+
+    def __role(self, name):
+        # IAM returns the policy documents URL-encoded
+        return {"RoleName": name, "Arn": f"arn:aws:iam::{self.__account_id}:role/{name}",
+                "AssumeRolePolicyDocument": quote(json.dumps(self.__roles[name]))}
+
+    def _GetRole(self, body):
+        return {"Role": self.__role(body["RoleName"])}
+
+    def _CreateRole(self, body):
+        self.__roles[body["RoleName"]] = json.loads(body["AssumeRolePolicyDocument"])
+        return {"Role": self.__role(body["RoleName"])}
+
+    def _UpdateAssumeRolePolicy(self, body):
+        self.__roles[body["RoleName"]] = json.loads(body["PolicyDocument"])
+        return {}
+
+    def _GetPolicy(self, body):
+        if body["PolicyArn"] not in self.__policies:
+            raise LookupError(body["PolicyArn"])
+        return {"Policy": {"Arn": body["PolicyArn"]}}
+
+    def _CreatePolicy(self, body):
+        policy_arn = f"arn:aws:iam::{self.__account_id}:policy/{body['PolicyName']}"
+        self.__policies[policy_arn] = json.loads(body["PolicyDocument"])
+        return {"Policy": {"Arn": policy_arn}}
+
+    def _ListAttachedRolePolicies(self, body):
+        return {"AttachedPolicies": [{"PolicyArn": policy_arn} for role_name, policy_arn in self.__attachments
+                                     if role_name == body["RoleName"]], "IsTruncated": False}
+
+    def _AttachRolePolicy(self, body):
+        self.__attachments.add((body["RoleName"], body["PolicyArn"]))
+        return {}
+
+
+def stub_accounts(account_ids):
+    """
+    Assumes the role of each account through a stubbed STS, and installs an in-memory IAM on its cached IAM client,
+     so setup_iam runs without AWS.
+
+    Args:
+        account_ids (list): The IDs of the accounts.
+    """
+    from botocore.stub import ANY, Stubber
+    from role_assignment import assumed_roles, get_boto_client
+
+    sts_client = get_boto_client("sts")
+    with Stubber(sts_client) as stubber:
+        for account_id in account_ids:
+            stubber.add_response("assume_role", {"Credentials": {
+                "AccessKeyId": "ASIABENCHMARK0000000",
+                "SecretAccessKey": "benchmark",
+                "SessionToken": "benchmark",
+                "Expiration": datetime.now(timezone.utc) + timedelta(hours=1),
+            }}, {"RoleArn": f"arn:aws:iam::{account_id}:role/qualysintegrationassumerole", "RoleSessionName": ANY})
+            InMemoryIAM(account_id).install(assumed_roles.get_client(account_id, "iam"))
+        stubber.assert_no_pending_responses()
+
+
+class BenchmarkContext:
+    """Stands in for the Lambda context, with a 15 minutes timeout."""
+
+    def __init__(self):
+        self.aws_request_id = str(uuid.uuid4())
+        self.__deadline = time.monotonic() + 900
+
+    def get_remaining_time_in_millis(self):
+        return int((self.__deadline - time.monotonic()) * 1000)
+
+
+def account_event(account_name, account_id):
+    return {"detail": {"serviceEventDetails": {"createManagedAccountStatus": {
+        "state": "SUCCEEDED", "account": {"accountName": account_name, "accountId": account_id}}}}}
+
+
+def run(args, emulator):
+    from client_pool import QualysClientPool
+    from connectors.index import AWSConnectorIndex
+    from handlers.aws import AWSConnectorHanlder
+    from notification.outbox import SlackOutbox
+    from notification.slack import SlackNotifier
+    from qualys import QualysClient
+    from role_assignment import setup_iam
+    import lambda_function
+
+    os.environ["SLACK_TEST_CHANNEL_WEBHOOK_URL"] = emulator.slack_webhook_url
+    notifier = SlackNotifier(outbox=SlackOutbox(":memory:"), rate_limit=args.slack_rate_limit)
+    client = QualysClient(emulator.host, notifier, protocol="http", connector_index=AWSConnectorIndex())
+    lambda_function.slack_notifier = notifier
+    lambda_function.client_pool = QualysClientPool({"default": client})
+
+    stages = {name: Stage(name) for name in ("search_all", "get_by_name", "create", "activate", "delete", "setup_iam",
+                                             "lambda_handler", "batch_handler")}
+    for _ in range(args.list_runs):
+        stages["search_all"].measure(lambda: sum(1 for _ in client.iter_aws_connectors(page_size=args.page_size)),
+                                     items=len(emulator.store))
+    for iteration in range(args.iterations):
+        name = f"account-{iteration * 7919 % max(args.connectors, 1)}-prd"
+        stages["get_by_name"].measure(client.get_aws_connector_by_name, name, use_index=False)
+
+    for iteration in range(args.iterations):
+        name = f"bench-client-{iteration}-prd"
+        response, _ = stages["create"].measure(client.create_aws_connector, name)
+        connector = AWSConnectorHanlder.xml_to_objects(response.content)[0]
+        stages["activate"].measure(client.activate_aws_connector, connector.id,
+                                   f"arn:aws:iam::{200000000000 + iteration}:role/Role_For_QualysEC2Connector")
+        stages["delete"].measure(client.delete_aws_connector, name)
+
+    account_ids = [str(300000000000 + index) for index in range(args.iterations * 2 + args.batch_size * args.batches)]
+    stub_accounts(account_ids)
+    accounts = iter(account_ids)
+    for _ in range(args.iterations):
+        stages["setup_iam"].measure(setup_iam, client.base_account_id, "1658443190235", next(accounts))
+    for iteration in range(args.iterations):
+        event = account_event(f"bench-lambda-{iteration}-prd", next(accounts))
+        stages["lambda_handler"].measure(lambda_function.lambda_handler, event, BenchmarkContext())
+    for batch in range(args.batches):
+        records = [{"messageId": str(uuid.uuid4()),
+                    "body": json.dumps(account_event(f"bench-batch-{batch}-{index}-prd", next(accounts)))}
+                   for index in range(args.batch_size)]
+        stages["batch_handler"].measure(lambda_function.batch_handler, {"Records": records}, BenchmarkContext(),
+                                        items=args.batch_size)
+    return [stage.summary() for stage in stages.values() if stage.samples]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connectors", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--list-runs", type=int, default=5)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--batches", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--activation-delay", type=float, default=0,
+                        help="seconds an activated connector stays in transitional states")
+    parser.add_argument("--slack-rate-limit", type=float, default=100)
+    parser.add_argument("--rate-limit", type=int, help="API requests allowed per --rate-window seconds")
+    parser.add_argument("--rate-window", type=float, default=60)
+    parser.add_argument("--concurrency-limit", type=int, help="API requests processed at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="path of a file where the results are written as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the handlers")
+    args = parser.parse_args()
+
+    with QualysEmulator(connectors=args.connectors, latency=args.latency_ms / 1000, error_rate=args.error_rate,
+                        activation_delay=args.activation_delay, seed=args.seed, rate_limit=args.rate_limit,
+                        rate_window=args.rate_window, concurrency_limit=args.concurrency_limit) as emulator:
+        output = sys.stdout if args.verbose else io.StringIO()
+        with redirect_stdout(output):
+            results = run(args, emulator)
+        activated = emulator.store.search([("name", "CONTAINS", "bench-"), ("disabled", "EQUALS", "false")])
+        requests = dict(emulator.requests)
+
+    print(f"{args.connectors} connectors, {args.latency_ms:g} ms latency, {args.error_rate:.1%} errors")
+    print(f"{'stage':<16}{'samples':>8}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'per s':>10}")
+    for result in results:
+        print(f"{result['stage']:<16}{result['samples']:>8}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+              f"{result['mean_ms']:>10.1f}{result['throughput_per_s']:>10.1f}")
+    print(f"accounts provisioned: {len(activated)}, requests: {json.dumps(requests, sort_keys=True)}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"arguments": vars(args), "stages": results, "provisioned": len(activated),
+                       "requests": requests}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Import-time benchmark of the Lambda entry point.
+
+Runs a fresh interpreter with `python -X importtime`, the same way a cold start imports the handler module, and
+reports the cumulative import time of lambda_function and of its slowest imports. It also runs a filtered-out
+invocation (a non-production account) and lists which heavy dependencies it imported, which should be none.
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs 5] [--top 10] [--max-ms 50]
+
+With --max-ms, the script exits with status 1 when the median import time of lambda_function exceeds the limit, so
+it can be used to catch cold-start regressions in CI.
+"""
+from os.path import abspath, dirname
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPOSITORY_DIRECTORY = dirname(dirname(abspath(__file__)))
+HEAVY_MODULES = ("boto3", "botocore", "requests", "urllib3", "lxml", "aiohttp")
+FILTERED_OUT_INVOCATION = """
+import sys
+import lambda_function
+lambda_function.lambda_handler({"detail": {"serviceEventDetails": {"createManagedAccountStatus": {
+    "state": "SUCCEEDED", "account": {"accountName": "sandbox-dev", "accountId": "111111111111"}}}}}, None)
+print(",".join(sorted(name for name in sys.modules if name.split(".")[0] in %r and "." not in name)))
+""" % (HEAVY_MODULES,)
+
+
+def run_python(*arguments):
+    environment = dict(os.environ)
+    environment.setdefault("QUALYS_API_USER", "benchmark")
+    environment.setdefault("QUALYS_API_PASSWORD", "benchmark")
+    environment.setdefault("QUALYS_BASE_ACCOUNT_ID", "000000000000")
+    environment.setdefault("SLACK_TEST_CHANNEL_WEBHOOK_URL", "http://127.0.0.1/")
+    return subprocess.run([sys.executable, *arguments], cwd=REPOSITORY_DIRECTORY, env=environment,
+                          capture_output=True, text=True, check=True)
+
+
+def measure_import():
+    """
+    Imports lambda_function in a fresh interpreter.
+
+    Returns:
+        (dict): The cumulative import time, in microseconds, of lambda_function and of each module it imported.
+    """
+    stderr = run_python("-X", "importtime", "-c", "import lambda_function").stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line[len("import time:"):].split("|")
+        imports.append((module.strip(), len(module) - len(module.lstrip()), int(cumulative_us)))
+    # A module is reported after its own imports, which are the preceding, more indented, lines.
+    position = max(index for index, (module, _, _) in enumerate(imports) if module == "lambda_function")
+    cumulative = {"lambda_function": imports[position][2]}
+    top_level_indent = imports[position][1]
+    for module, indent, cumulative_us in reversed(imports[:position]):
+        if indent <= top_level_indent:
+            break
+        cumulative[module] = cumulative_us
+    return cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    runs = [measure_import() for _ in range(args.runs)]
+    median_ms = statistics.median(run["lambda_function"] for run in runs) / 1000
+    print(f"import lambda_function: {median_ms:.1f} ms (median of {args.runs} runs)")
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)[1:args.top + 1]
+    for module, cumulative_us in slowest:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+    imported = run_python("-c", FILTERED_OUT_INVOCATION).stdout.strip()
+    print(f"heavy modules imported by a filtered-out invocation: {imported or 'none'}")
+
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print(f"FAIL: import time above {args.max_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+Local stand-in for the Qualys QPS API, so the client can be load-tested without the real API server.
+
+Implements the AwsAssetDataConnector endpoints used by QualysClient, on top of an in-memory set of connectors:
+- qps/rest/{2.0,3.0}/search/am/awsassetdataconnector: filters (EQUALS, NOT EQUALS, IN, CONTAINS, GREATER, LESSER)
+  and pagination (startFromOffset/limitResults, hasMoreRecords, lastId).
+- qps/rest/2.0/create/am/awsassetdataconnector: creates a disabled connector.
+- qps/rest/2.0/update/am/awsassetdataconnector/<id>: sets the role ARN and enables the connector, which goes through
+  the transitional states for --activation-delay seconds before FINISHED_SUCCESS.
+- qps/rest/2.0/delete/am/awsassetdataconnector: deletes the connectors matching the filters.
+- qps/rest/3.0/get/am/awsassetdataconnector/<id> (GET): returns one connector.
+It also accepts any POST to /slack, standing in for the Slack webhook.
+
+Each request is delayed by the configured latency (with +/-50% jitter), and fails with a 503 at the configured rate.
+With --rate-limit or --concurrency-limit, the API requests are limited as Qualys does: the X-RateLimit-* and
+X-Concurrency-Limit-* headers are sent with every response, and the requests over a limit are answered with a 409.
+
+Usage:
+    python benchmarks/qualys_emulator.py [--port 8080] [--connectors 1000] [--latency-ms 50] [--error-rate 0.01]
+        [--activation-delay 0] [--rate-limit 300 --rate-window 3600] [--concurrency-limit 2]
+"""
+from os.path import abspath, dirname
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+import argparse
+import random
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as StdET
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from benchmarks.synthetic import connector_fields, render_connector, service_response_xml  # noqa: E402
+
+ENDPOINT_PATTERN = re.compile(
+    r"^/qps/rest/(?P<version>2\.0|3\.0)/(?P<action>search|create|update|delete|get)/am/awsassetdataconnector"
+    r"(?:/(?P<id>\d+))?/?$"
+)
+TRANSITIONAL_STATES = ("QUEUED", "PROCESSING")
+MAX_LIMIT_RESULTS = 1000
+
+
+def criteria_matches(fields, field, operator, value):
+    """
+    Evaluates one search Criteria on the fields of a connector.
+
+    Args:
+        fields (dict): The fields of the connector.
+        field (str): The field of the criteria, eg: 'name'.
+        operator (str): The operator of the criteria, eg: 'EQUALS'.
+        value (str): The value of the criteria.
+
+    Returns:
+        (bool): True if the connector matches the criteria.
+    """
+    actual = fields.get(field)
+    if actual is None:
+        return operator == "NOT EQUALS"
+    if operator == "EQUALS":
+        return actual == value
+    if operator == "NOT EQUALS":
+        return actual != value
+    if operator == "IN":
+        return actual in {item.strip() for item in value.split(",")}
+    if operator == "CONTAINS":
+        return value in actual
+    if operator in ("GREATER", "LESSER"):
+        if field == "id":
+            actual, value = int(actual), int(value)
+        return actual > value if operator == "GREATER" else actual < value
+    raise ValueError(f"Unsupported operator {operator}")
+
+
+class ConnectorStore:
+    """
+    Class that represents the connectors of the emulated subscription, kept in memory in creation (ie: ID) order.
+    """
+
+    def __init__(self, count=0, activation_delay=0):
+        """
+        Constructor method of class ConnectorStore.
+
+        Args:
+            count (int): Number of activated connectors the subscription starts with. Defaults to 0.
+            activation_delay (float): Seconds an activated connector stays in the transitional states. Defaults to 0.
+        """
+        self.__connectors = {}
+        self.__activated_at = {}
+        self.__activation_delay = activation_delay
+        self.__next_index = count
+        self.__lock = threading.Lock()
+        for index in range(count):
+            fields = connector_fields(index)
+            self.__connectors[fields["id"]] = fields
+
+    def __len__(self):
+        return len(self.__connectors)
+
+    def __current(self, fields):
+        activated_at = self.__activated_at.get(fields["id"])
+        if activated_at is None:
+            return fields
+        elapsed = time.monotonic() - activated_at
+        if elapsed >= self.__activation_delay:
+            del self.__activated_at[fields["id"]]
+            fields["connectorState"] = "FINISHED_SUCCESS"
+            fields["lastSync"] = time.strftime("%Y-%m-%dT%H:%M:%S.000+0000", time.gmtime())
+        else:
+            fields["connectorState"] = TRANSITIONAL_STATES[int(elapsed * 2 / self.__activation_delay)]
+        return fields
+
+    def search(self, criteria):
+        """
+        Returns the connectors matching all the criteria.
+
+        Args:
+            criteria (list): (field, operator, value) tuples.
+
+        Returns:
+            (list): The fields of the matching connectors, in ID order.
+        """
+        with self.__lock:
+            return [dict(fields) for fields in map(self.__current, self.__connectors.values())
+                    if all(criteria_matches(fields, *item) for item in criteria)]
+
+    def create(self, name, external_id=None, all_regions=None):
+        with self.__lock:
+            fields = connector_fields(self.__next_index)
+            self.__next_index += 1
+            fields.update(name=name, awsAccountId=None, lastSync=None, lastError=None, connectorState="PENDING",
+                          disabled="true", arn=None)
+            if external_id:
+                fields["externalId"] = external_id
+            if all_regions:
+                fields["allRegions"] = all_regions
+            self.__connectors[fields["id"]] = fields
+            return dict(fields)
+
+    def update(self, connector_id, arn=None, disabled=None):
+        with self.__lock:
+            fields = self.__connectors.get(connector_id)
+            if fields is None:
+                return None
+            if arn is not None:
+                fields["arn"] = arn
+                fields["awsAccountId"] = arn.split(":")[4]
+            if disabled is not None:
+                fields["disabled"] = disabled
+            if fields["disabled"] == "false" and fields["arn"]:
+                fields["connectorState"] = TRANSITIONAL_STATES[0]
+                self.__activated_at[connector_id] = time.monotonic()
+            return dict(self.__current(fields))
+
+    def get(self, connector_id):
+        with self.__lock:
+            fields = self.__connectors.get(connector_id)
+            return dict(self.__current(fields)) if fields is not None else None
+
+    def delete(self, criteria):
+        with self.__lock:
+            deleted = [connector_id for connector_id, fields in self.__connectors.items()
+                       if all(criteria_matches(fields, *item) for item in criteria)]
+            for connector_id in deleted:
+                del self.__connectors[connector_id]
+                self.__activated_at.pop(connector_id, None)
+            return deleted
+
+
+def parse_service_request(body):
+    """
+    Parses a ServiceRequest body.
+
+    Args:
+        body (bytes): The request body. May be empty.
+
+    Returns:
+        (tuple): (criteria, preferences, data) of the request: the (field, operator, value) tuples of the filters, the
+         preferences as a dict, and the fields of the AwsAssetDataConnector data as a dict.
+    """
+    if not body.strip():
+        return [], {}, {}
+    root = StdET.fromstring(body)
+    criteria = [(item.get("field"), item.get("operator"), (item.text or "").strip())
+                for item in root.iterfind("filters/Criteria")]
+    preferences = {element.tag: (element.text or "").strip() for element in root.iterfind("preferences/*")}
+    data = {element.tag: (element.text or "").strip() for element in root.iterfind("data/AwsAssetDataConnector/*")}
+    return criteria, preferences, data
+
+
+class QualysRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, which Nagle's algorithm would delay on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_xml(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        emulator = self.server.emulator
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.startswith("/slack"):
+            emulator.record("slack")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+            return
+        match = ENDPOINT_PATTERN.match(self.path.split("?")[0])
+        if match is None:
+            self.send_xml(404, service_response_xml([], response_code="NOT_FOUND"))
+            return
+        action = match.group("action")
+        emulator.record(action)
+        admitted, headers = emulator.admit()
+        if not admitted:
+            emulator.record("throttled")
+            self.send_xml(409, service_response_xml([], response_code="TOO_MANY_REQUESTS"), headers)
+            return
+        try:
+            emulator.delay()
+            if emulator.should_fail():
+                emulator.record("errors")
+                self.send_xml(503, service_response_xml([], response_code="SERVICE_UNAVAILABLE"), headers)
+                return
+            try:
+                criteria, preferences, data = parse_service_request(body)
+                status, response = getattr(self, f"handle_{action}")(emulator.store, match, criteria, preferences,
+                                                                     data)
+            except (StdET.ParseError, ValueError) as err:
+                status, response = 400, service_response_xml([], response_code=f"INVALID_REQUEST: {err}")
+            self.send_xml(status, response, headers)
+        finally:
+            emulator.release()
+
+    def handle_search(self, store, match, criteria, preferences, data):
+        start_offset = max(int(preferences.get("startFromOffset") or 1), 1)
+        limit_results = min(int(preferences.get("limitResults") or 100), MAX_LIMIT_RESULTS)
+        found = store.search(criteria)
+        page = found[start_offset - 1:start_offset - 1 + limit_results]
+        has_more_records = start_offset - 1 + len(page) < len(found)
+        return 200, service_response_xml([render_connector(fields) for fields in page],
+                                         has_more_records=has_more_records,
+                                         last_id=page[-1]["id"] if page else None)
+
+    def handle_create(self, store, match, criteria, preferences, data):
+        if not data.get("name"):
+            raise ValueError("The connector name is required")
+        fields = store.create(data["name"], external_id=data.get("externalId"), all_regions=data.get("allRegions"))
+        return 200, service_response_xml([render_connector(fields)])
+
+    def handle_update(self, store, match, criteria, preferences, data):
+        fields = store.update(match.group("id"), arn=data.get("arn"), disabled=data.get("disabled"))
+        if fields is None:
+            return 404, service_response_xml([], response_code="NOT_FOUND")
+        return 200, service_response_xml([render_connector(fields)])
+
+    def handle_get(self, store, match, criteria, preferences, data):
+        fields = store.get(match.group("id"))
+        if fields is None:
+            return 404, service_response_xml([], response_code="NOT_FOUND")
+        return 200, service_response_xml([render_connector(fields)])
+
+    def handle_delete(self, store, match, criteria, preferences, data):
+        if not criteria:
+            raise ValueError("Deleting requires filters")
+        deleted = store.delete(criteria)
+        return 200, service_response_xml([f"<AwsAssetDataConnector><id>{connector_id}</id></AwsAssetDataConnector>"
+                                          for connector_id in deleted])
+
+
+class QualysEmulator:
+    """
+    Class that represents the emulated Qualys API server, served by a background thread.
+
+    Attributes:
+        store (ConnectorStore): The connectors of the emulated subscription.
+        requests (Counter): Number of requests received per action ('search', 'create', ..., 'slack'), of injected
+         errors ('errors') and of requests rejected for exceeding a limit ('throttled').
+        max_running (int): Highest number of API requests processed at once.
+    """
+
+    def __init__(self, connectors=0, latency=0.0, error_rate=0.0, activation_delay=0.0, host="127.0.0.1", port=0,
+                 seed=None, rate_limit=None, rate_window=60, concurrency_limit=None):
+        """
+        Constructor method of class QualysEmulator.
+
+        Args:
+            connectors (int): Number of activated connectors the subscription starts with. Defaults to 0.
+            latency (float): Mean delay, in seconds, added to each API request. Defaults to 0.
+            error_rate (float): Fraction of the API requests answered with a 503. Defaults to 0.
+            activation_delay (float): Seconds an activated connector stays in the transitional states. Defaults to 0.
+            host (str): Address the server listens on. Defaults to '127.0.0.1'.
+            port (int): Port the server listens on. Defaults to 0 (any free port).
+            seed (int): Seed of the latency and error generator, for reproducible runs. Defaults to None.
+            rate_limit (int): Number of API requests allowed per window. Defaults to None (unlimited).
+            rate_window (float): Length, in seconds, of the rate limit window. Defaults to 60.
+            concurrency_limit (int): Number of API requests processed at once. Defaults to None (unlimited).
+        """
+        self.store = ConnectorStore(connectors, activation_delay)
+        self.requests = Counter()
+        self.max_running = 0
+        self.__rate_limit = rate_limit
+        self.__rate_window = rate_window
+        self.__concurrency_limit = concurrency_limit
+        self.__window_end = 0
+        self.__window_count = 0
+        self.__running = 0
+        self.__latency = latency
+        self.__error_rate = error_rate
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__server = ThreadingHTTPServer((host, port), QualysRequestHandler)
+        self.__server.daemon_threads = True
+        self.__server.emulator = self
+        self.__thread = None
+
+    @property
+    def host(self):
+        """
+        Read-only property. Returns the address of the server, as expected by QualysClient, eg: '127.0.0.1:8080'.
+        """
+        host, port = self.__server.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def slack_webhook_url(self):
+        return f"http://{self.host}/slack/webhook"
+
+    def record(self, name):
+        with self.__lock:
+            self.requests[name] += 1
+
+    def delay(self):
+        if self.__latency > 0:
+            with self.__lock:
+                delay = self.__latency * self.__random.uniform(0.5, 1.5)
+            time.sleep(delay)
+
+    def admit(self):
+        """
+        Applies the rate and concurrency limits to an API request, which must be released once answered if admitted.
+
+        Returns:
+            (tuple): (admitted, headers), whether the request is processed and the limit headers of its response.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            if now >= self.__window_end:
+                self.__window_end = now + self.__rate_window
+                self.__window_count = 0
+            to_wait = 0
+            if self.__rate_limit is not None and self.__window_count >= self.__rate_limit:
+                to_wait = max(int(self.__window_end - now + 0.999), 1)
+            admitted = to_wait == 0 and (self.__concurrency_limit is None or self.__running < self.__concurrency_limit)
+            if admitted:
+                self.__window_count += 1
+                self.__running += 1
+                self.max_running = max(self.max_running, self.__running)
+            headers = {}
+            if self.__rate_limit is not None:
+                headers.update({
+                    "X-RateLimit-Limit": self.__rate_limit,
+                    "X-RateLimit-Window-Sec": self.__rate_window,
+                    "X-RateLimit-Remaining": max(self.__rate_limit - self.__window_count, 0),
+                    "X-RateLimit-ToWait-Sec": to_wait,
+                })
+            if self.__concurrency_limit is not None:
+                headers.update({
+                    "X-Concurrency-Limit-Limit": self.__concurrency_limit,
+                    "X-Concurrency-Limit-Running": self.__running,
+                })
+        return admitted, headers
+
+    def release(self):
+        with self.__lock:
+            self.__running -= 1
+
+    def should_fail(self):
+        with self.__lock:
+            return self.__random.random() < self.__error_rate
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="qualys-emulator", daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--connectors", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--activation-delay", type=float, default=0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--rate-limit", type=int)
+    parser.add_argument("--rate-window", type=float, default=60)
+    parser.add_argument("--concurrency-limit", type=int)
+    args = parser.parse_args()
+
+    emulator = QualysEmulator(connectors=args.connectors, latency=args.latency_ms / 1000, error_rate=args.error_rate,
+                              activation_delay=args.activation_delay, host=args.host, port=args.port, seed=args.seed,
+                              rate_limit=args.rate_limit, rate_window=args.rate_window,
+                              concurrency_limit=args.concurrency_limit)
+    print(f"Qualys emulator listening on http://{emulator.host} with {len(emulator.store)} connectors")
+    with emulator:
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
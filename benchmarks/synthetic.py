@@ -0,0 +1,116 @@
+"""Synthetic Qualys responses used by the benchmarks and the Qualys emulator."""
+from xml.sax.saxutils import escape
+
+# Elements of an AwsAssetDataConnector, in the order Qualys returns them. The values of the nested ones (NESTED_FIELDS)
+# are kept as XML, the others as text.
+CONNECTOR_FIELDS = ("id", "name", "awsAccountId", "lastSync", "lastError", "connectorState", "type", "defaultTags",
+                    "disabled", "isGovCloudConfigured", "isChinaConfigured", "isDeleted", "arn", "externalId",
+                    "qualysAwsAccountId", "authRecord", "allRegions")
+NESTED_FIELDS = ("defaultTags", "authRecord")
+
+
+def connector_fields(index):
+    """
+    Builds the fields of one activated connector.
+
+    Args:
+        index (int): Number of the connector, used to derive its ID, name and account ID.
+
+    Returns:
+        (dict): Maps the AwsAssetDataConnector element names to their values.
+    """
+    account_id = 100000000000 + index
+    return {
+        "id": str(1000000 + index),
+        "name": f"account-{index}-prd",
+        "awsAccountId": str(account_id),
+        "lastSync": "2022-07-21T22:40:08.000+0000",
+        "lastError": "None",
+        "connectorState": "FINISHED_SUCCESS",
+        "type": "AWS",
+        "defaultTags": "<list><TagSimple><id>1234</id><name>Cloud Agent</name></TagSimple></list>",
+        "disabled": "false",
+        "isGovCloudConfigured": "false",
+        "isChinaConfigured": "false",
+        "isDeleted": "false",
+        "arn": f"arn:aws:iam::{account_id}:role/Role_For_QualysEC2Connector",
+        "externalId": str(1658443190235 + index),
+        "qualysAwsAccountId": "205767712438",
+        "authRecord": "<id>5</id>",
+        "allRegions": "true",
+    }
+
+
+def render_connector(fields):
+    """
+    Renders one AwsAssetDataConnector element. Fields that are missing or None are omitted, as Qualys does.
+
+    Args:
+        fields (dict): Maps the element names to their values, as returned by connector_fields.
+
+    Returns:
+        (str): The AwsAssetDataConnector XML element.
+    """
+    elements = []
+    for field in CONNECTOR_FIELDS:
+        value = fields.get(field)
+        if value is None:
+            continue
+        elements.append(f"<{field}>{value if field in NESTED_FIELDS else escape(value)}</{field}>")
+    return f"<AwsAssetDataConnector>{''.join(elements)}</AwsAssetDataConnector>"
+
+
+def connector_xml(index):
+    """
+    Renders one AwsAssetDataConnector element, with every field Qualys returns for an activated connector.
+
+    Args:
+        index (int): Number of the connector, used to derive its ID, name and account ID.
+
+    Returns:
+        (str): The AwsAssetDataConnector XML element.
+    """
+    return render_connector(connector_fields(index))
+
+
+def service_response_xml(connectors, response_code="SUCCESS", has_more_records=None, last_id=None):
+    """
+    Renders a ServiceResponse holding already rendered connectors.
+
+    Args:
+        connectors (list): The AwsAssetDataConnector XML elements.
+        response_code (str): Value of the responseCode element. Defaults to 'SUCCESS'.
+        has_more_records (bool): Value of the hasMoreRecords element. Defaults to None (element omitted).
+        last_id (str): Value of the lastId element. Defaults to None (element omitted).
+
+    Returns:
+        (bytes): The ServiceResponse XML.
+    """
+    metadata = f"<responseCode>{response_code}</responseCode><count>{len(connectors)}</count>"
+    if has_more_records is not None:
+        metadata += f"<hasMoreRecords>{'true' if has_more_records else 'false'}</hasMoreRecords>"
+    if last_id is not None:
+        metadata += f"<lastId>{last_id}</lastId>"
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<ServiceResponse xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        f"{metadata}"
+        f"<data>{''.join(connectors)}</data>"
+        "</ServiceResponse>"
+    ).encode()
+
+
+def search_response_xml(count, first_index=0, has_more_records=False):
+    """
+    Renders a search ServiceResponse holding a page of synthetic connectors.
+
+    Args:
+        count (int): Number of connectors in the page.
+        first_index (int): Index of the first connector of the page. Defaults to 0.
+        has_more_records (bool): Value of the hasMoreRecords element. Defaults to False.
+
+    Returns:
+        (bytes): The ServiceResponse XML.
+    """
+    connectors = [connector_xml(index) for index in range(first_index, first_index + count)]
+    return service_response_xml(connectors, has_more_records=has_more_records)
@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import tracing
+
+
+class QualysClientPool:
+    """
+    Class that represents the Qualys subscriptions the accounts of the organization are split across (eg: one per
+     business unit, possibly on different Qualys platforms), with one QualysClient each, and the routes that tell which
+     subscription an account belongs to.
+
+    A route matches an account by the prefix of its name ('name_prefix'), by an organizational unit it is in ('ou',
+     the ID of its parent OU or of any OU above it) or by its tags ('tags', all of which must be set on the account).
+     The first matching route wins, and accounts matched by none belong to the default subscription. The OUs and tags of
+     an account are only requested from Organizations when a route needs them, and the route of each account is
+     cached.
+
+    Attributes:
+        __clients (dict): Maps the subscription names to their QualysClient, or to a function building it on first use.
+        __routes (list): The routes, as dicts with a 'subscription' key and the keys they match on.
+        __default (str): Name of the subscription of the accounts not matched by any route.
+        __routed (dict): Maps the account IDs to the name of their subscription.
+    """
+
+    def __init__(self, clients, routes=None, default=None, organizations_client=None):
+        """
+        Constructor method of class QualysClientPool.
+
+        Args:
+            clients (dict): Maps the subscription names to their QualysClient, or to a function without arguments
+             that builds it, so only the subscriptions used by the invocation have their client built.
+            routes (list): The routes, eg: [{"subscription": "retail", "name_prefix": "retail-"}, {"subscription":
+             "bank", "ou": "ou-ab12-cd34ef56"}, {"subscription": "bank", "tags": {"BusinessUnit": "Bank"}}].
+             Defaults to None (every account belongs to the default subscription).
+            default (str): Name of the subscription of the accounts not matched by any route. Defaults to the first
+             subscription.
+            organizations_client: The Organizations client used to read the OUs and tags of the accounts. Defaults to
+             the client of the process (see role_assignment).
+        """
+        if not clients:
+            raise ValueError("The pool needs at least one subscription")
+        self.__clients = dict(clients)
+        self.__routes = list(routes or [])
+        self.__default = default if default is not None else next(iter(self.__clients))
+        for subscription in [self.__default] + [route["subscription"] for route in self.__routes]:
+            if subscription not in self.__clients:
+                raise ValueError(f"Unknown Qualys subscription {subscription}")
+        self.__organizations_client = organizations_client
+        self.__routed = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def subscriptions(self):
+        """
+        Read-only property. Returns the names of the subscriptions, the default one first.
+
+        Returns:
+            (list): The subscription names.
+        """
+        return [self.__default] + [name for name in self.__clients if name != self.__default]
+
+    def client(self, subscription=None):
+        """
+        Returns the client of a subscription, building it on the first call.
+
+        Args:
+            subscription (str): The name of the subscription. Defaults to the default subscription.
+
+        Returns:
+            (QualysClient): The client.
+        """
+        subscription = subscription if subscription is not None else self.__default
+        with self.__lock:
+            client = self.__clients[subscription]
+            if callable(client):
+                client = self.__clients[subscription] = client()
+            return client
+
+    def route(self, account_name, account_id):
+        """
+        Returns the subscription an account belongs to.
+
+        Args:
+            account_name (str): The name of the account.
+            account_id (str): The ID of the account.
+
+        Returns:
+            (str): The name of the subscription.
+        """
+        with self.__lock:
+            if account_id in self.__routed:
+                return self.__routed[account_id]
+        account = {"name": account_name or "", "id": account_id}
+        subscription = next((route["subscription"] for route in self.__routes if self.__matches(route, account)),
+                            self.__default)
+        with self.__lock:
+            self.__routed[account_id] = subscription
+        return subscription
+
+    def client_for(self, account_name, account_id):
+        """
+        Returns the client of the subscription an account belongs to.
+
+        Args:
+            account_name (str): The name of the account.
+            account_id (str): The ID of the account.
+
+        Returns:
+            (QualysClient): The client.
+        """
+        return self.client(self.route(account_name, account_id))
+
+    def map(self, function):
+        """
+        Runs a function with the client of each subscription, concurrently, so the time taken is the one of the
+         slowest subscription, not the sum of all of them.
+
+        Args:
+            function: Function that receives a QualysClient, eg: lambda client: client.get_aws_connector_by_name(name).
+
+        Returns:
+            (dict): Maps the subscription names to the result of the function.
+
+        Raises:
+            Exception: the error raised by the function for a subscription, once all of them are done.
+        """
+        subscriptions = self.subscriptions
+        if len(subscriptions) == 1:
+            return {subscriptions[0]: function(self.client(subscriptions[0]))}
+        with ThreadPoolExecutor(max_workers=len(subscriptions), thread_name_prefix="qualys-pool") as executor:
+            futures = {subscription: executor.submit(tracing.propagate(self.__run), function, subscription)
+                       for subscription in subscriptions}
+        return {subscription: future.result() for subscription, future in futures.items()}
+
+    def __run(self, function, subscription):
+        with tracing.span("subscription", Subscription=subscription):
+            return function(self.client(subscription))
+
+    def find_connectors(self, account_id):
+        """
+        Looks for the connectors of an AWS account in every subscription, concurrently.
+
+        Args:
+            account_id (str): The ID of the AWS account.
+
+        Returns:
+            (dict): Maps the names of the subscriptions where the account has connectors to the list of them.
+        """
+        found = self.map(lambda client: client.get_aws_connectors_by_account_id(account_id))
+        return {subscription: connectors for subscription, connectors in found.items() if connectors}
+
+    def __matches(self, route, account):
+        if "name_prefix" in route and not account["name"].startswith(route["name_prefix"]):
+            return False
+        if "ou" in route and route["ou"] not in self.__get_account_detail(account, "ous", self.__list_ous):
+            return False
+        if "tags" in route:
+            tags = self.__get_account_detail(account, "tags", self.__list_tags)
+            if any(tags.get(key) != value for key, value in route["tags"].items()):
+                return False
+        return True
+
+    @staticmethod
+    def __get_account_detail(account, key, load):
+        if key not in account:
+            account[key] = load(account["id"])
+        return account[key]
+
+    def __get_organizations_client(self):
+        if self.__organizations_client is None:
+            from role_assignment import get_boto_client
+            self.__organizations_client = get_boto_client('organizations')
+        return self.__organizations_client
+
+    def __list_ous(self, account_id):
+        ous = set()
+        child_id = account_id
+        while True:
+            parents = self.__get_organizations_client().list_parents(ChildId=child_id)["Parents"]
+            if not parents or parents[0]["Type"] != "ORGANIZATIONAL_UNIT":
+                return ous
+            child_id = parents[0]["Id"]
+            ous.add(child_id)
+
+    def __list_tags(self, account_id):
+        paginator = self.__get_organizations_client().get_paginator('list_tags_for_resource')
+        return {tag["Key"]: tag["Value"] for page in paginator.paginate(ResourceId=account_id) for tag in page["Tags"]}
+
+
+def pool_from_environment(build_client):
+    """
+    Builds the client pool configured by the QUALYS_SUBSCRIPTIONS environment variable, a JSON document such as:
+     {"subscriptions": {"retail": {"api_server_url": "qualysapi.qg2.apps.qualys.com", "credentials_prefix":
+     "QUALYS_RETAIL"}, ...}, "routes": [{"subscription": "retail", "name_prefix": "retail-"}, ...], "default": "retail"}
+     Without it, the pool has a single 'default' subscription, on QUALYS_API_SERVER_URL (default
+     'qualysapi.qg3.apps.qualys.com') with the QUALYS_* credentials.
+
+    Args:
+        build_client: Function that receives the name and the settings (dict) of a subscription and returns its
+         QualysClient. Called on the first use of the subscription.
+
+    Returns:
+        (QualysClientPool): The client pool.
+    """
+    configuration = json.loads(os.environ.get("QUALYS_SUBSCRIPTIONS") or "null") or {"subscriptions": {"default": {
+        "api_server_url": os.environ.get("QUALYS_API_SERVER_URL", "qualysapi.qg3.apps.qualys.com")}}}
+    clients = {name: (lambda name=name, settings=settings: build_client(name, settings))
+               for name, settings in configuration["subscriptions"].items()}
+    return QualysClientPool(clients, configuration.get("routes"), configuration.get("default"))
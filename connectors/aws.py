@@ -1,3 +1,95 @@
+from datetime import datetime
+import sys
+
+_UNPARSED = object()
+# Connector states Qualys reports while it is still processing a change, eg: right after the connector is activated.
+TRANSITIONAL_STATES = frozenset(("PENDING", "QUEUED", "RUNNING", "PROCESSING"))
+
+
+def parse_bool(value):
+    """
+    Parses a Qualys boolean value.
+
+    Args:
+        value: 'true' or 'false' (as sent by Qualys), a bool, or None.
+
+    Returns:
+        (bool): The parsed value. None if no value was sent.
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    return value.strip().lower() == "true"
+
+
+def parse_datetime(value):
+    """
+    Parses a Qualys datetime value, eg: '2022-07-21T22:40:08.000+0000'.
+
+    Args:
+        value: the datetime as sent by Qualys, a datetime, or None.
+
+    Returns:
+        (datetime): The parsed, timezone aware, datetime. None if no value was sent or it could not be parsed.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    for datetime_format in ("%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z"):
+        try:
+            return datetime.strptime(value, datetime_format)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def format_value(value):
+    """
+    Converts a typed value back to the text sent by Qualys, eg: True to 'true'.
+
+    Args:
+        value: the value to be converted.
+
+    Returns:
+        (str): The value as text. None if value is None.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}" + value.strftime("%z")
+    return str(value)
+
+
+class LazyField:
+    """
+    Descriptor that keeps the raw text of a connector field and parses it only on first access. The parsed value is
+     stored in the instance, so following accesses are plain attribute reads.
+    """
+
+    __slots__ = ("raw_slot", "value_slot", "parser")
+
+    def __init__(self, raw_slot, parser):
+        self.raw_slot = raw_slot
+        self.value_slot = f"{raw_slot}_value"
+        self.parser = parser
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = getattr(instance, self.value_slot)
+        if value is _UNPARSED:
+            value = self.parser(getattr(instance, self.raw_slot))
+            setattr(instance, self.value_slot, value)
+        return value
+
+    def __set__(self, instance, value):
+        setattr(instance, self.raw_slot, format_value(value))
+        setattr(instance, self.value_slot, _UNPARSED if isinstance(value, str) else value)
+
+
 class AWSConnector:
     """
     Class that represents the AWS EC2 Connector on Qualys.
@@ -5,44 +97,194 @@ class AWSConnector:
     Attributes:
         id (str): The AWS EC2 connector ID on Qualys.
         name (str):The name for AWS EC2 connector ID on Qualys.
-        aws_account_id (str): The AWS Account ID which the connector is related.
-        last_sync (str): The datetime of the last sync.
-        last_error (str): The description of the last error.
+        aws_account_id (str): The AWS Account ID which the connector is related. None if not set yet.
+        last_sync (datetime): The datetime of the last sync. None if the connector never synced.
+        last_error (str): The description of the last error, if any.
         connector_state (str): The current state of the connector.
         type (str): The cloud provider. In this class, with always be 'AWS'.
-        default_tags (str): json string containing the tags set at the connector (if there is some).
-        disabled (str): Boolean value as string. Should be 'true' or 'false' depending on the state of the connector.
-        is_gov_cloud_configured (str): Boolean value as str. 'true' if the account is governamental, 'false' otherwise.
-        is_china_configured (str): Boolean value as str. 'true' if the account is chinese, 'false' otherwise.
-        is_deleted (str): Boolean value as string. 'true' if the account was deleted, 'false' otherwise.
+        default_tags (dict): the tags set at the connector (if there is some).
+        disabled (bool): True if the connector is disabled, False otherwise.
+        is_gov_cloud_configured (bool): True if the account is governamental, False otherwise.
+        is_china_configured (bool): True if the account is chinese, False otherwise.
+        is_deleted (bool): True if the account was deleted, False otherwise.
         arn (str): The role arn configured on the connector.
         external_id (str): The external ID of the connector, used when setting the Role on AWS.
         qualys_aws_accountid (str): ID for the AWS Account, but inside Qualys view.
-        auth_record (str): str(authrecord)
-        all_regions (str): Boolean as str. 'true' if the connector was configured to scan all regions, 'false' if not.
+        auth_record (str): The auth record of the connector, if any.
+        all_regions (bool): True if the connector was configured to scan all regions, False if not.
+
+    The datetime and boolean fields are kept as the text sent by Qualys and parsed on first access. The class uses
+     __slots__, so a full inventory of connectors can be kept in memory, and connectors are compared and hashed by ID.
 
     """
 
-    def __init__(self, id, name, awsaccountid, lastsync, lasterror, connectorstate, type, defaulttags, disabled,
-                 isgovcloudconfigured, ischinaconfigured, isdeleted, arn, externalid, qualysawsaccountid, authrecord,
-                 allregions):
-        self.id = str(id)
-        self.name = str(name)
-        self.aws_account_id = str(awsaccountid)
-        self.last_sync = str(lastsync)
-        self.last_error = str(lasterror)
-        self.connector_state = str(connectorstate)
-        self.type = str(type)
-        self.default_tags = str(defaulttags)
-        self.disabled = str(disabled)
-        self.is_gov_cloud_configured = str(isgovcloudconfigured)
-        self.is_china_configured = str(ischinaconfigured)
-        self.is_deleted = str(isdeleted)
-        self.arn = str(arn)
-        self.external_id = str(externalid)
-        self.qualys_aws_accountid = str(qualysawsaccountid)
-        self.auth_record = str(authrecord)
-        self.all_regions = str(allregions)
+    # Maps the AwsAssetDataConnector child elements to the position of the constructor argument they fill.
+    xml_fields = {
+        "id": 0,
+        "name": 1,
+        "awsAccountId": 2,
+        "lastSync": 3,
+        "lastError": 4,
+        "connectorState": 5,
+        "type": 6,
+        "defaultTags": 7,
+        "disabled": 8,
+        "isGovCloudConfigured": 9,
+        "isChinaConfigured": 10,
+        "isDeleted": 11,
+        "arn": 12,
+        "externalId": 13,
+        "qualysAwsAccountId": 14,
+        "authRecord": 15,
+        "allRegions": 16
+    }
+
+    __slots__ = (
+        "id", "name", "aws_account_id", "_last_sync", "_last_sync_value", "last_error", "connector_state", "type",
+        "default_tags", "_disabled", "_disabled_value", "_is_gov_cloud_configured", "_is_gov_cloud_configured_value",
+        "_is_china_configured", "_is_china_configured_value", "_is_deleted", "_is_deleted_value", "arn", "external_id",
+        "qualys_aws_accountid", "auth_record", "_all_regions", "_all_regions_value"
+    )
+
+    last_sync = LazyField("_last_sync", parse_datetime)
+    disabled = LazyField("_disabled", parse_bool)
+    is_gov_cloud_configured = LazyField("_is_gov_cloud_configured", parse_bool)
+    is_china_configured = LazyField("_is_china_configured", parse_bool)
+    is_deleted = LazyField("_is_deleted", parse_bool)
+    all_regions = LazyField("_all_regions", parse_bool)
+
+    def __init__(self, id, name, awsaccountid=None, lastsync=None, lasterror=None, connectorstate=None, type=None,
+                 defaulttags=None, disabled=None, isgovcloudconfigured=None, ischinaconfigured=None, isdeleted=None,
+                 arn=None, externalid=None, qualysawsaccountid=None, authrecord=None, allregions=None):
+        intern = AWSConnector.__intern
+        lazy = AWSConnector.__lazy
+        self.id = None if id is None else str(id)
+        self.name = name
+        self.aws_account_id = awsaccountid
+        self._last_sync, self._last_sync_value = lazy(lastsync)
+        self.last_error = lasterror
+        self.connector_state = intern(connectorstate)
+        self.type = intern(type)
+        self.default_tags = defaulttags
+        self._disabled, self._disabled_value = lazy(intern(disabled))
+        self._is_gov_cloud_configured, self._is_gov_cloud_configured_value = lazy(intern(isgovcloudconfigured))
+        self._is_china_configured, self._is_china_configured_value = lazy(intern(ischinaconfigured))
+        self._is_deleted, self._is_deleted_value = lazy(intern(isdeleted))
+        self.arn = arn
+        self.external_id = externalid
+        self.qualys_aws_accountid = intern(qualysawsaccountid)
+        self.auth_record = authrecord
+        self._all_regions, self._all_regions_value = lazy(intern(allregions))
+
+    @staticmethod
+    def __lazy(value):
+        # Returns the (raw, parsed) pair stored by a LazyField, without going through the descriptor.
+        if value is None:
+            return None, None
+        if isinstance(value, str):
+            return value, _UNPARSED
+        return format_value(value), value
+
+    @staticmethod
+    def __intern(value):
+        # The values of these fields repeat across all the connectors, so they are shared instead of copied.
+        return sys.intern(value) if isinstance(value, str) else value
+
+    @classmethod
+    def from_element(cls, element):
+        """
+        Builds a connector from an AwsAssetDataConnector XML element, walking its children only once. Fields missing
+         from the element are set to None.
+
+        Args:
+            element (Element): The AwsAssetDataConnector element (from xml.etree or lxml).
+
+        Returns:
+            (AWSConnector): The decoded connector.
+        """
+        xml_fields = cls.xml_fields
+        values = [None] * len(xml_fields)
+        for field in element:
+            position = xml_fields.get(field.tag)
+            if position is None:
+                continue
+            if position == 7:
+                values[position] = cls.__decode_default_tags(field)
+            else:
+                values[position] = field.text
+        return cls(*values)
+
+    @staticmethod
+    def __decode_default_tags(default_tags):
+        tag = default_tags.find("list/TagSimple")
+        if tag is None:
+            return None
+        return {
+            "list": {
+                "TagSimple": {
+                    "id": tag.findtext("id"),
+                    "name": tag.findtext("name")
+                }
+            }
+        }
+
+    def to_row(self):
+        """
+        Returns the constructor arguments of the connector, with the fields as sent by Qualys (eg: 'true' instead of
+         True), so AWSConnector(*row) rebuilds it. Used to store connectors compactly, eg: as a JSON array.
+
+        Returns:
+            (tuple): The arguments, in the order of xml_fields.
+        """
+        return (self.id, self.name, self.aws_account_id, self._last_sync, self.last_error, self.connector_state,
+                self.type, self.default_tags, self._disabled, self._is_gov_cloud_configured, self._is_china_configured,
+                self._is_deleted, self.arn, self.external_id, self.qualys_aws_accountid, self.auth_record,
+                self._all_regions)
+
+    @property
+    def in_transition(self):
+        """
+        Read-only property. Returns whether Qualys is still processing a change of the connector.
+
+        Returns:
+            (bool): True if the connector state is transitional, False if it is final.
+        """
+        return self.connector_state in TRANSITIONAL_STATES
+
+    def to_dict(self):
+        """
+        Converts the connector to a dictionary of typed values, keyed by the attribute names.
+
+        Returns:
+            (dict): The connector attributes, eg: {'id': '123', 'name': 'my-account-prd', 'disabled': False, ...}.
+        """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "aws_account_id": self.aws_account_id,
+            "last_sync": self.last_sync,
+            "last_error": self.last_error,
+            "connector_state": self.connector_state,
+            "type": self.type,
+            "default_tags": self.default_tags,
+            "disabled": self.disabled,
+            "is_gov_cloud_configured": self.is_gov_cloud_configured,
+            "is_china_configured": self.is_china_configured,
+            "is_deleted": self.is_deleted,
+            "arn": self.arn,
+            "external_id": self.external_id,
+            "qualys_aws_accountid": self.qualys_aws_accountid,
+            "auth_record": self.auth_record,
+            "all_regions": self.all_regions
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, AWSConnector):
+            return NotImplemented
+        return self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
 
     def __repr__(self):
         """Real representation of the object.
@@ -51,10 +293,10 @@ class AWSConnector:
             (str): The object representation, eg: AWSConnector(id, name, aws_account_id, last_sync, last_error...).
 
         """
-        return f"{self.__class__.__name__}({self.id}, {self.name}, {self.aws_account_id}, {self.last_sync}," \
-               f" {self.last_error}, {self.connector_state}, {self.type}, {self.default_tags}, {self.disabled}," \
-               f"{self.is_gov_cloud_configured}, {self.is_china_configured}, {self.is_deleted}, {self.arn}," \
-               f"{self.external_id}, {self.aws_account_id}, {self.auth_record}, {self.all_regions})"
+        return f"{self.__class__.__name__}({self.id}, {self.name}, {self.aws_account_id}, {self._last_sync}," \
+               f" {self.last_error}, {self.connector_state}, {self.type}, {self.default_tags}, {self._disabled}," \
+               f"{self._is_gov_cloud_configured}, {self._is_china_configured}, {self._is_deleted}, {self.arn}," \
+               f"{self.external_id}, {self.aws_account_id}, {self.auth_record}, {self._all_regions})"
 
     def __str__(self):
         """Human-readable string of the object. When using print(<connector_object>), the output will look like that.
@@ -66,21 +308,21 @@ class AWSConnector:
 
         colum_width = 30
         fill_char = " "
-        ljust = lambda text: text.ljust(colum_width, fill_char)
+        ljust = lambda text: str(text).ljust(colum_width, fill_char)
         return ljust("ID:") + ljust(self.id) + "\n" + \
                ljust("Name:") + ljust(self.name) + "\n" + \
                ljust("AWS account ID:") + ljust(self.aws_account_id) + "\n" + \
-               ljust("Last sync:") + ljust(self.last_sync) + "\n" + \
+               ljust("Last sync:") + ljust(self._last_sync) + "\n" + \
                ljust("Last error:") + ljust(self.last_error) + "\n" + \
                ljust("Connector state:") + ljust(self.connector_state) + "\n" + \
                ljust("Type:") + ljust(self.type) + "\n" + \
                ljust("Default tags:") + ljust(self.default_tags) + "\n" + \
-               ljust("Disabled:") + ljust(self.disabled) + "\n" + \
-               ljust("Is Gov Cloud configured:") + ljust(self.is_gov_cloud_configured) + "\n" + \
-               ljust("Is Chine configured:") + ljust(self.is_china_configured) + "\n" + \
-               ljust("Is deleted:") + ljust(self.is_deleted) + "\n" + \
+               ljust("Disabled:") + ljust(self._disabled) + "\n" + \
+               ljust("Is Gov Cloud configured:") + ljust(self._is_gov_cloud_configured) + "\n" + \
+               ljust("Is Chine configured:") + ljust(self._is_china_configured) + "\n" + \
+               ljust("Is deleted:") + ljust(self._is_deleted) + "\n" + \
                ljust("ARN:") + ljust(self.arn) + "\n" + \
                ljust("External ID:") + ljust(self.external_id) + "\n" + \
                ljust("Qualys AWS account ID:") + ljust(self.qualys_aws_accountid) + "\n" + \
                ljust("Auth record:") + ljust(self.auth_record) + "\n" + \
-               ljust("All regions:") + ljust(self.all_regions)
+               ljust("All regions:") + ljust(self._all_regions)
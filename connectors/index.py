@@ -0,0 +1,101 @@
+import threading
+import time
+
+
+class AWSConnectorIndex:
+    """
+    In-memory index of AWS EC2 Connectors by name and by ID, with time based invalidation. Meant to live as long as
+     the QualysClient that owns it, so lookups repeated inside one invocation, or across warm invocations of the
+     Lambda, can be answered without requesting Qualys again.
+
+    Attributes:
+        __ttl (float): Number of seconds an indexed connector is considered fresh.
+        __by_name (dict): Maps connector names to (expiration, connector) tuples.
+        __by_id (dict): Maps connector IDs to (expiration, connector) tuples.
+    """
+
+    def __init__(self, ttl=300):
+        """
+        Constructor method of class AWSConnectorIndex.
+
+        Args:
+            ttl (float): Number of seconds an indexed connector is considered fresh. Defaults to 300.
+        """
+        self.__ttl = ttl
+        self.__by_name = {}
+        self.__by_id = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__by_id)
+
+    def add(self, connector):
+        """
+        Indexes a connector by its name and ID, replacing any previous entry for them.
+
+        Args:
+            connector (AWSConnector): The connector to be indexed.
+        """
+        entry = (time.monotonic() + self.__ttl, connector)
+        with self.__lock:
+            self.__by_name[connector.name] = entry
+            self.__by_id[connector.id] = entry
+
+    def get_by_name(self, connector_name):
+        """
+        Returns the indexed connector with the given name, if it is still fresh.
+
+        Args:
+            connector_name (str): The name of the connector.
+
+        Returns:
+            connector (AWSConnector): The indexed connector. None if it is not indexed or has expired.
+        """
+        with self.__lock:
+            return self.__get_fresh(self.__by_name.get(connector_name))
+
+    def get_by_id(self, connector_id):
+        """
+        Returns the indexed connector with the given ID, if it is still fresh.
+
+        Args:
+            connector_id (str): The ID of the connector.
+
+        Returns:
+            connector (AWSConnector): The indexed connector. None if it is not indexed or has expired.
+        """
+        with self.__lock:
+            return self.__get_fresh(self.__by_id.get(str(connector_id)))
+
+    def invalidate(self, connector_name=None, connector_id=None):
+        """
+        Removes a connector from the index, given its name or its ID. Both keys of the connector are removed.
+
+        Args:
+            connector_name (str): The name of the connector.
+            connector_id (str): The ID of the connector.
+        """
+        with self.__lock:
+            entries = [self.__by_name.get(connector_name), self.__by_id.get(str(connector_id))]
+            for entry in entries:
+                if entry is not None:
+                    self.__discard(entry[1])
+
+    def clear(self):
+        """Removes all the connectors from the index."""
+        with self.__lock:
+            self.__by_name.clear()
+            self.__by_id.clear()
+
+    def __get_fresh(self, entry):
+        if entry is None:
+            return None
+        expiration, connector = entry
+        if expiration < time.monotonic():
+            self.__discard(connector)
+            return None
+        return connector
+
+    def __discard(self, connector):
+        self.__by_name.pop(connector.name, None)
+        self.__by_id.pop(connector.id, None)
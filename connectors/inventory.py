@@ -0,0 +1,246 @@
+from connectors.aws import AWSConnector
+import json
+import sqlite3
+import threading
+import time
+
+
+class ConnectorInventory:
+    """
+    Class that represents a local copy of the connectors of the Qualys subscription, stored in a SQLite database. It
+     lives in the /tmp of the execution environment, so it survives warm invocations of the Lambda, and it is kept up
+     to date incrementally: only the connectors created or synced since the last sync are requested, and the whole
+     inventory is downloaded again only when the database was written by another version (SCHEMA_VERSION) or the
+     full_sync_ttl expired.
+
+    Qualys has no 'last updated' field, so the incremental syncs request the connectors whose ID is greater than the
+     greatest ID stored (the created ones) and the connectors whose lastSync is after the watermark (the synced ones).
+     Deletions and changes that do not update lastSync are only seen by the next full sync, unless they were made
+     through the QualysClient owning the inventory, which updates it.
+
+    A full sync downloads the connectors into a staging table, taking the lock for each batch only, so the inventory
+     can still be read while they are downloaded. The staging table then replaces the connectors in one short
+     transaction. The connectors added or discarded meanwhile are applied to both tables.
+
+    Attributes:
+        SCHEMA_VERSION (int): Version of the database layout and of the stored rows (see AWSConnector.to_row).
+        __full_sync_ttl (float): Seconds after which the whole inventory is downloaded again.
+        __refresh_interval (float): Seconds during which the inventory is used without asking Qualys for changes.
+        __discarded (set): Names and IDs of the connectors discarded during the running full sync. None when no full
+         sync is running.
+    """
+
+    SCHEMA_VERSION = 1
+    # The watermark is moved back by this overlap, so connectors synced while the inventory was downloaded are not
+    # missed. The overlapping ones are requested again, which is harmless.
+    WATERMARK_OVERLAP = 60
+    STAGING_BATCH_SIZE = 500
+
+    def __init__(self, path, full_sync_ttl=3600, refresh_interval=60):
+        """
+        Constructor method of class ConnectorInventory.
+
+        Args:
+            path (str): Path of the database file (':memory:' for an in-memory database).
+            full_sync_ttl (float): Seconds after which the whole inventory is downloaded again. Defaults to 3600.
+            refresh_interval (float): Seconds during which the inventory is used without asking Qualys for changes.
+             Defaults to 60.
+        """
+        self.__full_sync_ttl = full_sync_ttl
+        self.__refresh_interval = refresh_interval
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.RLock()
+        self.__sync_lock = threading.Lock()
+        self.__discarded = None
+        with self.__lock, self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if self.__get_meta("schema_version") != str(self.SCHEMA_VERSION):
+                self.__connection.execute("DROP TABLE IF EXISTS connectors")
+                self.__connection.execute("DELETE FROM meta")
+                self.__set_meta(schema_version=self.SCHEMA_VERSION)
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS connectors "
+                "(id INTEGER PRIMARY KEY, name TEXT, aws_account_id TEXT, row TEXT NOT NULL)"
+            )
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS connectors_name ON connectors (name)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS connectors_account ON connectors (aws_account_id)")
+            self.__connection.execute("DROP TABLE IF EXISTS connectors_staging")
+
+    def __get_meta(self, key):
+        row = self.__connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def __set_meta(self, **values):
+        self.__connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                      [(key, str(value)) for key, value in values.items()])
+
+    def __upsert(self, connectors, table="connectors"):
+        self.__connection.executemany(
+            f"INSERT OR REPLACE INTO {table} (id, name, aws_account_id, row) VALUES (?, ?, ?, ?)",
+            [(int(connector.id), connector.name, connector.aws_account_id,
+              json.dumps(connector.to_row(), separators=(",", ":"))) for connector in connectors]
+        )
+
+    @staticmethod
+    def __watermark(epoch):
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch))
+
+    def sync(self, fetch, force_full=False):
+        """
+        Brings the inventory up to date, if it is due: a full sync when it is empty, written by another schema version
+         or older than the full_sync_ttl, else an incremental sync when the refresh_interval elapsed since the last one.
+
+        Args:
+            fetch: Function that takes a list of (field, operator, value) search criteria (None for all the
+             connectors) and returns an iterable of the matching connectors, eg: QualysClient.iter_aws_connectors.
+            force_full (bool): if True, the whole inventory is downloaded, whether it is due or not. Defaults to False.
+
+        Returns:
+            (str): 'full' or 'incremental', the kind of sync made. None if the inventory was fresh.
+        """
+        # The syncs are serialized by their own lock, and only take the lock of the database to write, so the
+        # inventory can be read while the connectors are downloaded
+        with self.__sync_lock:
+            with self.__lock:
+                now = time.time()
+                full_sync_at = float(self.__get_meta("full_sync_at") or 0)
+                synced_at = float(self.__get_meta("synced_at") or 0)
+                max_id = self.__connection.execute("SELECT MAX(id) FROM connectors").fetchone()[0] or 0
+            if force_full or now - full_sync_at > self.__full_sync_ttl:
+                self.__full_sync(fetch, now)
+                return "full"
+            if now - synced_at <= self.__refresh_interval:
+                return None
+            connectors = []
+            for criteria in ([("id", "GREATER", str(max_id))],
+                             [("lastSync", "GREATER", self.__watermark(synced_at - self.WATERMARK_OVERLAP))]):
+                connectors.extend(fetch(criteria))
+            with self.__lock, self.__connection:
+                self.__upsert(connectors)
+                self.__set_meta(synced_at=now)
+            return "incremental"
+
+    def __full_sync(self, fetch, now):
+        with self.__lock, self.__connection:
+            self.__connection.execute("DROP TABLE IF EXISTS connectors_staging")
+            self.__connection.execute(
+                "CREATE TABLE connectors_staging "
+                "(id INTEGER PRIMARY KEY, name TEXT, aws_account_id TEXT, row TEXT NOT NULL)"
+            )
+            self.__discarded = set()
+        try:
+            batch = []
+            for connector in fetch(None):
+                batch.append(connector)
+                if len(batch) >= self.STAGING_BATCH_SIZE:
+                    self.__stage(batch)
+                    batch = []
+            self.__stage(batch)
+            with self.__lock, self.__connection:
+                self.__connection.execute("DELETE FROM connectors")
+                self.__connection.execute("INSERT INTO connectors SELECT * FROM connectors_staging")
+                self.__set_meta(full_sync_at=now, synced_at=now)
+        finally:
+            with self.__lock, self.__connection:
+                self.__connection.execute("DROP TABLE IF EXISTS connectors_staging")
+                self.__discarded = None
+
+    def __stage(self, connectors):
+        with self.__lock, self.__connection:
+            # The connectors discarded since the full sync started may still be listed, and must not come back
+            self.__upsert([connector for connector in connectors
+                           if connector.name not in self.__discarded and int(connector.id) not in self.__discarded],
+                          table="connectors_staging")
+
+    def add(self, connector):
+        """
+        Stores a connector, replacing its previous version, eg: after it was requested from Qualys.
+
+        Args:
+            connector (AWSConnector): The connector.
+        """
+        with self.__lock, self.__connection:
+            self.__upsert([connector])
+            if self.__discarded is not None:
+                self.__upsert([connector], table="connectors_staging")
+
+    def discard(self, connector_name=None, connector_id=None):
+        """
+        Removes a connector from the inventory, given its name or its ID, eg: after it was deleted or changed.
+
+        Args:
+            connector_name (str): The name of the connector.
+            connector_id (str): The ID of the connector.
+        """
+        connector_id = None if connector_id is None else int(connector_id)
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM connectors WHERE name = ? OR id = ?", (connector_name, connector_id))
+            if self.__discarded is not None:
+                self.__connection.execute("DELETE FROM connectors_staging WHERE name = ? OR id = ?",
+                                          (connector_name, connector_id))
+                self.__discarded.update(value for value in (connector_name, connector_id) if value is not None)
+
+    def get_by_name(self, connector_name):
+        """
+        Returns the stored connector with the given name.
+
+        Args:
+            connector_name (str): The name of the connector.
+
+        Returns:
+            connector (AWSConnector): The connector. None if it is not stored.
+        """
+        connectors = self.__select("WHERE name = ? LIMIT 1", connector_name)
+        return connectors[0] if connectors else None
+
+    def get_by_id(self, connector_id):
+        """
+        Returns the stored connector with the given ID.
+
+        Args:
+            connector_id (str): The ID of the connector.
+
+        Returns:
+            connector (AWSConnector): The connector. None if it is not stored.
+        """
+        connectors = self.__select("WHERE id = ?", int(connector_id))
+        return connectors[0] if connectors else None
+
+    def get_by_account_id(self, account_id):
+        """
+        Returns the stored connectors of an AWS account.
+
+        Args:
+            account_id (str): The ID of the AWS account.
+
+        Returns:
+            (list): The connectors, usually one.
+        """
+        return self.__select("WHERE aws_account_id = ? ORDER BY id", str(account_id))
+
+    def __select(self, clause, *params):
+        with self.__lock:
+            rows = self.__connection.execute(f"SELECT row FROM connectors {clause}", params).fetchall()
+        return [AWSConnector(*json.loads(row)) for row, in rows]
+
+    def __iter__(self):
+        """
+        Iterates over the stored connectors, ordered by ID, reading them in batches so they are not all loaded at once.
+
+        Yields:
+            connector (AWSConnector): each stored connector.
+        """
+        last_id = -1
+        while True:
+            with self.__lock:
+                rows = self.__connection.execute(
+                    "SELECT id, row FROM connectors WHERE id > ? ORDER BY id LIMIT 500", (last_id,)
+                ).fetchall()
+            if not rows:
+                return
+            for last_id, row in rows:
+                yield AWSConnector(*json.loads(row))
+
+    def __len__(self):
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM connectors").fetchone()[0]
@@ -0,0 +1,220 @@
+"""
+Exports the connectors of the Qualys subscriptions as NDJSON or CSV, eg: for security reporting.
+
+The connectors are streamed from the search endpoint one page at a time and written as soon as they are decoded, so
+memory stays flat however many connectors the subscriptions have. The output can be gzip compressed, and written to a
+file, to the standard output or to S3 (as a multipart upload, one part per 8 MiB).
+
+Usage:
+    python export.py [--format ndjson|csv] [--gzip] [--output connectors.ndjson | s3://bucket/key | -]
+        [--page-size 100]
+
+The subscriptions are the ones configured for the Lambda (see QUALYS_SUBSCRIPTIONS), with their credentials read
+from the environment variables.
+"""
+from connectors.aws import format_value
+from datetime import datetime
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+
+# Columns of the export, in order. 'subscription' is the name of the Qualys subscription the connector belongs to.
+EXPORT_FIELDS = ("subscription", "id", "name", "aws_account_id", "connector_state", "last_sync", "last_error", "arn",
+                 "disabled", "is_deleted", "all_regions")
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Class that represents a binary file written to S3 through a multipart upload. The written bytes are buffered until
+     a part is full, then uploaded, so only one part is kept in memory. Closing the file completes the upload; leaving
+     its context on an error aborts it, so no incomplete object is left behind.
+    """
+
+    def __init__(self, bucket, key, s3_client=None, part_size=8 * 1024 * 1024):
+        """
+        Constructor method of class S3MultipartWriter.
+
+        Args:
+            bucket (str): Name of the S3 bucket.
+            key (str): Key of the object.
+            s3_client: The S3 client. Defaults to the client of the process (see role_assignment).
+            part_size (int): Size of the uploaded parts, at least 5 MiB (the S3 minimum). Defaults to 8 MiB.
+        """
+        super().__init__()
+        if s3_client is None:
+            from role_assignment import get_boto_client
+            s3_client = get_boto_client('s3')
+        self.__client = s3_client
+        self.__bucket = bucket
+        self.__key = key
+        self.__part_size = max(part_size, 5 * 1024 * 1024)
+        self.__buffer = bytearray()
+        self.__parts = []
+        self.__upload_id = self.__client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.__buffer.extend(data)
+        while len(self.__buffer) >= self.__part_size:
+            self.__upload_part(bytes(self.__buffer[:self.__part_size]))
+            del self.__buffer[:self.__part_size]
+        return len(data)
+
+    def __upload_part(self, body):
+        part_number = len(self.__parts) + 1
+        response = self.__client.upload_part(Bucket=self.__bucket, Key=self.__key, UploadId=self.__upload_id,
+                                             PartNumber=part_number, Body=body)
+        self.__parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+
+    def close(self):
+        if self.closed:
+            return
+        # The last part may be smaller than 5 MiB, and an empty export is uploaded as a single empty part
+        if self.__buffer or not self.__parts:
+            self.__upload_part(bytes(self.__buffer))
+            self.__buffer.clear()
+        self.__client.complete_multipart_upload(Bucket=self.__bucket, Key=self.__key, UploadId=self.__upload_id,
+                                                MultipartUpload={"Parts": self.__parts})
+        super().close()
+
+    def abort(self):
+        """Aborts the upload, discarding the uploaded parts."""
+        if self.closed:
+            return
+        self.__client.abort_multipart_upload(Bucket=self.__bucket, Key=self.__key, UploadId=self.__upload_id)
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def open_output(destination, s3_client=None):
+    """
+    Opens the binary file an export is written to.
+
+    Args:
+        destination (str): A path, 's3://bucket/key', or '-' for the standard output.
+        s3_client: The S3 client used for S3 destinations. Defaults to the client of the process.
+
+    Returns:
+        The binary file, to be used as a context manager.
+    """
+    if destination == "-":
+        return open(sys.stdout.fileno(), "wb", closefd=False)
+    if destination.startswith("s3://"):
+        bucket, _, key = destination[len("s3://"):].partition("/")
+        if not bucket or not key:
+            raise ValueError(f"Invalid S3 destination {destination}, expected s3://bucket/key")
+        return S3MultipartWriter(bucket, key, s3_client)
+    return open(destination, "wb")
+
+
+def export_row(connector, subscription=None, fields=EXPORT_FIELDS):
+    """
+    Builds the exported row of a connector.
+
+    Args:
+        connector (AWSConnector): The connector.
+        subscription (str): The name of the subscription of the connector. Defaults to None.
+        fields (tuple): The exported fields, in order. Defaults to EXPORT_FIELDS.
+
+    Returns:
+        (dict): The exported fields, with dates as ISO 8601 text.
+    """
+    row = {}
+    for field in fields:
+        value = subscription if field == "subscription" else getattr(connector, field)
+        row[field] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+def export_connectors(sources, output, output_format="ndjson", compress=False, fields=EXPORT_FIELDS):
+    """
+    Writes connectors to a binary file, one row each, as they are read.
+
+    Args:
+        sources: Iterable of (subscription, connectors) tuples, where connectors is an iterable of AWSConnector, eg:
+         [("default", client.iter_aws_connectors())].
+        output: The binary file written to. It is not closed.
+        output_format (str): 'ndjson' (one JSON object per line) or 'csv' (with a header line). Defaults to 'ndjson'.
+        compress (bool): if True, the rows are gzip compressed. Defaults to False.
+        fields (tuple): The exported fields, in order. Defaults to EXPORT_FIELDS.
+
+    Returns:
+        (int): The number of exported connectors.
+    """
+    if output_format not in ("ndjson", "csv"):
+        raise ValueError(f"Unsupported export format {output_format}")
+    compressed = gzip.GzipFile(fileobj=output, mode="wb") if compress else None
+    text = io.TextIOWrapper(compressed or output, encoding="utf-8", newline="", write_through=False)
+    count = 0
+    try:
+        writer = None
+        if output_format == "csv":
+            writer = csv.writer(text)
+            writer.writerow(fields)
+        for subscription, connectors in sources:
+            for connector in connectors:
+                row = export_row(connector, subscription, fields)
+                if writer is not None:
+                    writer.writerow("" if value is None else format_value(value) for value in row.values())
+                else:
+                    text.write(json.dumps(row) + "\n")
+                count += 1
+        text.flush()
+    finally:
+        # Detached, so closing the wrapper does not close the output, which belongs to the caller
+        text.detach()
+        if compressed is not None:
+            compressed.close()
+    return count
+
+
+def export_subscriptions(pool, destination, output_format="ndjson", compress=False, page_size=100):
+    """
+    Exports the connectors of every subscription of a client pool, one subscription after the other.
+
+    Args:
+        pool (QualysClientPool): The client pool.
+        destination (str): A path, 's3://bucket/key', or '-' for the standard output.
+        output_format (str): 'ndjson' or 'csv'. Defaults to 'ndjson'.
+        compress (bool): if True, the output is gzip compressed. Defaults to False.
+        page_size (int): Number of connectors requested per page. Defaults to 100.
+
+    Returns:
+        (int): The number of exported connectors.
+    """
+    sources = ((subscription, pool.client(subscription).iter_aws_connectors(page_size=page_size))
+               for subscription in pool.subscriptions)
+    with open_output(destination) as output:
+        return export_connectors(sources, output, output_format, compress)
+
+
+def main():
+    from client_pool import pool_from_environment
+    from qualys import QualysClient, read_api_credentials
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="gzip compress the output")
+    parser.add_argument("--output", default="-", help="a path, s3://bucket/key, or - for the standard output")
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    pool = pool_from_environment(lambda subscription, settings: QualysClient(
+        settings["api_server_url"], notifier=None, protocol=settings.get("protocol", "https"),
+        credentials=read_api_credentials(settings.get("credentials_prefix", "QUALYS"))))
+    count = export_subscriptions(pool, args.output, args.format, args.gzip, args.page_size)
+    print(f"Exported {count} connectors to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,194 @@
 from connectors.aws import AWSConnector
-import xml.etree.ElementTree as ET
+from handlers.templates import XMLRequestTemplate
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 
 class AWSConnectorHanlder:
 
+    creation_template = XMLRequestTemplate("connectors/create_aws_connector.xml",
+                                           parameters=("connector_name", "all_regions"))
+    activation_template = XMLRequestTemplate("connectors/activate_aws_connector.xml",
+                                             parameters=("role_arn", "disabled_state"))
+    # Without filters, a deletion request would delete every connector of the subscription
+    deletion_template = XMLRequestTemplate("connectors/delete_aws_connector.xml", criteria_required=True)
+    search_template = XMLRequestTemplate("connectors/search_aws_connectors.xml",
+                                         parameters=("start_offset", "limit_results"))
+
     def __init__(self):
         pass
 
     @staticmethod
-    def xml_to_dict(connectors_as_xml):
-        all_connectors = []
-        tree = ET.ElementTree(ET.fromstring(connectors_as_xml))
-        root = tree.getroot()
-        for connector in root.findall('.//AwsAssetDataConnector'):
-            connector_as_dict = {
-                "id": connector.find("id").text,
-                "name": connector.find("name").text,
-                "awsAccountId": connector.find("awsAccountId").text if connector.find("awsAccountId") else None,
-                "lastSync": connector.find("lastSync").text if connector.find("lastSync") else None,
-                "lastError": connector.find("lastError").text if connector.find("lastError") else None,
-                "connectorState": connector.find("connectorState").text,
-                "type": connector.find("type").text,
-                "defaultTags": {
-                    "list": {
-                        "TagSimple": {
-                            "id": connector.find("defaultTags/list/TagSimple/id").text,
-                            "name": connector.find("defaultTags/list/TagSimple/name").text
-                        }
-                    }
-                } if connector.find("defaultTags") else None,
-                "disabled": connector.find("disabled").text,
-                "isGovCloudConfigured": connector.find("isGovCloudConfigured").text,
-                "isChinaConfigured": connector.find("isChinaConfigured").text,
-                "isDeleted": connector.find("isDeleted").text if connector.find("isDeleted") else None,
-                "arn": connector.find("arn").text if connector.find("arn") else None,
-                "externalId": connector.find("externalId").text,
-                "qualysAwsAccountId": connector.find("qualysAwsAccountId").text if connector.find("qualysAwsAccountId") else None,
-                "authRecord": connector.find("authRecord").text if connector.find("authRecord") else None,
-                "allRegions": connector.find("allRegions").text
-            }
-            all_connectors.append(connector_as_dict)
-        return all_connectors
+    def element_to_object(connector):
+        """
+        Decodes a single AwsAssetDataConnector XML element into an AWSConnector.
+
+        Args:
+            connector (Element): The AwsAssetDataConnector element.
+
+        Returns:
+            (AWSConnector): The decoded connector.
+        """
+        return AWSConnector.from_element(connector)
+
+    @staticmethod
+    def xml_to_objects(connectors_as_xml):
+        """
+        Decodes all the connectors of a Qualys ServiceResponse.
+
+        Args:
+            connectors_as_xml (bytes): The ServiceResponse XML, eg: the content of a search or creation response.
+
+        Returns:
+            (list): The decoded AWSConnector objects, in document order.
+        """
+        if isinstance(connectors_as_xml, str):
+            connectors_as_xml = connectors_as_xml.encode()
+        root = ET.fromstring(connectors_as_xml)
+        return [AWSConnectorHanlder.element_to_object(connector)
+                for connector in root.iter("AwsAssetDataConnector")]
 
     @staticmethod
-    def dict_to_object(connectors_dicts: list):
-        all_connectors = []
-        for dictionary in connectors_dicts:
-            connector = AWSConnector(id=dictionary["id"], name=dictionary["name"],
-                                     awsaccountid=dictionary["awsAccountId"],
-                                     lastsync=dictionary["lastSync"], lasterror=dictionary["lastError"],
-                                     connectorstate=dictionary["connectorState"], type=dictionary["type"],
-                                     defaulttags=dictionary["defaultTags"], disabled=dictionary["disabled"],
-                                     isgovcloudconfigured=dictionary["isGovCloudConfigured"],
-                                     ischinaconfigured=dictionary["isChinaConfigured"],
-                                     isdeleted=dictionary["isDeleted"], arn=dictionary["arn"],
-                                     externalid=dictionary["externalId"],
-                                     qualysawsaccountid=dictionary["qualysAwsAccountId"],
-                                     authrecord=dictionary["authRecord"],
-                                     allregions=dictionary["allRegions"])
-            all_connectors.append(connector)
-        return all_connectors
+    def iter_xml_connectors(xml_stream, page_info=None, chunk_size=65536):
+        """
+        Incrementally parses a Qualys ServiceResponse from a file-like object, yielding each connector as soon as its
+         element is complete. Parsed connector elements are discarded right after being yielded, so the memory used
+         does not grow with the number of connectors in the response.
+
+        Args:
+            xml_stream: file-like object (eg: the raw stream of a response) containing the ServiceResponse XML.
+            page_info (dict): optional dictionary that will be filled with the response metadata ('responseCode',
+             'count', 'hasMoreRecords' and 'lastId') once the stream is consumed.
+            chunk_size (int): Number of bytes read from the stream at a time. Defaults to 65536.
+
+        Yields:
+            connector (AWSConnector): each connector found in the response, in document order.
+        """
+        decoder = ConnectorStreamDecoder()
+        while True:
+            chunk = xml_stream.read(chunk_size)
+            if not chunk:
+                break
+            for connector in decoder.feed(chunk):
+                yield connector
+        for connector in decoder.close():
+            yield connector
+        if page_info is not None:
+            page_info.update(decoder.page_info)
 
     @staticmethod
-    def handle_connector_creation_xml(connector_name):
-        creation_xml_file_name = "xml/connectors/create_aws_connector.xml"
-        creation_xml_file = open(creation_xml_file_name)
-        create_connector_xml_data = str(creation_xml_file.read())
-        create_connector_xml_string = create_connector_xml_data.replace("connector_name", connector_name)
-        return create_connector_xml_string
+    def handle_connector_creation_xml(connector_name, regions=None):
+        """
+        Renders the creation request of a connector.
+
+        Args:
+            connector_name (str): The name of the connector.
+            regions (list): Codes of the regions the connector syncs, eg: ["us-east-1"]. Defaults to None (all the
+             regions).
+
+        Returns:
+            (str): The creation request XML.
+        """
+        return AWSConnectorHanlder.creation_template.render(connector_name=connector_name, regions=regions,
+                                                            all_regions="false" if regions else "true")
 
     @staticmethod
     def handle_connector_activation_xml(role_arn):
-        activation_xml_file_name = "xml/connectors/activate_aws_connector.xml"
-        activation_xml_file = open(activation_xml_file_name)
-        activate_connector_xml_data = str(activation_xml_file.read())
-        activate_connector_xml_string = activate_connector_xml_data.replace("disabled_state", "false")
-        activate_connector_xml_string = activate_connector_xml_string.replace("role_arn", role_arn)
-        return activate_connector_xml_string
+        return AWSConnectorHanlder.activation_template.render(role_arn=role_arn, disabled_state="false")
 
     @staticmethod
     def handle_connector_deletion_xml(connector_name):
-        deletion_xml_file_name = "xml/connectors/delete_aws_connector.xml"
-        deletion_xml_file = open(deletion_xml_file_name)
-        deletion_connector_xml_data = str(deletion_xml_file.read())
-        deletion_connector_xml_string = deletion_connector_xml_data.replace("connector_name", connector_name)
-        return deletion_connector_xml_string
+        return AWSConnectorHanlder.deletion_template.render(criteria=[("name", "EQUALS", connector_name)])
+
+    @staticmethod
+    def handle_connectors_deletion_xml(values, field="id"):
+        """
+        Renders a single deletion request for many connectors. Qualys combines the criteria of a request with AND, so
+         all the connectors are selected by the same field, with the IN operator.
+
+        Args:
+            values (list): IDs (or names) of the connectors to be removed.
+            field (str): The field used to select the connectors, 'id' or 'name'. Defaults to 'id'.
+
+        Returns:
+            (str): The deletion request XML.
+
+        Raises:
+            ValueError: if no value is given, or a value contains a comma, which separates the values of the IN
+             criteria (eg: deleting 'a,b' would delete the connectors 'a' and 'b').
+        """
+        if not values:
+            raise ValueError("At least one connector must be given!")
+        invalid = [value for value in values if "," in str(value)]
+        if invalid:
+            raise ValueError(f"Connectors can't be selected by a {field} containing a comma: {invalid}")
+        criteria = [(field, "IN", ",".join(str(value) for value in values))]
+        return AWSConnectorHanlder.deletion_template.render(criteria=criteria)
+
+    @staticmethod
+    def handle_connector_search_xml(start_offset, limit_results, criteria=None):
+        return AWSConnectorHanlder.search_template.render(criteria=criteria, start_offset=start_offset,
+                                                          limit_results=limit_results)
+
+
+class ConnectorStreamDecoder:
+    """
+    Push-based decoder of a Qualys ServiceResponse. The response is fed in chunks, as they arrive, and the connectors
+     completed by each chunk are returned right away. It does not read from the response itself, so the same decoder
+     is used by the synchronous and the asynchronous clients.
+
+    Attributes:
+        page_info (dict): The response metadata ('responseCode', 'count', 'hasMoreRecords' and 'lastId') parsed so far.
+    """
+
+    metadata_tags = ("responseCode", "count", "hasMoreRecords", "lastId")
+
+    def __init__(self):
+        self.page_info = {}
+        self.__parser = ET.XMLPullParser(events=("start", "end"))
+        self.__depth = 0
+        self.__data_element = None
+
+    def feed(self, chunk):
+        """
+        Feeds a chunk of the response to the decoder.
+
+        Args:
+            chunk (bytes): The next chunk of the response.
+
+        Returns:
+            (list): The connectors completed by the chunk.
+        """
+        self.__parser.feed(chunk)
+        return self.__read_connectors()
+
+    def close(self):
+        """
+        Signals the end of the response to the decoder.
+
+        Returns:
+            (list): The connectors that were still pending, if any.
+        """
+        self.__parser.close()
+        return self.__read_connectors()
+
+    def __read_connectors(self):
+        connectors = []
+        for event, element in self.__parser.read_events():
+            if event == "start":
+                self.__depth += 1
+                if self.__depth == 2 and element.tag == "data":
+                    self.__data_element = element
+                continue
+            self.__depth -= 1
+            if self.__depth == 2 and element.tag == "AwsAssetDataConnector":
+                connectors.append(AWSConnector.from_element(element))
+                element.clear()
+                if self.__data_element is not None:
+                    self.__data_element.remove(element)
+            elif self.__depth == 1 and element.tag in self.metadata_tags:
+                self.page_info[element.tag] = element.text
+        return connectors
@@ -0,0 +1,120 @@
+from os.path import abspath, dirname, join
+from xml.sax.saxutils import escape, quoteattr
+import re
+import xml.etree.ElementTree as ET
+
+TEMPLATES_DIRECTORY = join(dirname(dirname(abspath(__file__))), "xml")
+
+
+def render_criteria(criteria):
+    """
+    Renders search filters as Criteria elements, escaping the field names, operators and values.
+
+    Args:
+        criteria (list): (field, operator, value) tuples, eg: [("name", "IN", "account-a-prd,account-b-prd")].
+
+    Returns:
+        (str): The Criteria elements.
+    """
+    return "".join(
+        f"<Criteria field={quoteattr(field)} operator={quoteattr(operator)}>{escape(str(value))}</Criteria>"
+        for field, operator, value in criteria
+    )
+
+
+def render_endpoints(regions):
+    """
+    Renders the regions of a connector as the AwsEndpointSimple elements added to its endpoints.
+
+    Args:
+        regions (list): Region codes, eg: ["us-east-1", "sa-east-1"].
+
+    Returns:
+        (str): The add element holding the AwsEndpointSimple elements.
+    """
+    endpoints = "".join(f"<AwsEndpointSimple><regionCode>{escape(region)}</regionCode></AwsEndpointSimple>"
+                        for region in regions)
+    return f"<add>{endpoints}</add>"
+
+
+class XMLRequestTemplate:
+    """
+    Class that represents a request template from the xml directory. The template is parsed once, when the object
+     is created, and kept as a list of literal segments and parameter slots, so rendering a request is a plain string
+     join with no file I/O.
+
+    Placeholders are elements whose whole text is the name of a parameter, eg: <name>connector_name</name>. A
+     <filters>criteria</filters> element is a slot for search criteria, and is left out of the request when no criteria
+     are given, unless the template requires them (eg: a deletion, which would select every connector). Likewise, an <endpoints>regions</endpoints> element is a slot for the regions of a connector.
+
+    Attributes:
+        __segments (list): literal XML segments at even positions and parameter names at odd positions.
+    """
+
+    criteria_slot = "criteria"
+    regions_slot = "regions"
+    __placeholder = re.compile(r"\{\{(\w+)\}\}")
+
+    def __init__(self, file_name, parameters=(), criteria_required=False):
+        """
+        Constructor method of class XMLRequestTemplate.
+
+        Args:
+            file_name (str): Path of the template, relative to the xml directory, eg:
+             'connectors/create_aws_connector.xml'.
+            parameters (tuple): Names of the parameters of the template.
+            criteria_required (bool): if True, the template can't be rendered without criteria. Defaults to False.
+        """
+        self.__criteria_required = criteria_required
+        root = ET.parse(join(TEMPLATES_DIRECTORY, file_name)).getroot()
+        for element in root.iter():
+            text = element.text.strip() if element.text else None
+            if text in parameters or (text == self.criteria_slot and element.tag == "filters") or (
+                    text == self.regions_slot and element.tag == "endpoints"):
+                element.text = "{{%s}}" % text
+        serialized = ET.tostring(root, encoding="unicode")
+        serialized = serialized.replace("<filters>{{%s}}</filters>" % self.criteria_slot, "{{%s}}" % self.criteria_slot)
+        serialized = serialized.replace("<endpoints>{{%s}}</endpoints>" % self.regions_slot,
+                                        "{{%s}}" % self.regions_slot)
+        self.__segments = self.__placeholder.split('<?xml version="1.0" encoding="UTF-8"?>\n' + serialized)
+        self.__parameters = frozenset(self.__segments[1::2])
+
+    @property
+    def parameters(self):
+        """
+        Read-only property. Returns the names of the slots of the template.
+
+        Returns:
+            (frozenset): the parameter names (including 'criteria' for templates with search filters, and 'regions' for
+             templates with connector regions).
+        """
+        return self.__parameters
+
+    def render(self, criteria=None, regions=None, **values):
+        """
+        Renders the request, escaping the values of the parameters.
+
+        Args:
+            criteria (list): (field, operator, value) tuples used as search filters. Defaults to None (no filters).
+            regions (list): Region codes of the connector. Defaults to None (no endpoints element).
+            **values: the value of each parameter of the template.
+
+        Returns:
+            (str): The request XML.
+
+        Raises:
+            KeyError: if the value of a parameter is missing.
+            ValueError: if the template requires criteria and none were given.
+        """
+        if self.__criteria_required and not criteria:
+            raise ValueError("The request can't be rendered without criteria!")
+        segments = self.__segments[:]
+        for position in range(1, len(segments), 2):
+            name = segments[position]
+            if name == self.criteria_slot:
+                segments[position] = f"<filters>{render_criteria(criteria)}</filters>" if criteria else ""
+            elif name == self.regions_slot:
+                segments[position] = f"<endpoints>{render_endpoints(regions)}</endpoints>" if regions else ""
+            else:
+                segments[position] = escape(str(values[name]))
+        return "".join(segments)
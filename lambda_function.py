@@ -1,11 +1,136 @@
-from qualys import QualysClient
-from handlers.aws import AWSConnectorHanlder
-from notification.slack import SlackNotifier
-from role_assignment import setup_iam
+import json
+import os
+import threading
+import tracing
 
-slack_notifier = SlackNotifier()
-aws_connector_handler = AWSConnectorHanlder()
-qualys_client = QualysClient(api_server_url="qualysapi.qg3.apps.qualys.com", notifier=slack_notifier)
+# The clients are built on first use (see get_client_pool), so invocations that are filtered out never import or
+# construct them. Once built, they are kept on these globals and reused by the warm invocations.
+slack_notifier = None
+client_pool = None
+state_store = None
+_clients_lock = threading.Lock()
+
+
+def inventory_from_environment(subscription="default"):
+    """
+    Builds the connector inventory configured by the environment variables: a SQLite database at
+     QUALYS_INVENTORY_PATH (default '/tmp/qualys_inventory.sqlite3', empty to disable it), fully synced every
+     QUALYS_INVENTORY_TTL seconds (default 3600) and incrementally every QUALYS_INVENTORY_REFRESH seconds (default 60).
+
+    Args:
+        subscription (str): The Qualys subscription of the inventory. Subscriptions other than 'default' have their
+         name added to the file name, eg: '/tmp/qualys_inventory-retail.sqlite3'.
+
+    Returns:
+        (ConnectorInventory): The connector inventory. None if it is disabled.
+    """
+    path = os.environ.get("QUALYS_INVENTORY_PATH", "/tmp/qualys_inventory.sqlite3")
+    if not path:
+        return None
+    if subscription != "default":
+        root, extension = os.path.splitext(path)
+        path = f"{root}-{subscription}{extension}"
+    from connectors.inventory import ConnectorInventory
+    return ConnectorInventory(path, full_sync_ttl=float(os.environ.get("QUALYS_INVENTORY_TTL", 3600)),
+                              refresh_interval=float(os.environ.get("QUALYS_INVENTORY_REFRESH", 60)))
+
+
+def build_qualys_client(subscription, settings):
+    """
+    Builds the Qualys client of a subscription of the pool (see client_pool.pool_from_environment).
+
+    Args:
+        subscription (str): The name of the subscription.
+        settings (dict): Its settings: 'api_server_url', and optionally 'credentials_prefix' (the prefix of the
+         environment variables holding its credentials, default 'QUALYS') and 'protocol'.
+
+    Returns:
+        (QualysClient): The client.
+    """
+    from connectors.index import AWSConnectorIndex
+    from qualys import QualysClient, read_api_credentials
+    connector_index = AWSConnectorIndex(ttl=float(os.environ.get("QUALYS_CONNECTOR_INDEX_TTL", 300)))
+    return QualysClient(api_server_url=settings["api_server_url"], notifier=slack_notifier,
+                        protocol=settings.get("protocol", "https"), connector_index=connector_index,
+                        inventory=inventory_from_environment(subscription),
+                        credentials=read_api_credentials(settings.get("credentials_prefix", "QUALYS")))
+
+
+def get_client_pool():
+    """
+    Returns the Qualys client pool of the process, building it (with the Slack notifier its clients use and the
+     provisioning state store) on the first call. The client of each subscription is built on its first use.
+
+    Returns:
+        (QualysClientPool): The memoized client pool.
+    """
+    global slack_notifier, client_pool, state_store
+    if client_pool is not None:
+        return client_pool
+    with _clients_lock:
+        if client_pool is None:
+            from client_pool import pool_from_environment
+            from notification.slack import SlackNotifier
+            from state_store import state_store_from_environment
+            state_store = state_store_from_environment()
+            slack_notifier = SlackNotifier()
+            client_pool = pool_from_environment(build_qualys_client)
+    return client_pool
+
+
+def get_qualys_client(account_name=None, account_id=None):
+    """
+    Returns the Qualys client of the subscription an account belongs to.
+
+    Args:
+        account_name (str): The name of the account.
+        account_id (str): The ID of the account. Defaults to None (the client of the default subscription).
+
+    Returns:
+        (QualysClient): The memoized Qualys client.
+    """
+    pool = get_client_pool()
+    return pool.client_for(account_name, account_id) if account_id is not None else pool.client()
+
+
+def provision(account_name, account_id, context=None):
+    from provisioning import provision_account
+    from retry import RetryPolicy
+    invocation_id = getattr(context, "aws_request_id", None)
+    with tracing.trace("provision", trace_id=invocation_id, AccountId=account_id):
+        client = get_qualys_client(account_name, account_id)
+        retry_policy = RetryPolicy(max_attempts=int(os.environ.get("PROVISIONING_MAX_ATTEMPTS", 3)), context=context)
+        return provision_account(client, account_name, account_id, invocation_id, retry_policy, state_store,
+                                 state_wait=float(os.environ.get("CONNECTOR_STATE_MAX_WAIT", 30)),
+                                 region_scope=os.environ.get("CONNECTOR_REGION_SCOPE", "all"))
+
+
+def flush_notifications(context=None):
+    """
+    Waits for the queued Slack messages to be posted, so they are not lost when the execution environment is frozen
+     after the handler returns, along with the messages kept in the outbox by previous invocations. Gives up 1 second
+     before the Lambda timeout, keeping the undelivered messages in the outbox.
+
+    Args:
+        context: The Lambda context. Defaults to None (no time limit).
+    """
+    if slack_notifier is None:
+        return
+    slack_notifier.drain_outbox()
+    timeout = None
+    if context is not None:
+        timeout = max(context.get_remaining_time_in_millis() / 1000 - 1, 0)
+    with tracing.span("slack_flush"):
+        if not slack_notifier.flush(timeout):
+            print("Could not send all the Slack messages before the timeout")
+
+
+def decommission(account_id, context=None):
+    from provisioning import decommission_account
+    with tracing.trace("decommission", trace_id=getattr(context, "aws_request_id", None), AccountId=account_id):
+        # The connectors of the account are looked for in every subscription, concurrently, in case it was moved.
+        deleted = get_client_pool().map(lambda client: decommission_account(client, account_id, state_store))
+        return [connector_id for connector_ids in deleted.values() for connector_id in connector_ids]
 
 
 def check_account_production(account_name):
@@ -13,55 +138,217 @@ def check_account_production(account_name):
     return account_name.split("-")[-1].lower() in sufixes
 
 
+def get_created_account(event):
+    """
+    Extracts the created account from a Control Tower createManagedAccountStatus event.
+
+    Args:
+        event (dict): The EventBridge event.
+
+    Returns:
+        (tuple): (account_name, account_id) of the created account. None if the account creation did not succeed.
+    """
+    account_status = event['detail']['serviceEventDetails']['createManagedAccountStatus']
+    if account_status['state'] != 'SUCCEEDED':
+        return None
+    return account_status['account']['accountName'], account_status['account']['accountId']
+
+
+def get_closed_account(event):
+    """
+    Extracts the account closed, or removed from the organization, from an Organizations CloudTrail event (eg:
+     delivered by an EventBridge rule on the CloseAccount and RemoveAccountFromOrganization calls).
+
+    Args:
+        event (dict): The EventBridge event.
+
+    Returns:
+        (str): The ID of the account. None if the event is not about an account closure.
+    """
+    detail = event.get('detail') or {}
+    if detail.get('eventSource') != 'organizations.amazonaws.com' or detail.get('errorCode'):
+        return None
+    if detail.get('eventName') not in ('CloseAccount', 'RemoveAccountFromOrganization'):
+        return None
+    return (detail.get('requestParameters') or {}).get('accountId')
+
+
 def lambda_handler(event, context):
-    if event['detail']['serviceEventDetails']['createManagedAccountStatus']['state'] == 'SUCCEEDED':
+    closed_account_id = get_closed_account(event)
+    if closed_account_id is not None:
+        decommission(closed_account_id, context)
+        return
 
-        account_name = event['detail']['serviceEventDetails']['createManagedAccountStatus']['account']['accountName']
-        account_id = event['detail']['serviceEventDetails']['createManagedAccountStatus']['account']['accountId']
+    created_account = get_created_account(event)
+    if created_account is None:
+        return
 
-        if not check_account_production(account_name):
-            return
+    account_name, account_id = created_account
+    if not check_account_production(account_name):
+        return
 
+    with tracing.profiled("lambda_handler"), tracing.trace("lambda_handler", getattr(context, "aws_request_id", None)):
         try:
-            response, connector_creation_status = qualys_client.create_aws_connector(account_name)
-
-            if connector_creation_status:
-                connector_as_dict = AWSConnectorHanlder.xml_to_dict(response.text)
-                connector = AWSConnectorHanlder.dict_to_object(connector_as_dict)
-                if len(connector) < 1:
-                    qualys_client.delete_aws_connector(account_name)
-                    lambda_handler(event, context)
-                    return
-                connector = connector[0]
-                role_arn = setup_iam(
-                    qualys_base_account_id=qualys_client.base_account_id,
-                    external_id=connector.external_id,
-                    account_id=account_id
-                )
-                response, connector_activation_status = qualys_client.activate_aws_connector(
-                    connector_id=connector.id,
-                    role_arn=role_arn
-                )
-                connector = qualys_client.get_aws_connector_by_name(connector.name)
-                if connector_activation_status:
-                    connector.arn = role_arn
-                    print(role_arn)
-                    qualys_client.notifier.send_message(
-                        on_success=True,
-                        account_name=account_name,
-                        account_id=account_id,
-                        connector=connector,
-                        creation_result=connector_creation_status,
-                        activation_result=connector_activation_status
-                    )
-                else:
-                    qualys_client.delete_aws_connector(connector.name)
-                    print(f"Not activated! {connector.name} connector was deleted.")
-        except Exception as err:
-            print(err)
-            qualys_client.notifier.send_message(
-                on_success=False,
-                account_name=account_name,
-                account_id=account_id,
-                error_message=err
-            )
+            provision(account_name, account_id, context)
+        finally:
+            flush_notifications(context)
+
+
+def process_batch_record(record, context=None):
+    """
+    Provisions the account of one record of a batch. Records about accounts that do not need a connector are
+     considered processed.
+
+    Args:
+        record (dict): The SQS record, whose body is the EventBridge event of the account.
+        context: The Lambda context. Defaults to None.
+
+    Returns:
+        (bool): True if the record was processed, False if it should be retried.
+    """
+    try:
+        created_account = get_created_account(json.loads(record['body']))
+    except (KeyError, TypeError, ValueError) as err:
+        print(f"Invalid record {record.get('messageId')}: {err}")
+        return False
+    if created_account is None:
+        return True
+    account_name, account_id = created_account
+    if not check_account_production(account_name):
+        return True
+    return provision(account_name, account_id, context)
+
+
+def batch_handler(event, context):
+    """
+    Provisions the accounts of a batch of SQS records (eg: EventBridge events of an Account Factory batch delivered
+     through an SQS queue) concurrently, on a bounded thread pool.
+
+    Args:
+        event (dict): The SQS event, with the records in event['Records'].
+        context: The Lambda context.
+
+    Returns:
+        (dict): The SQS partial batch response, listing the records that failed, so only them are retried.
+
+    Raises:
+        ValueError: if a record has no messageId, ie: the event is not an SQS event, since its failures could not be
+         reported.
+    """
+    records = event.get('Records', [])
+    batch_item_failures = []
+    if not records:
+        return {"batchItemFailures": batch_item_failures}
+    if any(not record.get('messageId') for record in records):
+        raise ValueError("Every record of a batch needs a messageId, is the handler triggered by an SQS queue?")
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    max_workers = min(int(os.environ.get("BATCH_MAX_WORKERS", 8)), len(records))
+    # Each record is provisioned on a worker thread, under a trace of its own (see provision).
+    with tracing.profiled("batch_handler"), tracing.trace("batch_handler", getattr(context, "aws_request_id", None),
+                                                          Records=len(records)):
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(process_batch_record, record, context): record['messageId']
+                           for record in records}
+                for future in as_completed(futures):
+                    try:
+                        processed = future.result()
+                    except Exception as err:
+                        print(err)
+                        processed = False
+                    if not processed:
+                        batch_item_failures.append({"itemIdentifier": futures[future]})
+        finally:
+            flush_notifications(context)
+    return {"batchItemFailures": batch_item_failures}
+
+
+def reconciliation_handler(event, context):
+    """
+    Scheduled entry point that provisions the production accounts of the organization that have no connector (eg:
+     accounts created before the Lambda existed, or whose event was lost) and reports the orphan connectors. In sweep
+     mode, the orphan connectors of accounts closed in the organization are deleted. Each Qualys
+     subscription is reconciled concurrently, and only provisions the accounts routed to it.
+
+    Args:
+        event (dict): The scheduled event. {"sweep": true} enables the sweep mode, as does the RECONCILIATION_SWEEP
+         environment variable. At most RECONCILIATION_SWEEP_MAX (default 100) connectors are deleted per run.
+        context: The Lambda context, used to stop starting new provisionings near the timeout.
+
+    Returns:
+        (dict): The reconciliation report.
+    """
+    from reconciliation import iter_organization_accounts, reconcile, sweep_orphans
+    pool = get_client_pool()
+    reserved_ms = int(os.environ.get("RECONCILIATION_RESERVED_MS", 60000))
+    sweep = (event or {}).get("sweep") or os.environ.get("RECONCILIATION_SWEEP", "").lower() == "true"
+
+    def reconcile_subscription(client):
+        # The connectors of accounts routed to other subscriptions are matched too, so they are not taken as orphans
+        # (eg: when the routes changed after the account was provisioned). Before a sweep, the inventory is fully
+        # synced, so no connector is deleted on the basis of a stale copy.
+        subscription_report = reconcile(
+            connectors=client.list_aws_connectors(force_full=sweep),
+            accounts=accounts,
+            needs_connector=check_account_production,
+            provision=lambda account_name, account_id: provision(account_name, account_id, context),
+            max_workers=int(os.environ.get("RECONCILIATION_MAX_WORKERS", 8)),
+            has_time_left=lambda: context is None or context.get_remaining_time_in_millis() > reserved_ms,
+            owns_account=lambda account: pool.client_for(account.name, account.id) is client
+        )
+        return subscription_report
+
+    with tracing.profiled("reconciliation_handler"), tracing.trace("reconciliation_handler",
+                                                                   getattr(context, "aws_request_id", None)):
+        try:
+            accounts = list(iter_organization_accounts())
+            reports = pool.map(reconcile_subscription)
+            # The subscriptions are swept one after the other, so the deletions of the run share a single cap
+            sweep_max = int(os.environ.get("RECONCILIATION_SWEEP_MAX", 100))
+            for subscription, subscription_report in reports.items():
+                subscription_report["deleted"] = []
+                if sweep:
+                    subscription_report["deleted"] = sweep_orphans(
+                        subscription_report["orphans"], pool.client(subscription).delete_aws_connectors,
+                        accounts=len(accounts), max_deletions=sweep_max)
+                    sweep_max -= len(subscription_report["deleted"])
+        finally:
+            flush_notifications(context)
+    report = {"accounts": len(accounts), "connectors": 0, "provisioned": [], "failed": [], "skipped": [],
+              "orphans": [], "deleted": []}
+    for subscription, subscription_report in reports.items():
+        report["connectors"] += subscription_report["connectors"]
+        for orphan in subscription_report["orphans"]:
+            orphan["subscription"] = subscription
+        for key in ("provisioned", "failed", "skipped", "orphans", "deleted"):
+            report[key].extend(subscription_report[key])
+    print(json.dumps({key: value if isinstance(value, int) else len(value) for key, value in report.items()}))
+    for orphan in report["orphans"]:
+        print(f"Orphan connector {orphan['name']} ({orphan['id']}) of subscription {orphan['subscription']}, "
+              f"AWS account {orphan['aws_account_id']} ({orphan['account_status'] or 'not in the organization'})")
+    return report
+
+
+def export_handler(event, context):
+    """
+    Entry point that exports the connectors of every Qualys subscription (eg: on a schedule, for security reporting),
+     streaming them to the destination as they are read (see export).
+
+    Args:
+        event (dict): Optional settings: 'destination' (a path, eg: under /tmp, or 's3://bucket/key'), 'format'
+         ('ndjson' or 'csv') and 'gzip' (bool). Default to the EXPORT_DESTINATION, EXPORT_FORMAT (default 'ndjson')
+         and EXPORT_GZIP (default false) environment variables.
+        context: The Lambda context.
+
+    Returns:
+        (dict): The destination and the number of exported connectors.
+    """
+    from export import export_subscriptions
+    event = event or {}
+    destination = event.get("destination") or os.environ["EXPORT_DESTINATION"]
+    output_format = event.get("format") or os.environ.get("EXPORT_FORMAT", "ndjson")
+    compress = event.get("gzip", os.environ.get("EXPORT_GZIP", "").lower() == "true")
+    with tracing.profiled("export_handler"), tracing.trace("export_handler", getattr(context, "aws_request_id", None)):
+        count = export_subscriptions(get_client_pool(), destination, output_format, compress)
+    print(f"Exported {count} connectors to {destination}")
+    return {"destination": destination, "connectors": count}
@@ -0,0 +1,76 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class SlackOutbox:
+    """
+    Class that represents the outbox of the Slack notifier: a local SQLite database holding the messages that could not
+     be delivered (eg: Slack kept answering 429 until the Lambda deadline), so they are posted by the next warm
+     invocation. It lives in the /tmp of the execution environment, so it survives between invocations, but not a cold
+     start.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor method of class SlackOutbox.
+
+        Args:
+            path (str): Path of the database file (':memory:' for an in-memory database).
+        """
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.Lock()
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, message TEXT NOT NULL, saved_at REAL)"
+            )
+
+    def save(self, messages):
+        """
+        Stores messages to be delivered later.
+
+        Args:
+            messages (list): The messages, as returned by SlackNotifier.assemble_message.
+
+        Returns:
+            (list): The IDs of the stored messages.
+        """
+        ids = []
+        with self.__lock, self.__connection:
+            for message in messages:
+                cursor = self.__connection.execute(
+                    "INSERT INTO outbox (message, saved_at) VALUES (?, ?)", (json.dumps(message), time.time())
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def load(self, limit=100):
+        """
+        Returns the oldest stored messages.
+
+        Args:
+            limit (int): Maximum number of messages returned. Defaults to 100.
+
+        Returns:
+            (list): (id, message) tuples, oldest first.
+        """
+        with self.__lock:
+            rows = self.__connection.execute("SELECT id, message FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(message_id, json.loads(message)) for message_id, message in rows]
+
+    def delete(self, ids):
+        """
+        Removes delivered messages.
+
+        Args:
+            ids (list): The IDs of the messages.
+        """
+        if not ids:
+            return
+        with self.__lock, self.__connection:
+            self.__connection.executemany("DELETE FROM outbox WHERE id = ?", [(message_id,) for message_id in ids])
+
+    def __len__(self):
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
@@ -1,29 +1,253 @@
-from botocore.vendored import requests
+from notification.outbox import SlackOutbox
+from rate_limit import TokenBucket
+from transport import get_transport, retry_after_delay
 import os
 import json
+import threading
+import time
+import requests
 
 
 class SlackNotifier:
+    """
+    Class that represents the Slack notifier. Messages are queued and posted by a background sender, so the caller does
+     not wait for Slack. Messages queued within a short window are combined into one digest message, so a batch of
+     accounts produces one or a few posts. Call flush before the Lambda handler returns, so the queued messages are
+     posted before the execution environment is frozen.
 
-    def __init__(self):
+    The posts are paced by a token bucket, since Slack webhooks accept about one message per second, and a 429 answer
+     is retried after the delay of its Retry-After header. Messages that could not be delivered before the flush
+     deadline are kept in the outbox and posted by the next warm invocation (see drain_outbox).
+
+    Attributes:
+        __coalesce_window (float): Seconds the sender waits for more messages before posting a digest.
+        __max_digest_size (int): Maximum number of messages combined into one digest.
+        __max_attempts (int): Maximum number of attempts to post a digest before keeping it in the outbox.
+        __bucket (TokenBucket): The limiter pacing the posts.
+        __outbox (SlackOutbox): Where the undelivered messages are kept.
+        __pending (list): The queued messages, as {'id': outbox ID or None, 'message': assembled message} entries.
+    """
+
+    def __init__(self, transport=None, coalesce_window=None, max_digest_size=20, rate_limit=None, outbox=None,
+                 max_attempts=5):
+        """
+        Constructor method of class SlackNotifier.
+
+        Args:
+            transport (HTTPTransport): the HTTP transport used to post the messages. Defaults to the shared transport.
+            coalesce_window (float): Seconds the sender waits for more messages before posting a digest. Defaults to
+             the SLACK_COALESCE_WINDOW environment variable, or 2.
+            max_digest_size (int): Maximum number of messages combined into one digest. Defaults to 20.
+            rate_limit (float): Maximum number of posts per second. Defaults to the SLACK_RATE_LIMIT environment
+             variable, or 1.
+            outbox (SlackOutbox): Where the undelivered messages are kept. Defaults to a SQLite database at the
+             SLACK_OUTBOX_PATH environment variable, or '/tmp/slack_outbox.sqlite3'.
+            max_attempts (int): Maximum number of attempts to post a digest. Defaults to 5.
+        """
         self.__webhook_url = os.environ["SLACK_TEST_CHANNEL_WEBHOOK_URL"]
+        self.__transport = transport if transport is not None else get_transport()
+        if coalesce_window is None:
+            coalesce_window = float(os.environ.get("SLACK_COALESCE_WINDOW", 2))
+        if rate_limit is None:
+            rate_limit = float(os.environ.get("SLACK_RATE_LIMIT", 1))
+        if outbox is None:
+            outbox = SlackOutbox(os.environ.get("SLACK_OUTBOX_PATH", "/tmp/slack_outbox.sqlite3"))
+        self.__coalesce_window = coalesce_window
+        self.__max_digest_size = max_digest_size
+        self.__max_attempts = max_attempts
+        self.__bucket = TokenBucket(rate_limit)
+        self.__outbox = outbox
+        self.__pending = []
+        self.__in_flight = []
+        self.__queued_outbox_ids = set()
+        self.__flushing = False
+        self.__deadline = None
+        self.__kept_count = 0
+        self.__condition = threading.Condition()
+        self.__sender = None
 
     def send_message(self, **kwargs):
         """
-        Calls a function passing the name and ID for the created account and the related connector.
-        The function will format the Slack mesage contet, then, the result will be sent to the Slack webhook url.
+        Formats the Slack message about the created account and the related connector, and queues it to be posted to
+         the Slack webhook url by the background sender. The message is formatted right away, so later changes to the
+         connector object do not change it.
 
         Args:
             kwargs (dict): Arguments used to format the message that will be sent to Slack.
         """
+        self.__enqueue([{"id": None, "message": self.assemble_message(kwargs)}])
+
+    def drain_outbox(self, limit=100):
+        """
+        Queues the messages kept in the outbox by previous invocations, so they are posted with the next digest. They
+         are removed from the outbox only once delivered.
+
+        Args:
+            limit (int): Maximum number of messages queued. Defaults to 100.
+
+        Returns:
+            (int): The number of messages queued.
+        """
+        with self.__condition:
+            entries = [{"id": message_id, "message": message} for message_id, message in self.__outbox.load(limit)
+                       if message_id not in self.__queued_outbox_ids]
+        self.__enqueue(entries)
+        return len(entries)
+
+    def __enqueue(self, entries):
+        if not entries:
+            return
+        with self.__condition:
+            self.__pending.extend(entries)
+            self.__queued_outbox_ids.update(entry["id"] for entry in entries if entry["id"] is not None)
+            if self.__sender is None or not self.__sender.is_alive():
+                self.__sender = threading.Thread(target=self.__send_pending, name="slack-sender", daemon=True)
+                self.__sender.start()
+            self.__condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Posts the queued messages right away, without waiting for the coalescing window, and waits for them to be sent.
+         The messages still not delivered when the timeout expires are kept in the outbox.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait. Defaults to None (wait until all are sent).
+
+        Returns:
+            (bool): True if all the queued messages were sent, False if any of them was kept in the outbox.
+        """
+        with self.__condition:
+            self.__flushing = True
+            self.__deadline = None if timeout is None else time.monotonic() + timeout
+            kept_count = self.__kept_count
+            self.__condition.notify_all()
+            try:
+                delivered = self.__condition.wait_for(lambda: not self.__pending and not self.__in_flight, timeout)
+                if not delivered:
+                    # The sender keeps trying the digest it is posting, and removes it from the outbox if it succeeds
+                    # before the execution environment is frozen.
+                    self.__keep(self.__pending + self.__in_flight)
+                    self.__queued_outbox_ids.difference_update(entry["id"] for entry in self.__pending)
+                    self.__queued_outbox_ids.update(entry["id"] for entry in self.__in_flight)
+                    self.__pending.clear()
+                return delivered and self.__kept_count == kept_count
+            finally:
+                self.__flushing = False
+                self.__deadline = None
+
+    def __keep(self, entries):
+        new_entries = [entry for entry in entries if entry["id"] is None]
+        ids = self.__outbox.save([entry["message"] for entry in new_entries])
+        self.__kept_count += len(entries)
+        for entry, message_id in zip(new_entries, ids):
+            entry["id"] = message_id
+
+    def __time_left(self):
+        deadline = self.__deadline
+        return None if deadline is None else deadline - time.monotonic()
 
+    def __send_pending(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__pending)
+                deadline = time.monotonic() + self.__coalesce_window
+                while not self.__flushing and len(self.__pending) < self.__max_digest_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+                self.__in_flight = self.__pending[:self.__max_digest_size]
+                del self.__pending[:self.__max_digest_size]
+                entries = self.__in_flight
+            try:
+                done = self.__deliver(self.assemble_digest([entry["message"] for entry in entries]))
+            except Exception as err:
+                print(f"Could not send the Slack message: {err}")
+                done = False
+            with self.__condition:
+                try:
+                    if done:
+                        self.__outbox.delete([entry["id"] for entry in entries if entry["id"] is not None])
+                    else:
+                        self.__keep(entries)
+                except Exception as err:
+                    print(f"Could not update the Slack outbox: {err}")
+                self.__queued_outbox_ids.difference_update(entry["id"] for entry in entries)
+                self.__in_flight = []
+                self.__condition.notify_all()
+
+    def __deliver(self, slack_message):
+        """
+        Posts a message, pacing it with the token bucket and retrying it on 429 (after the Retry-After delay), 5xx and
+         connection errors, until the flush deadline.
+
+        Args:
+            slack_message (dict): The message body.
+
+        Returns:
+            (bool): True if the message is done with (delivered, or rejected by Slack), False if it should be kept
+             to be retried later.
+        """
+        for attempt in range(self.__max_attempts):
+            if not self.__bucket.acquire(self.__time_left()):
+                return False
+            try:
+                response = self.post_message(slack_message)
+            except requests.exceptions.RequestException as err:
+                print(f"Could not send the Slack message: {err}")
+                delay = self.__transport.backoff_delay(attempt)
+            else:
+                if response.status_code < 400:
+                    return True
+                if response.status_code != 429 and response.status_code < 500:
+                    print(f"Slack rejected the message: {response.status_code} {response.text}")
+                    return True
+                delay = retry_after_delay(response, default=self.__transport.backoff_delay(attempt))
+                if response.status_code == 429:
+                    # The next acquire waits for the delay requested by Slack
+                    self.__bucket.pause(delay)
+                    delay = 0
+            time_left = self.__time_left()
+            if attempt + 1 == self.__max_attempts or (time_left is not None and delay >= time_left):
+                return False
+            time.sleep(delay)
+        return False
+
+    def post_message(self, slack_message):
+        """
+        Posts a formatted message to the Slack webhook url.
+
+        Args:
+            slack_message (dict): The message body, as returned by assemble_message or assemble_digest.
+
+        Returns:
+            response (requests.Response): the response of the webhook.
+        """
         request_headers = {
             "Content-Type": "application/json",
         }
 
-        slack_message = self.assemble_message(kwargs)
         data = json.dumps(slack_message)
-        requests.post(url=self.__webhook_url, headers=request_headers, data=data)
+        return self.__transport.post(url=self.__webhook_url, headers=request_headers, data=data, idempotent=False)
+
+    @staticmethod
+    def assemble_digest(messages):
+        """
+        Combines messages prepared by assemble_message into one message, with a single header and the attachments of
+         all of them.
+
+        Args:
+            messages (list): The messages to be combined.
+
+        Returns:
+            (dict): The combined message. The message itself, if there is only one.
+        """
+        if len(messages) == 1:
+            return messages[0]
+        digest = dict(messages[0])
+        digest["text"] = f"{messages[0]['text']} ({len(messages)} accounts)"
+        digest["attachments"] = [attachment for message in messages for attachment in message["attachments"]]
+        return digest
 
     @staticmethod
     def assemble_message(kwargs):
@@ -0,0 +1,292 @@
+from connectors.aws import AWSConnector
+from handlers.aws import AWSConnectorHanlder
+from retry import RETRYABLE_STATUS_CODES, RetryableError, RetryPolicy, is_transient_error
+from role_assignment import IAMSetupError, discover_regions, setup_iam
+from state_store import CheckpointConflictError, ProvisioningState, ProvisioningStateStore
+import time
+import tracing
+
+
+def create_connector(qualys_client, account_name, regions=None, reuse_existing=False):
+    """
+    Provisioning step that creates the connector, syncing the given regions (all of them by default). A connector that
+     is created but not returned by Qualys is deleted, so the step can be retried without leaving a duplicate behind.
+
+    The creation is not idempotent: a create that failed or timed out may still have been processed by Qualys. So a
+     retried step is run with reuse_existing, and the connector it may have created is returned instead of a duplicate.
+
+    Returns:
+        (AWSConnector): The created (or reused) connector. None if Qualys refused to create it.
+    """
+    if reuse_existing:
+        connector = qualys_client.get_aws_connector_by_name(account_name, use_index=False)
+        if connector is not None:
+            print(f"Reusing the {account_name} connector created by a previous attempt.")
+            return connector
+    response, connector_creation_status = qualys_client.create_aws_connector(account_name, regions=regions)
+    if not connector_creation_status:
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            raise RetryableError(f"Connector creation failed (HTTP {response.status_code})")
+        print(f"Connector creation failed (HTTP {response.status_code}): {response.text}")
+        return None
+    with tracing.span("xml_decode", BytesReceived=len(response.content)):
+        connectors = AWSConnectorHanlder.xml_to_objects(response.content)
+    if len(connectors) < 1:
+        qualys_client.delete_aws_connector(account_name)
+        raise RetryableError("Connector creation did not return the connector")
+    return connectors[0]
+
+
+def configure_iam(qualys_client, connector, account_id, invocation_id):
+    """
+    Provisioning step that sets up the role assumed by Qualys on the account.
+
+    Returns:
+        (IAMSetupResult): The result of the setup.
+    """
+    iam_setup = setup_iam(
+        qualys_base_account_id=qualys_client.base_account_id,
+        external_id=connector.external_id,
+        account_id=account_id,
+        invocation_id=invocation_id
+    )
+    if not iam_setup.ok:
+        message = f"IAM setup failed on {iam_setup.failed_step}: {iam_setup.error}"
+        if is_transient_error(iam_setup.error):
+            raise RetryableError(message) from iam_setup.error
+        raise IAMSetupError(message) from iam_setup.error
+    return iam_setup
+
+
+def activate_connector(qualys_client, connector, role_arn):
+    """
+    Provisioning step that activates the connector with the role set up on the account.
+
+    Returns:
+        (bool): True if the connector was activated, False otherwise.
+    """
+    response, connector_activation_status = qualys_client.activate_aws_connector(
+        connector_id=connector.id,
+        role_arn=role_arn
+    )
+    if not connector_activation_status and response.status_code in RETRYABLE_STATUS_CODES:
+        raise RetryableError(f"Connector activation failed (HTTP {response.status_code})")
+    return connector_activation_status
+
+
+def wait_for_connector_state(qualys_client, connector_id, max_wait, initial_delay=1, max_delay=8):
+    """
+    Provisioning step that polls the connector, by ID, until its state leaves the transitional values (see
+     AWSConnector.in_transition) or the time is up. The delay between polls doubles while the state does not change,
+     and goes back to the initial delay when it does, since Qualys is then making progress.
+
+    Args:
+        qualys_client (QualysClient): The client used to get the connector.
+        connector_id (str): The ID of the connector.
+        max_wait (float): Maximum number of seconds to wait for a final state.
+        initial_delay (float): Seconds between the first polls. Defaults to 1.
+        max_delay (float): Maximum number of seconds between two polls. Defaults to 8.
+
+    Returns:
+        (AWSConnector): The connector, as last read. Its state may still be transitional, if the time was up.
+
+    Raises:
+        RetryableError: if the connector was not found, eg: the search index of Qualys did not catch up yet.
+    """
+    deadline = time.monotonic() + max(max_wait, 0)
+    delay = initial_delay
+    previous_state = None
+    span = tracing.current_span()
+    polls = 0
+    while True:
+        connector = qualys_client.get_aws_connector(connector_id)
+        polls += 1
+        if connector is None:
+            raise RetryableError(f"Connector {connector_id} was not found after its activation")
+        if span is not None:
+            span.set(Polls=polls, ConnectorState=connector.connector_state)
+        if not connector.in_transition:
+            return connector
+        time_left = deadline - time.monotonic()
+        if time_left <= 0:
+            print(f"{connector.name} connector is still {connector.connector_state} after {polls} polls.")
+            return connector
+        if previous_state is not None:
+            delay = initial_delay if connector.connector_state != previous_state else min(delay * 2, max_delay)
+        previous_state = connector.connector_state
+        time.sleep(min(delay, time_left))
+
+
+def scope_regions(account_id, invocation_id, region_scope):
+    """
+    Provisioning step that selects the regions synced by the connector of an account (see discover_regions). The
+     regions are an optimization, so the connector syncs all of them when they could not be discovered.
+
+    Args:
+        account_id (str): The ID of the account.
+        invocation_id (str): The ID of the invocation, used to name the assumed-role session.
+        region_scope (str): 'enabled' (the regions enabled on the account) or 'in_use' (the ones with EC2 instances).
+
+    Returns:
+        (list): The region codes. None for all the regions.
+    """
+    try:
+        regions = discover_regions(account_id, invocation_id, probe=region_scope == "in_use")
+    except Exception as err:
+        print(f"Could not discover the regions of account {account_id}, its connector will sync all of them: {err}")
+        return None
+    span = tracing.current_span()
+    if span is not None:
+        span.set(Regions=len(regions))
+    return regions
+
+
+def provision_account(qualys_client, account_name, account_id, invocation_id=None, retry_policy=None,
+                      state_store=None, state_wait=30, region_scope="all"):
+    """
+    Runs the provisioning pipeline for one account: creates the connector on Qualys, sets up the IAM role assumed by
+     Qualys on the account, activates the connector and notifies the result. A step that fails for a transient reason
+     is retried by itself, according to the retry policy, so the steps already done are not repeated. With a state
+     store, each completed step is checkpointed, and a rerun for the same account resumes after the last checkpoint.
+
+    Args:
+        qualys_client (QualysClient): The client used to manage the connector, and whose notifier sends the result.
+        account_name (str): The name of the account, also used as the connector name.
+        account_id (str): The ID of the account.
+        invocation_id (str): The ID of the invocation (eg: the Lambda request ID), used to trace the calls made on
+         the account. Defaults to None.
+        retry_policy (RetryPolicy): The retry policy of the steps. Defaults to a policy without deadline.
+        state_store (ProvisioningStateStore): The store of the checkpoints. Defaults to None (no checkpoints).
+        state_wait (float): Maximum number of seconds to wait for the activated connector to reach a final state,
+         which is reported in the notification. Bounded by the time left to the invocation. Defaults to 30.
+        region_scope (str): The regions synced by the connector: 'all', 'enabled' (the regions enabled on the account)
+         or 'in_use' (the enabled ones with EC2 instances, see discover_regions). Defaults to 'all'.
+
+    Returns:
+        (bool): True if the connector was created and activated, False otherwise.
+    """
+    retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+    state = state_store.load(account_id) if state_store is not None else ProvisioningState(account_id)
+
+    def checkpoint(step, **outputs):
+        state.completed_steps[step] = ProvisioningStateStore.now()
+        state.outputs.update(outputs)
+        if state_store is not None:
+            state_store.save_step(account_id, step, **outputs)
+
+    def discard(connector_name):
+        qualys_client.delete_aws_connector(connector_name)
+        if state_store is not None:
+            state_store.clear(account_id)
+
+    if state.is_done("notify"):
+        print(f"{account_name} was already provisioned.")
+        return True
+    create_attempts = 0
+
+    def create(regions):
+        nonlocal create_attempts
+        create_attempts += 1
+        return create_connector(qualys_client, account_name, regions, reuse_existing=create_attempts > 1)
+
+    try:
+        if state.is_done("create"):
+            connector = AWSConnector(id=state.get("connector_id"), name=state.get("connector_name"),
+                                     externalid=state.get("external_id"))
+        else:
+            regions = None
+            if region_scope in ("enabled", "in_use"):
+                with tracing.span("scope_regions"):
+                    regions = scope_regions(account_id, invocation_id, region_scope)
+            connector = retry_policy.run("create", create, regions)
+            if connector is None:
+                return False
+            try:
+                checkpoint("create", connector_id=connector.id, connector_name=connector.name,
+                           external_id=connector.external_id)
+            except CheckpointConflictError:
+                # A concurrent run (eg: a duplicate delivery) created its connector first and goes on with it
+                if state_store.load(account_id).get("connector_id") != connector.id:
+                    qualys_client.delete_aws_connectors([connector.id], field="id")
+                print(f"{account_name} is being provisioned by another run, {connector.name} connector is left to it.")
+                return True
+
+        if state.is_done("setup_iam"):
+            role_arn = state.get("role_arn")
+        else:
+            try:
+                iam_setup = retry_policy.run("setup_iam", configure_iam, qualys_client, connector, account_id,
+                                             invocation_id)
+            except Exception as err:
+                discard(connector.name)
+                raise IAMSetupError(f"{err}. {connector.name} connector was deleted.") from err
+            role_arn = iam_setup.role_arn
+            checkpoint("setup_iam", role_arn=role_arn)
+
+        if state.is_done("activate"):
+            connector_activation_status = state.get("activation_status")
+        else:
+            connector_activation_status = retry_policy.run("activate", activate_connector, qualys_client, connector,
+                                                           role_arn)
+            if not connector_activation_status:
+                discard(connector.name)
+                print(f"Not activated! {connector.name} connector was deleted.")
+                return False
+            checkpoint("activate", activation_status=connector_activation_status)
+
+        max_wait = min(state_wait, retry_policy.remaining_ms() / 1000)
+        try:
+            connector = retry_policy.run("wait_for_connector_state", wait_for_connector_state, qualys_client,
+                                         connector.id, max_wait)
+        except Exception as err:
+            # The connector is already activated (and checkpointed), so only its state is unknown
+            print(f"Could not read the state of {connector.name} connector: {err}")
+            connector.connector_state = "unknown"
+        connector.arn = role_arn
+        print(role_arn)
+        with tracing.span("notify"):
+            qualys_client.notifier.send_message(
+                on_success=True,
+                account_name=account_name,
+                account_id=account_id,
+                connector=connector,
+                creation_result=True,
+                activation_result=connector_activation_status
+            )
+        checkpoint("notify")
+        return True
+    except CheckpointConflictError as err:
+        # A concurrent run got ahead of this one, and completes the provisioning
+        print(f"{account_name} is being provisioned by another run: {err}")
+        return True
+    except Exception as err:
+        print(err)
+        with tracing.span("notify"):
+            qualys_client.notifier.send_message(
+                on_success=False,
+                account_name=account_name,
+                account_id=account_id,
+                error_message=err
+            )
+        return False
+
+
+def decommission_account(qualys_client, account_id, state_store=None):
+    """
+    Deletes the connectors of a closed (or removed) account, found by their AWS account ID, with a single bulk
+     deletion, and forgets the provisioning checkpoint of the account.
+
+    Args:
+        qualys_client (QualysClient): The client used to find and delete the connectors.
+        account_id (str): The ID of the account.
+        state_store (ProvisioningStateStore): The store of the checkpoints. Defaults to None (no checkpoints).
+
+    Returns:
+        (list): The IDs of the deleted connectors.
+    """
+    connector_ids = [connector.id for connector in qualys_client.get_aws_connectors_by_account_id(account_id)]
+    deleted_ids = qualys_client.delete_aws_connectors(connector_ids, field="id") if connector_ids else []
+    if state_store is not None:
+        state_store.clear(account_id)
+    print(f"Account {account_id} was closed. Deleted connectors: {', '.join(deleted_ids) or 'none'}.")
+    return deleted_ids
@@ -1,13 +1,58 @@
 from handlers.aws import AWSConnectorHanlder
-from botocore.vendored import requests
+from rate_limit import get_throttle
+from transport import get_transport
 import base64
 import os
+import tracing
 
 
 class QualysClientError(Exception):
     pass
 
 
+def read_api_credentials(prefix="QUALYS"):
+    """
+    Reads the Qualys API credentials from the environment variables.
+
+    Args:
+        prefix (str): Prefix of the variables, so each subscription can have its own, eg: 'QUALYS_RETAIL' for
+         QUALYS_RETAIL_API_USER, QUALYS_RETAIL_API_PASSWORD and QUALYS_RETAIL_BASE_ACCOUNT_ID. Defaults to 'QUALYS'.
+
+    Returns:
+        (tuple): (user_name, user_pass, base_account_id) of the Qualys subscription.
+
+    Raises:
+        QualysClientError: if any of the credentials is not set.
+    """
+    try:
+        return (os.environ[f"{prefix}_API_USER"], os.environ[f"{prefix}_API_PASSWORD"],
+                os.environ[f"{prefix}_BASE_ACCOUNT_ID"])
+    except KeyError:
+        raise QualysClientError("API credentials was not set on environment variables!")
+
+
+def next_page_offset(page_info, start_offset):
+    """
+    Checks the metadata of a search response page and returns where the next page starts.
+
+    Args:
+        page_info (dict): The page metadata, as filled by the connector decoders.
+        start_offset (int): The offset the page was requested from.
+
+    Returns:
+        (int): The offset of the next page. None if the page was the last one.
+
+    Raises:
+        QualysClientError: if the page was not successfully returned.
+    """
+    if page_info.get("responseCode") != "SUCCESS":
+        raise QualysClientError(f"Could not list connectors ({page_info.get('responseCode')})!")
+    count = int(page_info.get("count") or 0)
+    if page_info.get("hasMoreRecords") != "true" or count == 0:
+        return None
+    return start_offset + count
+
+
 class QualysClient:
     """
     Class that represents the Qualys client.
@@ -19,7 +64,8 @@ class QualysClient:
         __asset_management_endpoint (str): URL for Qualys the asset management API.
     """
 
-    def __init__(self, api_server_url, notifier, protocol="https"):
+    def __init__(self, api_server_url, notifier, protocol="https", connector_index=None, transport=None,
+                 pool_maxsize=10, inventory=None, credentials=None, throttle=None):
         """
         Constructor method of class Qualys.
 
@@ -27,17 +73,29 @@ class QualysClient:
             api_server_url (str):  The API server URL that you should use for API requests. Depends on the platform
              where your Qualys account is located.
             protocol (str): WEB protocol used in the communication. Defaults to 'https'.
+            connector_index (AWSConnectorIndex): optional index used to answer connector lookups by name or ID without
+             requesting Qualys again. Defaults to None (every lookup is requested).
+            transport (HTTPTransport): the HTTP transport used by the requests. Defaults to the transport shared by the
+             process, so connections are reused across clients and warm invocations.
+            pool_maxsize (int): maximum number of connections kept to the API server. Defaults to 10.
+            inventory (ConnectorInventory): optional local copy of the connectors of the subscription, synced
+             incrementally, used to answer the lookups and listings before requesting Qualys. Defaults to None.
+            credentials (tuple): (user_name, user_pass, base_account_id) of the Qualys subscription. Defaults to the
+             credentials set on the environment variables (see read_api_credentials).
+            throttle (AdaptiveThrottle): the throttle applied to every request, following the rate and concurrency
+             limits reported by Qualys. Defaults to the throttle shared by the clients of the same user and platform.
         """
-        try:
-            self.__user_name = os.environ["QUALYS_API_USER"]
-            self.__user_pass = os.environ["QUALYS_API_PASSWORD"]
-            self.__base_account_id = os.environ["QUALYS_BASE_ACCOUNT_ID"]
-            self.__auth_credentials = base64.b64encode(f"{self.__user_name}:{self.__user_pass}".encode()).decode()
-        except KeyError:
-            raise QualysClientError("API credentials was not set on environment variables!")
+        self.__user_name, self.__user_pass, self.__base_account_id = (
+            credentials if credentials is not None else read_api_credentials())
+        self.__auth_credentials = base64.b64encode(f"{self.__user_name}:{self.__user_pass}".encode()).decode()
         self.__api_server_url = api_server_url
         self.__protocol = protocol
         self.__notifier = notifier
+        self.__connector_index = connector_index
+        self.__inventory = inventory
+        self.__transport = transport if transport is not None else get_transport()
+        self.__transport.mount_host(api_server_url, pool_maxsize=pool_maxsize, protocol=protocol)
+        self.__throttle = throttle if throttle is not None else get_throttle(f"{self.__user_name}@{api_server_url}")
         self.__asset_management_endpoint = "qps/rest/3.0/search/am"
 
     @property
@@ -60,6 +118,44 @@ class QualysClient:
         """
         return self.__notifier
 
+    @property
+    def connector_index(self):
+        """
+        Read-only property. Returns the index used to cache connector lookups, if any.
+
+        Returns:
+            self.__connector_index (AWSConnectorIndex): the connector index, or None.
+        """
+        return self.__connector_index
+
+    @property
+    def inventory(self):
+        """
+        Read-only property. Returns the local connector inventory, if any.
+
+        Returns:
+            self.__inventory (ConnectorInventory): the connector inventory, or None.
+        """
+        return self.__inventory
+
+    def sync_inventory(self, force_full=False):
+        """
+        Brings the connector inventory up to date, requesting only the connectors created or synced since its last
+         sync, unless a full sync is due (see ConnectorInventory.sync).
+
+        Args:
+            force_full (bool): if True, all the connectors are requested. Defaults to False.
+
+        Returns:
+            (str): 'full' or 'incremental', the kind of sync made. None if the inventory was fresh or there is none.
+        """
+        if self.__inventory is None:
+            return None
+        with tracing.span("inventory_sync") as span:
+            kind = self.__inventory.sync(lambda criteria: self.iter_aws_connectors(criteria=criteria), force_full)
+            span.set(SyncKind=kind or "none")
+        return kind
+
     def __make_basic_get_request(self, endpoint: str, params, object_category: str):
         """
         Makes a GET request to the API endpoint, passing the payload as parameter, then return the response.
@@ -73,28 +169,35 @@ class QualysClient:
              response: request response XML data.
         """
         full_url = f"{self.__protocol}://{self.__api_server_url}/{endpoint}/{object_category}"
-        response = requests.get(url=full_url,
-                                params=params,
-                                verify=False,
-                                auth=(self.__user_name, self.__user_pass))
+        response = self.__transport.get(url=full_url,
+                                        params=params,
+                                        auth=(self.__user_name, self.__user_pass),
+                                        throttle=self.__throttle)
         return response
 
-    def __make_basic_post_request(self, endpoint: str, object_category: str, headers: dict, data):
+    def __make_basic_post_request(self, endpoint: str, object_category: str, headers: dict, data, stream=False,
+                                  idempotent=True):
         """
         Makes a POST request to the API endpoint, passing the payload as parameter, then return the response.
 
         Args:
             endpoint: the API URL that will receive de request.
             object_category: the category of the item, eg: 'assetdataconnector' or 'hostasset'.
+            stream (bool): if True, the response body is not downloaded upfront and can be consumed through
+             response.raw. Defaults to False.
+            idempotent (bool): whether the request can be safely retried after it was sent. Defaults to True.
 
         Returns:
              response: request response XML data.
         """
         full_url = f"{self.__protocol}://{self.__api_server_url}/{endpoint}/{object_category}"
-        response = requests.post(url=full_url,
-                                 data=data,
-                                 headers=headers,
-                                 auth=(self.__user_name, self.__user_pass))
+        response = self.__transport.post(url=full_url,
+                                         data=data,
+                                         headers=headers,
+                                         auth=(self.__user_name, self.__user_pass),
+                                         stream=stream,
+                                         idempotent=idempotent,
+                                         throttle=self.__throttle)
         return response
 
     def get_aws_connectors(self):
@@ -112,33 +215,200 @@ class QualysClient:
         response = self.__make_basic_post_request(self.__asset_management_endpoint, object_category, headers, data)
         return response
 
-    def get_aws_connector_by_name(self, connector_name):
+    def iter_aws_connectors(self, page_size=100, criteria=None):
+        """
+        Iterates over all the created connectors, one page at a time. Each page is requested with the
+         'startFromOffset'/'limitResults' preferences and parsed incrementally from the response stream, so only the
+         connector being yielded is kept in memory, no matter how many connectors exist in the subscription.
+
+        Args:
+            page_size (int): Maximum number of connectors requested per page. Defaults to 100.
+            criteria (list): optional (field, operator, value) tuples sent as search filters, so only the matching
+             connectors are returned by Qualys, eg: [("name", "EQUALS", "my-account-prd")].
+
+        Yields:
+            connector (AWSConnector): each connector of the subscription.
+
+        Raises:
+            QualysClientError: if a page could not be retrieved.
+        """
+        headers = {
+            'content-type': 'text/xml',
+        }
+        object_category = "awsassetdataconnector"
+        start_offset = 1
+        while True:
+            data = AWSConnectorHanlder.handle_connector_search_xml(start_offset, page_size, criteria)
+            response = self.__make_basic_post_request(self.__asset_management_endpoint, object_category, headers, data,
+                                                      stream=True)
+            page_info = {}
+            try:
+                if response.status_code != 200:
+                    raise QualysClientError(f"Could not list connectors (HTTP {response.status_code})!")
+                response.raw.decode_content = True
+                for connector in AWSConnectorHanlder.iter_xml_connectors(response.raw, page_info):
+                    yield connector
+            finally:
+                span = tracing.current_span()
+                if span is not None:
+                    span.add(BytesReceived=response.raw.tell())
+                response.close()
+            start_offset = next_page_offset(page_info, start_offset)
+            if start_offset is None:
+                return
+
+    def list_aws_connectors(self, force_full=False):
+        """
+        Iterates over all the created connectors. When the client has a connector inventory, it is synced and the
+         connectors are read from it, else they are requested page by page (see iter_aws_connectors).
+
+        Args:
+            force_full (bool): if True, the inventory is fully synced first, so the connectors deleted or changed
+             without the client knowing are not listed stale. Defaults to False.
+
+        Yields:
+            connector (AWSConnector): each connector of the subscription.
         """
-        Get an AWS EC2 Connector by its name. The method first get all connectors then iterate over them till find the
-         requested and returns it.
+        if self.__inventory is None:
+            yield from self.iter_aws_connectors()
+            return
+        self.sync_inventory(force_full)
+        yield from self.__inventory
+
+    def get_aws_connector_by_name(self, connector_name, use_index=True):
+        """
+        Get an AWS EC2 Connector by its name. The name is sent as a search filter, so Qualys only returns the requested
+         connector. When the client has a connector index, a fresh indexed connector is returned without any request,
+         and then, when it has a connector inventory, the connector is read from the synced inventory.
 
         Args:
             connector_name: The name of the Connector.
+            use_index (bool): if False, the connector index and inventory are bypassed and the connector is requested
+             (and re-indexed). Defaults to True.
+
+        Returns:
+            connector (AWSConnector): The found connector. None if no connector with especified name was found.
+        """
+        if use_index and self.__connector_index is not None:
+            connector = self.__connector_index.get_by_name(connector_name)
+            if connector is not None:
+                return connector
+        if use_index and self.__inventory is not None:
+            self.sync_inventory()
+            connector = self.__inventory.get_by_name(connector_name)
+            if connector is not None:
+                return connector
+        return self.__find_aws_connector("name", connector_name)
+
+    def get_aws_connector_by_id(self, connector_id, use_index=True):
+        """
+        Get an AWS EC2 Connector by its ID. The ID is sent as a search filter, so Qualys only returns the requested
+         connector. When the client has a connector index, a fresh indexed connector is returned without any request,
+         and then, when it has a connector inventory, the connector is read from the synced inventory.
+
+        Args:
+            connector_id (str): The ID of the Connector.
+            use_index (bool): if False, the connector index and inventory are bypassed and the connector is requested
+             (and re-indexed). Defaults to True.
+
+        Returns:
+            connector (AWSConnector): The found connector. None if no connector with especified ID was found.
+        """
+        if use_index and self.__connector_index is not None:
+            connector = self.__connector_index.get_by_id(connector_id)
+            if connector is not None:
+                return connector
+        if use_index and self.__inventory is not None:
+            self.sync_inventory()
+            connector = self.__inventory.get_by_id(connector_id)
+            if connector is not None:
+                return connector
+        return self.__find_aws_connector("id", str(connector_id))
+
+    def get_aws_connectors_by_account_id(self, account_id):
+        """
+        Get the AWS EC2 Connectors of an AWS account, read from the synced connector inventory when the client has one,
+         else requested with the account ID as search filter.
+
+        Args:
+            account_id (str): The ID of the AWS account.
+
+        Returns:
+            (list): The connectors of the account, usually one. Empty if the account has none.
+        """
+        if self.__inventory is not None:
+            self.sync_inventory()
+            connectors = self.__inventory.get_by_account_id(account_id)
+            if connectors:
+                return connectors
+        connectors = [connector for connector in
+                      self.iter_aws_connectors(criteria=[("awsAccountId", "EQUALS", account_id)])
+                      if connector.aws_account_id == account_id]
+        if self.__inventory is not None:
+            for connector in connectors:
+                self.__inventory.add(connector)
+        return connectors
+
+    def __find_aws_connector(self, field, value):
+        """
+        Searches the connector whose field is equal to the given value, indexing it (and storing it in the inventory)
+         when found.
+
+        Args:
+            field (str): The connector field used as filter, eg: 'name' or 'id'.
+            value (str): The expected value of the field.
 
         Returns:
-            connector (request.Response): XML containing the data about the found connector. None if no connector with
-             especified name was found.
+            connector (AWSConnector): The found connector. None if no connector matches.
         """
-        all_connectors = self.get_aws_connectors().text
-        connectors_as_dict = AWSConnectorHanlder.xml_to_dict(all_connectors)
-        connectors_as_object = AWSConnectorHanlder.dict_to_object(connectors_as_dict)
-        for connector in connectors_as_object:
-            if connector.name == connector_name:
+        for connector in self.iter_aws_connectors(page_size=10, criteria=[(field, "EQUALS", value)]):
+            if getattr(connector, field) == value:
+                if self.__connector_index is not None:
+                    self.__connector_index.add(connector)
+                if self.__inventory is not None:
+                    self.__inventory.add(connector)
                 return connector
         return None
 
-    def create_aws_connector(self, connector_name):
+    def get_aws_connector(self, connector_id):
+        """
+        Gets one AWS EC2 Connector by its ID through the 'get' endpoint, which returns only that connector, eg: to read
+         its current state. The connector index and inventory are updated with the returned connector.
+
+        Args:
+            connector_id (str): The ID of the Connector.
+
+        Returns:
+            connector (AWSConnector): The connector. None if no connector with especified ID was found.
+
+        Raises:
+            QualysClientError: if the connector could not be retrieved.
+        """
+        api_endpoint = "qps/rest/3.0/get/am"
+        object_category = "awsassetdataconnector"
+        response = self.__make_basic_get_request(api_endpoint, None, f"{object_category}/{connector_id}")
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise QualysClientError(f"Could not get connector {connector_id} (HTTP {response.status_code})!")
+        connectors = AWSConnectorHanlder.xml_to_objects(response.content)
+        if not connectors:
+            return None
+        if self.__connector_index is not None:
+            self.__connector_index.add(connectors[0])
+        if self.__inventory is not None:
+            self.__inventory.add(connectors[0])
+        return connectors[0]
+
+    def create_aws_connector(self, connector_name, regions=None):
         """
         Create an AWS EC2 Connector. By default, the connector will be in disabled state. To active, call the
          activate_aws_connector method.
 
         Args:
             connector_name (str): The name of the connector to be created.
+            regions (list): Codes of the regions synced by the connector, eg: ["us-east-1"]. Defaults to None (all the
+             regions).
 
         Returns:
             (response (response.Response), status (bool)) (tuple): Tuple containing the response object of the request
@@ -150,11 +420,12 @@ class QualysClient:
 
         api_endpoint = "qps/rest/2.0/create/am"
         object_category = "awsassetdataconnector"
-        connector_creation_xml_data = AWSConnectorHanlder.handle_connector_creation_xml(connector_name)
+        connector_creation_xml_data = AWSConnectorHanlder.handle_connector_creation_xml(connector_name, regions)
         response = self.__make_basic_post_request(endpoint=api_endpoint,
                                                   object_category=object_category,
                                                   headers=headers,
-                                                  data=connector_creation_xml_data)
+                                                  data=connector_creation_xml_data,
+                                                  idempotent=False)
         status = True if response.status_code == 200 else False
         return response, status
 
@@ -178,6 +449,10 @@ class QualysClient:
         api_endpoint = "qps/rest/2.0/update/am"
         object_category = "awsassetdataconnector"
         activation_xml = AWSConnectorHanlder.handle_connector_activation_xml(role_arn)
+        if self.__connector_index is not None:
+            self.__connector_index.invalidate(connector_id=connector_id)
+        if self.__inventory is not None:
+            self.__inventory.discard(connector_id=connector_id)
         response = self.__make_basic_post_request(endpoint=api_endpoint,
                                                   object_category=f"{object_category}/{connector_id}",
                                                   headers=headers,
@@ -201,6 +476,10 @@ class QualysClient:
         }
 
         deletion_xml = AWSConnectorHanlder.handle_connector_deletion_xml(connector_name)
+        if self.__connector_index is not None:
+            self.__connector_index.invalidate(connector_name=connector_name)
+        if self.__inventory is not None:
+            self.__inventory.discard(connector_name=connector_name)
         api_endpoint = "qps/rest/2.0/delete/am"
         object_category = "awsassetdataconnector"
         response = self.__make_basic_post_request(endpoint=api_endpoint,
@@ -208,3 +487,56 @@ class QualysClient:
                                                   headers=headers,
                                                   data=deletion_xml)
         return response
+
+    def delete_aws_connectors(self, values, field="id", batch_size=100):
+        """
+        Deletes many Qualys AWS EC2 connectors, by ID or by name. Each request selects up to batch_size connectors
+         with a single IN criteria, so cleaning up hundreds of connectors takes a few requests.
+
+        Args:
+            values (list): IDs (or names) of the connectors to be removed. They must not contain commas, which
+             separate the values of the IN criteria.
+            field (str): The field used to select the connectors, 'id' or 'name'. Defaults to 'id'.
+            batch_size (int): Maximum number of connectors selected per request. Defaults to 100.
+
+        Returns:
+            (list): The IDs of the deleted connectors, as returned by Qualys.
+
+        Raises:
+            ValueError: if a value contains a comma. Nothing is deleted.
+            QualysClientError: if a deletion request failed. The connectors of the previous requests were deleted.
+        """
+        headers = {
+            'Content-type': 'text/xml',
+        }
+
+        api_endpoint = "qps/rest/2.0/delete/am"
+        object_category = "awsassetdataconnector"
+        values = [str(value) for value in values]
+        invalid = [value for value in values if "," in value]
+        if invalid:
+            raise ValueError(f"Connectors can't be selected by a {field} containing a comma: {invalid}")
+        deleted_ids = []
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            if self.__connector_index is not None:
+                for value in batch:
+                    if field == "id":
+                        self.__connector_index.invalidate(connector_id=value)
+                    else:
+                        self.__connector_index.invalidate(connector_name=value)
+            if self.__inventory is not None:
+                for value in batch:
+                    if field == "id":
+                        self.__inventory.discard(connector_id=value)
+                    else:
+                        self.__inventory.discard(connector_name=value)
+            deletion_xml = AWSConnectorHanlder.handle_connectors_deletion_xml(batch, field=field)
+            response = self.__make_basic_post_request(endpoint=api_endpoint,
+                                                      object_category=object_category,
+                                                      headers=headers,
+                                                      data=deletion_xml)
+            if response.status_code != 200:
+                raise QualysClientError(f"Could not delete connectors (HTTP {response.status_code})!")
+            deleted_ids.extend(connector.id for connector in AWSConnectorHanlder.xml_to_objects(response.content))
+        return deleted_ids
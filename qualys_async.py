@@ -0,0 +1,257 @@
+from handlers.aws import AWSConnectorHanlder, ConnectorStreamDecoder
+from qualys import QualysClientError, next_page_offset, read_api_credentials
+from transport import full_jitter_backoff
+from collections import namedtuple
+import aiohttp
+import asyncio
+
+AsyncResponse = namedtuple("AsyncResponse", ["status_code", "content", "headers"])
+
+
+class AsyncQualysClient:
+    """
+    Class that represents the asyncio counterpart of QualysClient. It builds the same requests and decodes the same
+     responses as the synchronous client, but many calls can be in flight at once on one event loop. The number of
+     concurrent calls is bounded by a semaphore, so hundreds of connector operations can be gathered without exceeding
+     the concurrency allowed by the subscription.
+
+    The client must be used as an async context manager, which opens and closes its HTTP session:
+
+        async with AsyncQualysClient("qualysapi.qg3.apps.qualys.com", max_in_flight=10) as client:
+            results = await asyncio.gather(*(client.create_aws_connector(name) for name in names))
+
+    Attributes:
+        __semaphore (asyncio.Semaphore): bounds the number of requests in flight. Created when the session is opened,
+         so it belongs to the running event loop, not to the one current when the client was built.
+        __session (aiohttp.ClientSession): the HTTP session, open while the context manager is active.
+    """
+
+    retryable_status_codes = (500, 502, 503, 504)
+
+    def __init__(self, api_server_url, notifier=None, protocol="https", max_in_flight=10, connect_timeout=5,
+                 read_timeout=60, max_retries=3, backoff_base=0.5, backoff_max=10):
+        """
+        Constructor method of class AsyncQualysClient.
+
+        Args:
+            api_server_url (str):  The API server URL that you should use for API requests. Depends on the platform
+             where your Qualys account is located.
+            notifier: optional Notifier object, used to send notifications. Defaults to None.
+            protocol (str): WEB protocol used in the communication. Defaults to 'https'.
+            max_in_flight (int): maximum number of requests in flight at once. Defaults to 10.
+            connect_timeout (float): seconds to wait for the connection to be established. Defaults to 5.
+            read_timeout (float): seconds to wait for the server to send data. Defaults to 60.
+            max_retries (int): maximum number of retries of a failed request. Defaults to 3.
+            backoff_base (float): base delay, in seconds, of the exponential backoff. Defaults to 0.5.
+            backoff_max (float): maximum delay, in seconds, between two attempts. Defaults to 10.
+        """
+        self.__user_name, self.__user_pass, self.__base_account_id = read_api_credentials()
+        self.__api_server_url = api_server_url
+        self.__protocol = protocol
+        self.__notifier = notifier
+        self.__max_in_flight = max_in_flight
+        self.__timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        self.__max_retries = max_retries
+        self.__backoff_base = backoff_base
+        self.__backoff_max = backoff_max
+        self.__semaphore = None
+        self.__session = None
+
+    @property
+    def base_account_id(self):
+        """
+        Read-only property. Returns the Qualys Base Account ID, used to create the Role on the created account.
+
+        Returns:
+            self.__base_account_id (str): Qualys Base Account ID
+        """
+        return self.__base_account_id
+
+    @property
+    def notifier(self):
+        """
+        Read-only property. Returns the Notifier object, used to send notifications.
+
+        Returns:
+            self.__notifier: the Notifier object, or None.
+        """
+        return self.__notifier
+
+    async def __aenter__(self):
+        self.__semaphore = asyncio.Semaphore(self.__max_in_flight)
+        self.__session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self.__max_in_flight),
+            auth=aiohttp.BasicAuth(self.__user_name, self.__user_pass),
+            timeout=self.__timeout
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Closes the HTTP session and its connections."""
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+            self.__semaphore = None
+
+    async def __make_basic_post_request(self, endpoint, object_category, data, idempotent=True):
+        """
+        Makes a POST request to the API endpoint, retrying it on connection errors and 5xx responses, then return the
+         response.
+
+        Args:
+            endpoint (str): the API URL that will receive de request.
+            object_category (str): the category of the item, eg: 'awsassetdataconnector'.
+            data (str): the request XML.
+            idempotent (bool): whether the request can be safely retried after it was sent. Defaults to True.
+
+        Returns:
+            response (AsyncResponse): the status code, content and headers of the response.
+        """
+        if self.__session is None:
+            raise QualysClientError("The client session is not open! Use the client as an async context manager.")
+        full_url = f"{self.__protocol}://{self.__api_server_url}/{endpoint}/{object_category}"
+        headers = {
+            'Content-type': 'text/xml',
+        }
+        attempt = 0
+        while True:
+            try:
+                async with self.__semaphore:
+                    async with self.__session.post(full_url, data=data, headers=headers) as response:
+                        content = await response.read()
+                        result = AsyncResponse(response.status, content, response.headers)
+            except aiohttp.ClientConnectorError:
+                if attempt >= self.__max_retries:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if not idempotent or attempt >= self.__max_retries:
+                    raise
+            else:
+                retryable = idempotent and result.status_code in self.retryable_status_codes
+                if not retryable or attempt >= self.__max_retries:
+                    return result
+            await asyncio.sleep(full_jitter_backoff(attempt, self.__backoff_base, self.__backoff_max))
+            attempt += 1
+
+    async def __search_page(self, start_offset, page_size, criteria):
+        """
+        Requests one page of the connector search and decodes it as the response arrives.
+
+        Returns:
+            (tuple): (connectors, page_info) of the page.
+        """
+        if self.__session is None:
+            raise QualysClientError("The client session is not open! Use the client as an async context manager.")
+        full_url = f"{self.__protocol}://{self.__api_server_url}/qps/rest/3.0/search/am/awsassetdataconnector"
+        data = AWSConnectorHanlder.handle_connector_search_xml(start_offset, page_size, criteria)
+        decoder = ConnectorStreamDecoder()
+        connectors = []
+        async with self.__semaphore:
+            async with self.__session.post(full_url, data=data, headers={'content-type': 'text/xml'}) as response:
+                if response.status != 200:
+                    raise QualysClientError(f"Could not list connectors (HTTP {response.status})!")
+                async for chunk in response.content.iter_chunked(65536):
+                    connectors.extend(decoder.feed(chunk))
+        connectors.extend(decoder.close())
+        return connectors, decoder.page_info
+
+    async def iter_aws_connectors(self, page_size=100, criteria=None):
+        """
+        Iterates over all the created connectors, one page at a time. Only one page of connectors is kept in memory,
+         and the in-flight slot is released before the connectors of the page are yielded.
+
+        Args:
+            page_size (int): Maximum number of connectors requested per page. Defaults to 100.
+            criteria (list): optional (field, operator, value) tuples sent as search filters.
+
+        Yields:
+            connector (AWSConnector): each connector of the subscription.
+
+        Raises:
+            QualysClientError: if a page could not be retrieved.
+        """
+        start_offset = 1
+        while start_offset is not None:
+            connectors, page_info = await self.__search_page(start_offset, page_size, criteria)
+            for connector in connectors:
+                yield connector
+            start_offset = next_page_offset(page_info, start_offset)
+
+    async def get_aws_connectors(self, page_size=100, criteria=None):
+        """
+        Get all the created connectors.
+
+        Args:
+            page_size (int): Maximum number of connectors requested per page. Defaults to 100.
+            criteria (list): optional (field, operator, value) tuples sent as search filters.
+
+        Returns:
+            (list): The AWSConnector objects of all the created connectors.
+        """
+        return [connector async for connector in self.iter_aws_connectors(page_size, criteria)]
+
+    async def get_aws_connector_by_name(self, connector_name):
+        """
+        Get an AWS EC2 Connector by its name. The name is sent as a search filter, so Qualys only returns the requested
+         connector.
+
+        Args:
+            connector_name (str): The name of the Connector.
+
+        Returns:
+            connector (AWSConnector): The found connector. None if no connector with especified name was found.
+        """
+        async for connector in self.iter_aws_connectors(page_size=10, criteria=[("name", "EQUALS", connector_name)]):
+            if connector.name == connector_name:
+                return connector
+        return None
+
+    async def create_aws_connector(self, connector_name):
+        """
+        Create an AWS EC2 Connector. By default, the connector will be in disabled state. To active, call the
+         activate_aws_connector method.
+
+        Args:
+            connector_name (str): The name of the connector to be created.
+
+        Returns:
+            (response (AsyncResponse), status (bool)) (tuple): Tuple containing the response of the request and a
+             boolean value based on the status code (true if 200, false otherwise).
+        """
+        connector_creation_xml_data = AWSConnectorHanlder.handle_connector_creation_xml(connector_name)
+        response = await self.__make_basic_post_request("qps/rest/2.0/create/am", "awsassetdataconnector",
+                                                        connector_creation_xml_data, idempotent=False)
+        return response, response.status_code == 200
+
+    async def activate_aws_connector(self, connector_id, role_arn):
+        """
+        Activate the Connector and sets the use for Cloud View. The connector must be created already.
+
+        Args:
+            connector_id (str): ID for the created connector.
+            role_arn (str): ARN for the role existing in the created accout for Qualys to assume.
+
+        Returns:
+            (response (AsyncResponse), status (bool)) (tuple): Tuple containing the response of the request and a
+             boolean value based on the status code (true if 200, false otherwise).
+        """
+        activation_xml = AWSConnectorHanlder.handle_connector_activation_xml(role_arn)
+        response = await self.__make_basic_post_request("qps/rest/2.0/update/am",
+                                                        f"awsassetdataconnector/{connector_id}", activation_xml)
+        return response, response.status_code == 200
+
+    async def delete_aws_connector(self, connector_name):
+        """Deletes a Qualys AWS EC2 connector by name.
+
+        Args:
+            connector_name (str): Name of the connector to be removed.
+
+        Returns:
+            response (AsyncResponse): the response of the request.
+
+        """
+        deletion_xml = AWSConnectorHanlder.handle_connector_deletion_xml(connector_name)
+        return await self.__make_basic_post_request("qps/rest/2.0/delete/am", "awsassetdataconnector", deletion_xml)
@@ -0,0 +1,218 @@
+from transport import retry_after_delay
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Class that represents a token bucket rate limiter. Tokens are added at a constant rate, up to the capacity of the
+     bucket, and each request takes one, so short bursts up to the capacity are allowed while the average rate never
+     goes above the configured one.
+
+    Attributes:
+        __rate (float): Tokens added per second.
+        __capacity (float): Maximum number of tokens kept in the bucket.
+        __tokens (float): Tokens currently available.
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        Constructor method of class TokenBucket.
+
+        Args:
+            rate (float): Tokens added per second, ie: the sustained number of requests per second.
+            capacity (float): Maximum number of tokens kept in the bucket, ie: the size of the allowed bursts.
+             Defaults to 1.
+        """
+        if rate <= 0:
+            raise ValueError("The rate of the bucket must be positive")
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__tokens = capacity
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self, now):
+        self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated_at) * self.__rate)
+        self.__updated_at = now
+
+    def acquire(self, timeout=None):
+        """
+        Takes a token from the bucket, waiting for it to be refilled if it is empty.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait. Defaults to None (wait as long as needed).
+
+        Returns:
+            (bool): True if a token was taken, False if the timeout would expire first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__refill(now)
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return True
+                delay = (1 - self.__tokens) / self.__rate
+            if deadline is not None and now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """
+        Empties the bucket for a number of seconds, eg: when the server answered with a Retry-After header, so no
+         request is made before it allows.
+
+        Args:
+            seconds (float): Seconds without tokens.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__refill(now)
+            self.__tokens = min(self.__tokens, 1 - seconds * self.__rate)
+
+
+def _header_number(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class AdaptiveThrottle:
+    """
+    Class that represents a client-side throttle of the requests to an API that enforces rate and concurrency limits
+     and reports them in the response headers, as Qualys does (X-RateLimit-* and X-Concurrency-Limit-*). It is shared
+     by the threads making requests with the same credentials, and:
+    - bounds the requests in flight to the X-Concurrency-Limit-Limit of the last response (or max_concurrency, until a
+      response tells the limit);
+    - paces the requests at the allowed rate (X-RateLimit-Limit per X-RateLimit-Window-Sec) once few requests are left
+      in the window (X-RateLimit-Remaining), instead of using them up in a burst;
+    - holds every request for the X-RateLimit-ToWait-Sec (or Retry-After) of a throttled response.
+
+    Attributes:
+        __limit (int): Maximum number of requests in flight. None if unknown.
+        __in_flight (int): Number of requests in flight.
+        __blocked_until (float): Monotonic time before which no request is started.
+        __interval (float): Minimum number of seconds between the start of two requests. 0 when no pacing is needed.
+    """
+
+    throttled_status_codes = (409, 429)
+
+    def __init__(self, max_concurrency=None, max_wait=120, max_waits=5, pacing_threshold=0.1):
+        """
+        Constructor method of class AdaptiveThrottle.
+
+        Args:
+            max_concurrency (int): Maximum number of requests in flight until a response tells the limit. Defaults to
+             None (unbounded).
+            max_wait (float): Maximum number of seconds a throttled request waits before being retried. Longer waits
+             are returned to the caller as failures. Defaults to 120.
+            max_waits (int): Maximum number of times a request is retried after being throttled. Defaults to 5.
+            pacing_threshold (float): Fraction of the rate limit left in the window below which the requests are
+             paced. Defaults to 0.1.
+        """
+        self.max_wait = max_wait
+        self.max_waits = max_waits
+        self.__pacing_threshold = pacing_threshold
+        self.__limit = max_concurrency
+        self.__in_flight = 0
+        self.__blocked_until = 0
+        self.__interval = 0
+        self.__next_start = 0
+        self.__condition = threading.Condition()
+
+    @property
+    def concurrency_limit(self):
+        return self.__limit
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits until a request can be started (a free slot of the concurrency limit, past any advertised wait and
+         respecting the pacing), and holds the slot while the request runs.
+        """
+        with self.__condition:
+            while True:
+                now = time.monotonic()
+                delay = max(self.__blocked_until, self.__next_start) - now
+                if self.__limit is not None and self.__in_flight >= self.__limit:
+                    self.__condition.wait(delay if delay > 0 else None)
+                elif delay > 0:
+                    self.__condition.wait(delay)
+                else:
+                    break
+            self.__in_flight += 1
+            self.__next_start = now + self.__interval
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__in_flight -= 1
+                self.__condition.notify_all()
+
+    def update(self, response):
+        """
+        Adjusts the throttle to the limits reported by a response.
+
+        Args:
+            response (requests.Response): The response.
+
+        Returns:
+            (float): Seconds to wait before retrying the request, if it was rejected for exceeding a limit. None if it
+             was not.
+        """
+        headers = response.headers
+        concurrency_limit = _header_number(headers, "X-Concurrency-Limit-Limit")
+        concurrency_running = _header_number(headers, "X-Concurrency-Limit-Running")
+        rate_limit = _header_number(headers, "X-RateLimit-Limit")
+        window = _header_number(headers, "X-RateLimit-Window-Sec")
+        remaining = _header_number(headers, "X-RateLimit-Remaining")
+        to_wait = _header_number(headers, "X-RateLimit-ToWait-Sec") or retry_after_delay(response, 0)
+        wait = None
+        if response.status_code in self.throttled_status_codes:
+            if to_wait > 0:
+                wait = to_wait
+            elif response.status_code == 429 or remaining == 0 or (
+                    concurrency_limit is not None and concurrency_running is not None
+                    and concurrency_running >= concurrency_limit):
+                # Rejected without an advertised wait (eg: requests of other clients took the concurrency slots)
+                wait = 1
+        with self.__condition:
+            now = time.monotonic()
+            if concurrency_limit is not None:
+                self.__limit = max(int(concurrency_limit), 1)
+            if wait or to_wait > 0:
+                self.__blocked_until = max(self.__blocked_until, now + (wait or to_wait))
+            if rate_limit and window and remaining is not None:
+                # Paced once the requests left could all be taken by the ones in flight, or nearly all are used
+                threshold = max(rate_limit * self.__pacing_threshold, self.__in_flight)
+                self.__interval = window / rate_limit if remaining <= threshold else 0
+            self.__condition.notify_all()
+        return wait
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def get_throttle(key):
+    """
+    Returns the throttle shared by the clients of the process that use the same API limits (eg: the same Qualys user
+     on the same platform), creating it on the first call, so it persists across warm Lambda invocations.
+
+    Args:
+        key (str): Identifies the limits, eg: 'user@qualysapi.qg3.apps.qualys.com'.
+
+    Returns:
+        (AdaptiveThrottle): The shared throttle, bounded to QUALYS_MAX_CONCURRENCY requests in flight (if set) until
+         Qualys reports its limit.
+    """
+    with _throttles_lock:
+        if key not in _throttles:
+            _throttles[key] = AdaptiveThrottle(max_concurrency=int(os.environ.get("QUALYS_MAX_CONCURRENCY", 0)) or None,
+                                               max_wait=float(os.environ.get("QUALYS_THROTTLE_MAX_WAIT", 120)))
+        return _throttles[key]
@@ -0,0 +1,173 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+
+OrganizationAccount = namedtuple("OrganizationAccount", ["id", "name", "status"])
+ConnectorKey = namedtuple("ConnectorKey", ["id", "name", "aws_account_id"])
+# Statuses of the accounts closed in the organization (see ListAccounts), whose connectors can be swept
+CLOSED_ACCOUNT_STATUSES = ("SUSPENDED", "PENDING_CLOSURE")
+
+
+def iter_organization_accounts(organizations_client=None):
+    """
+    Iterates over all the accounts of the AWS Organization, one page of the ListAccounts API at a time.
+
+    Args:
+        organizations_client: The Organizations client. Defaults to the client of the process (see role_assignment).
+
+    Yields:
+        (OrganizationAccount): The ID, name and status of each account.
+    """
+    if organizations_client is None:
+        from role_assignment import get_boto_client
+        organizations_client = get_boto_client('organizations')
+    for page in organizations_client.get_paginator('list_accounts').paginate():
+        for account in page['Accounts']:
+            yield OrganizationAccount(account['Id'], account['Name'], account['Status'])
+
+
+class ConnectorJoinIndex:
+    """
+    Class that represents the build side of the hash join between the connectors and the accounts. Only the key
+     fields of each connector are kept (not the AWSConnector objects), indexed by AWS account ID and by name, so the
+     accounts can be streamed and matched in constant time each. An account may have several connectors (eg:
+     duplicates left by a retried creation), and all of them are matched, so none is taken as an orphan.
+
+    Attributes:
+        connectors (dict): Maps the connector IDs to their ConnectorKey.
+        matched_ids (set): IDs of the connectors matched by an account so far.
+    """
+
+    def __init__(self, connectors):
+        """
+        Constructor method of class ConnectorJoinIndex.
+
+        Args:
+            connectors: Iterable of AWSConnector objects, eg: QualysClient.iter_aws_connectors().
+        """
+        self.connectors = {}
+        self.matched_ids = set()
+        self.__by_account_id = {}
+        self.__by_name = {}
+        for connector in connectors:
+            key = ConnectorKey(connector.id, connector.name, connector.aws_account_id)
+            self.connectors[key.id] = key
+            if key.aws_account_id:
+                self.__by_account_id.setdefault(key.aws_account_id, []).append(key.id)
+            self.__by_name.setdefault(key.name, []).append(key.id)
+
+    def match(self, account):
+        """
+        Finds the connectors of an account, by account ID and, for connectors not activated yet, by name.
+
+        Args:
+            account (OrganizationAccount): The account.
+
+        Returns:
+            (ConnectorKey): The first connector of the account. None if the account has no connector.
+        """
+        connector_ids = self.__by_account_id.get(account.id, []) + self.__by_name.get(account.name, [])
+        if not connector_ids:
+            return None
+        self.matched_ids.update(connector_ids)
+        return self.connectors[connector_ids[0]]
+
+    def unmatched(self):
+        """
+        Returns the connectors not matched by any account (orphans, once all the accounts were matched).
+
+        Returns:
+            (list): The ConnectorKey of each unmatched connector.
+        """
+        return [key for connector_id, key in self.connectors.items() if connector_id not in self.matched_ids]
+
+
+def reconcile(connectors, accounts, needs_connector, provision, max_workers=8, has_time_left=None, owns_account=None):
+    """
+    Reconciles the connectors of the Qualys subscription with the accounts of the organization. The connectors are
+     indexed, then the accounts are streamed and joined with them, in linear time. Active accounts that need a
+     connector and have none are provisioned on a bounded thread pool, and connectors whose account is not active in
+     the organization are reported as orphans, with the status of their account in the organization (None if the
+     organization does not list it).
+
+    Args:
+        connectors: Iterable of the AWSConnector objects of the subscription.
+        accounts: Iterable of the OrganizationAccount objects of the organization.
+        needs_connector: Predicate that receives an account name and returns whether it needs a connector.
+        provision: Function that receives the name and ID of an account, provisions it, and returns True on success.
+        max_workers (int): Maximum number of accounts provisioned at once. Defaults to 8.
+        has_time_left: Function that returns False when no more provisioning can be started, eg: near the Lambda
+         timeout. Defaults to None (no deadline).
+        owns_account: Predicate that receives an account and returns whether its connector belongs to this
+         subscription. The connectors of the other accounts are still matched, so they are not reported as orphans,
+         but the accounts are not provisioned. Defaults to None (every account belongs to the subscription).
+
+    Returns:
+        (dict): The report of the reconciliation, with the counts of accounts and connectors, and the lists of
+         provisioned, failed and skipped accounts, and of orphan connectors.
+    """
+    index = ConnectorJoinIndex(connectors)
+    inactive_accounts = {}
+    report = {"accounts": 0, "connectors": len(index.connectors), "provisioned": [], "failed": [], "skipped": [],
+              "orphans": []}
+
+    def provision_missing(account):
+        if has_time_left is not None and not has_time_left():
+            return "skipped"
+        try:
+            return "provisioned" if provision(account.name, account.id) else "failed"
+        except Exception as err:
+            print(f"Could not provision {account.name} ({account.id}): {err}")
+            return "failed"
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reconciliation") as executor:
+        for account in accounts:
+            report["accounts"] += 1
+            if account.status != "ACTIVE":
+                inactive_accounts[account.id] = account.status
+                continue
+            if index.match(account) is None and needs_connector(account.name) and (
+                    owns_account is None or owns_account(account)):
+                futures.append((account, executor.submit(provision_missing, account)))
+        report["orphans"] = [dict(key._asdict(), account_status=inactive_accounts.get(key.aws_account_id))
+                             for key in index.unmatched()]
+        for account, future in futures:
+            report[future.result()].append({"id": account.id, "name": account.name})
+    return report
+
+
+def sweep_orphans(orphans, delete_connectors, batch_size=100, accounts=None, max_deletions=None):
+    """
+    Deletes the orphan connectors whose AWS account the organization lists as closed (see CLOSED_ACCOUNT_STATUSES).
+     The other orphans are only reported: the connectors never activated have no account to check, and the accounts
+     the organization does not list may belong to another organization or have been onboarded by hand. The
+     connectors are deleted by ID, in bulk requests.
+
+    Args:
+        orphans (list): The orphan connectors, as reported by reconcile.
+        delete_connectors: Function that receives the connector IDs, the selecting field and the batch size, and
+         returns the IDs of the deleted connectors, eg: QualysClient.delete_aws_connectors.
+        batch_size (int): Maximum number of connectors deleted per request. Defaults to 100.
+        accounts (int): Number of accounts the orphans were reported against. When it is 0, nothing is deleted: an
+         empty listing of the organization (eg: a role without access) would make every connector an orphan.
+         Defaults to None (not checked).
+        max_deletions (int): Maximum number of connectors deleted; the other orphans are left to the next runs.
+         Defaults to None (no limit).
+
+    Returns:
+        (list): The IDs of the deleted connectors.
+    """
+    connector_ids = [orphan["id"] for orphan in orphans
+                     if orphan["aws_account_id"] and orphan.get("account_status") in CLOSED_ACCOUNT_STATUSES]
+    if not connector_ids:
+        return []
+    if accounts == 0:
+        print(f"No account was listed in the organization, refusing to sweep {len(connector_ids)} connectors.")
+        return []
+    if max_deletions is not None and len(connector_ids) > max_deletions:
+        print(f"Sweeping {max_deletions} of {len(connector_ids)} orphan connectors, the others are left to the next "
+              f"runs.")
+        connector_ids = connector_ids[:max_deletions]
+    if not connector_ids:
+        return []
+    return delete_connectors(connector_ids, field="id", batch_size=batch_size)
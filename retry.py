@@ -0,0 +1,126 @@
+from transport import full_jitter_backoff
+import time
+import tracing
+
+RETRYABLE_STATUS_CODES = (409, 429, 500, 502, 503, 504)
+RETRYABLE_AWS_ERROR_CODES = (
+    "Throttling", "ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException", "ServiceUnavailable",
+    "InternalFailure", "InternalError", "ConcurrentModification", "ConcurrentModificationException"
+)
+
+
+class RetryableError(Exception):
+    """Raised by a provisioning step when it failed for a transient reason and can be run again."""
+    pass
+
+
+def is_transient_error(error):
+    """
+    Default classification of the errors raised by the provisioning steps.
+
+    Args:
+        error (Exception): The error raised by the step.
+
+    Returns:
+        (bool): True if running the step again may succeed, False otherwise.
+    """
+    if isinstance(error, RetryableError):
+        return True
+    try:
+        from requests.exceptions import ConnectionError, Timeout
+        if isinstance(error, (ConnectionError, Timeout)):
+            return True
+    except ImportError:
+        pass
+    try:
+        from botocore.exceptions import ClientError, ConnectionClosedError, EndpointConnectionError, ReadTimeoutError
+        if isinstance(error, (ConnectionClosedError, EndpointConnectionError, ReadTimeoutError)):
+            return True
+        if isinstance(error, ClientError):
+            return error.response.get('Error', {}).get('Code') in RETRYABLE_AWS_ERROR_CODES
+    except ImportError:
+        pass
+    return False
+
+
+class RetryBudgetExceeded(Exception):
+    pass
+
+
+class RetryPolicy:
+    """
+    Class that represents the retry policy of the provisioning steps. A failed step is run again, by itself, with
+     exponential backoff and jitter, until it succeeds, the maximum number of attempts is reached, or the next attempt
+     would not fit in the time left to the Lambda invocation.
+
+    Attributes:
+        __max_attempts (int): Maximum number of attempts of a step (including the first one).
+        __backoff_base (float): base delay, in seconds, of the exponential backoff.
+        __backoff_max (float): maximum delay, in seconds, between two attempts.
+        __context: The Lambda context, used to read the remaining time of the invocation. None if there is no deadline.
+        __reserved_ms (int): Milliseconds of the invocation kept for the steps that follow, eg: the notification.
+    """
+
+    def __init__(self, max_attempts=3, backoff_base=1, backoff_max=20, context=None, reserved_ms=10000):
+        """
+        Constructor method of class RetryPolicy.
+
+        Args:
+            max_attempts (int): Maximum number of attempts of a step (including the first one). Defaults to 3.
+            backoff_base (float): base delay, in seconds, of the exponential backoff. Defaults to 1.
+            backoff_max (float): maximum delay, in seconds, between two attempts. Defaults to 20.
+            context: The Lambda context. Defaults to None (no deadline).
+            reserved_ms (int): Milliseconds of the invocation kept for the steps that follow. Defaults to 10000.
+        """
+        self.__max_attempts = max_attempts
+        self.__backoff_base = backoff_base
+        self.__backoff_max = backoff_max
+        self.__context = context
+        self.__reserved_ms = reserved_ms
+
+    def remaining_ms(self):
+        """
+        Returns the time left to the invocation, minus the reserved time.
+
+        Returns:
+            (float): The remaining milliseconds. Infinity if the policy has no context.
+        """
+        if self.__context is None:
+            return float("inf")
+        return self.__context.get_remaining_time_in_millis() - self.__reserved_ms
+
+    def run(self, step_name, function, *args, retryable=is_transient_error, **kwargs):
+        """
+        Runs a step, retrying it while it fails with a retryable error. The step is traced as a span named after it,
+         with the number of attempts made.
+
+        Args:
+            step_name (str): The name of the step, used in the log messages.
+            function: The step.
+            *args: The positional arguments of the step.
+            retryable: Predicate that receives the error raised by the step and returns whether it can be retried.
+             Defaults to is_transient_error.
+            **kwargs: The keyword arguments of the step.
+
+        Returns:
+            The value returned by the step.
+
+        Raises:
+            The error of the last attempt, if the step did not succeed.
+        """
+        attempt = 0
+        with tracing.span(step_name) as span:
+            while True:
+                span.set(Attempts=attempt + 1)
+                try:
+                    return function(*args, **kwargs)
+                except Exception as error:
+                    attempt += 1
+                    if attempt >= self.__max_attempts or not retryable(error):
+                        raise
+                    delay = full_jitter_backoff(attempt - 1, self.__backoff_base, self.__backoff_max)
+                    if delay * 1000 >= self.remaining_ms():
+                        raise RetryBudgetExceeded(f"No time left to retry {step_name}: {error}") from error
+                    print(f"{step_name} failed ({error}). Retrying in {delay:.1f}s "
+                          f"({attempt}/{self.__max_attempts - 1}).")
+                    time.sleep(delay)
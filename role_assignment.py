@@ -1,31 +1,223 @@
-from botocore.exceptions import ClientError
-import boto3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
 import json
+import re
+import threading
+import tracing
 
+# boto3 is imported, and its session built, on first use, so cold starts that never reach IAM don't pay for it.
+_boto_session = None
+_boto_clients = {}
+_boto_lock = threading.Lock()
 
-def setup_iam(qualys_base_account_id, external_id, account_id):
 
-    boto_sts = boto3.client('sts')
+def get_boto_session():
+    """
+    Returns the boto3 session of the process, building it on the first call.
 
-    stsresponse = boto_sts.assume_role(
-        RoleArn=f"arn:aws:iam::{account_id}:role/qualysintegrationassumerole",
-        RoleSessionName='newsession'
-    )
+    Returns:
+        (boto3.session.Session): The memoized session.
+    """
+    global _boto_session
+    with _boto_lock:
+        if _boto_session is None:
+            import boto3
+            _boto_session = boto3.session.Session()
+        return _boto_session
 
-    newsession_id = stsresponse["Credentials"]["AccessKeyId"]
-    newsession_key = stsresponse["Credentials"]["SecretAccessKey"]
-    newsession_token = stsresponse["Credentials"]["SessionToken"]
 
-    iam_client = boto3.client(
-        'iam',
-        aws_access_key_id=newsession_id,
-        aws_secret_access_key=newsession_key,
-        aws_session_token=newsession_token
-    )
+def get_boto_client(service_name, **kwargs):
+    """
+    Creates a client from the session of the process. Clients created without arguments (ie: using the Lambda
+     credentials) are memoized per service. The creation is serialized, since boto3 sessions are not safe to use from
+     many threads at once, while the clients are. Each call made by the client is traced (see tracing).
 
-    role_name = "Role_For_QualysEC2Connector"
+    Args:
+        service_name (str): The AWS service, eg: 'sts' or 'iam'.
+        **kwargs: any other argument accepted by boto3.session.Session.client, eg: temporary credentials.
 
-    trust_relationship_policy_another_iam_user = {
+    Returns:
+        The boto3 client.
+    """
+    session = get_boto_session()
+    with _boto_lock:
+        if kwargs:
+            return tracing.instrument_boto_client(session.client(service_name, **kwargs))
+        if service_name not in _boto_clients:
+            _boto_clients[service_name] = tracing.instrument_boto_client(session.client(service_name))
+        return _boto_clients[service_name]
+
+
+def role_session_name(account_id, invocation_id=None):
+    """
+    Builds the name of an assumed-role session, so the calls made on the account can be traced back, on CloudTrail,
+     to the account and the Lambda invocation that made them.
+
+    Args:
+        account_id (str): The ID of the account whose role is assumed.
+        invocation_id (str): The ID of the invocation, eg: the Lambda request ID. Defaults to None.
+
+    Returns:
+        (str): A valid session name (at most 64 characters of [\\w+=,.@-]), eg: 'qualys-123456789012-<request id>'.
+    """
+    session_name = f"qualys-{account_id}-{invocation_id}" if invocation_id else f"qualys-{account_id}"
+    return re.sub(r"[^\w+=,.@-]", "-", session_name)[:64]
+
+
+class AssumedRoleCache:
+    """
+    Class that represents a cache of the sessions assumed on the target accounts. Each account has one session, built
+     from the temporary credentials of the assumed role, and the clients created from it. The credentials are reused
+     until they are about to expire, so processing an account again, in the same invocation or in a warm one, does not
+     call STS nor build the clients again.
+
+    Attributes:
+        __role_name (str): Name of the role assumed on the target accounts.
+        __refresh_margin (timedelta): How long before the expiration the credentials are refreshed.
+        __entries (dict): Maps the account IDs to their cached session.
+    """
+
+    def __init__(self, role_name="qualysintegrationassumerole", refresh_margin=300):
+        """
+        Constructor method of class AssumedRoleCache.
+
+        Args:
+            role_name (str): Name of the role assumed on the target accounts. Defaults to 'qualysintegrationassumerole'.
+            refresh_margin (float): Seconds before the expiration the credentials are refreshed. Defaults to 300.
+        """
+        self.__role_name = role_name
+        self.__refresh_margin = timedelta(seconds=refresh_margin)
+        self.__entries = {}
+        self.__lock = threading.Lock()
+
+    def get_client(self, account_id, service_name, invocation_id=None, region_name=None):
+        """
+        Returns a client of a service on the target account, authenticated with the assumed role.
+
+        Args:
+            account_id (str): The ID of the target account.
+            service_name (str): The AWS service, eg: 'iam'.
+            invocation_id (str): The ID of the invocation, used in the session name if the role is (re)assumed.
+            region_name (str): The region of the client, eg: 'sa-east-1'. Defaults to None (the default region).
+
+        Returns:
+            The boto3 client.
+        """
+        entry = self.__get_entry(account_id)
+        key = service_name if region_name is None else (service_name, region_name)
+        with entry["lock"]:
+            self.__refresh(entry, account_id, invocation_id)
+            if key not in entry["clients"]:
+                with _boto_lock:
+                    entry["clients"][key] = tracing.instrument_boto_client(
+                        entry["session"].client(service_name, region_name=region_name))
+            return entry["clients"][key]
+
+    def invalidate(self, account_id):
+        """
+        Discards the session of an account, eg: after its credentials were rejected.
+
+        Args:
+            account_id (str): The ID of the target account.
+        """
+        with self.__lock:
+            self.__entries.pop(account_id, None)
+
+    def __get_entry(self, account_id):
+        with self.__lock:
+            if account_id not in self.__entries:
+                self.__entries[account_id] = {"lock": threading.Lock(), "expiration": None, "session": None,
+                                              "clients": {}}
+            return self.__entries[account_id]
+
+    def __refresh(self, entry, account_id, invocation_id):
+        now = datetime.now(timezone.utc)
+        if entry["expiration"] is not None and entry["expiration"] - self.__refresh_margin > now:
+            return
+        import boto3
+        sts_response = get_boto_client('sts').assume_role(
+            RoleArn=f"arn:aws:iam::{account_id}:role/{self.__role_name}",
+            RoleSessionName=role_session_name(account_id, invocation_id)
+        )
+        credentials = sts_response["Credentials"]
+        with _boto_lock:
+            entry["session"] = boto3.session.Session(
+                aws_access_key_id=credentials["AccessKeyId"],
+                aws_secret_access_key=credentials["SecretAccessKey"],
+                aws_session_token=credentials["SessionToken"]
+            )
+        entry["expiration"] = credentials["Expiration"]
+        entry["clients"] = {}
+
+
+assumed_roles = AssumedRoleCache()
+# Runs the independent steps of setup_iam concurrently. Shared by all the calls, so batches don't spawn a pool each.
+_iam_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="setup-iam")
+# Probes the regions of an account concurrently (see discover_regions).
+_region_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="region-probe")
+# Errors of a region where the assumed role may not call EC2, eg: denied by an SCP.
+REGION_DENIED_ERROR_CODES = ("UnauthorizedOperation", "AccessDenied", "AccessDeniedException", "AuthFailure",
+                             "OptInRequired")
+# Errors of calls made with cached credentials that are no longer valid, eg: expired, or of a revoked or re-created role
+EXPIRED_CREDENTIALS_ERROR_CODES = ("ExpiredToken", "ExpiredTokenException", "InvalidClientTokenId")
+REJECTED_CREDENTIALS_ERROR_CODES = EXPIRED_CREDENTIALS_ERROR_CODES + ("AccessDenied", "AccessDeniedException")
+
+
+class IAMSetupError(Exception):
+    pass
+
+
+class IAMSetupResult(namedtuple("IAMSetupResult", ["role_arn", "policy_arn", "changes", "failed_step", "error"])):
+    """
+    Class that represents the result of setup_iam.
+
+    Attributes:
+        role_arn (str): ARN of the role assumed by Qualys. None if it could not be set up.
+        policy_arn (str): ARN of the policy attached to the role. None if it could not be set up.
+        changes (tuple): The write calls made on the account, eg: ('create_role', 'attach_role_policy'). Empty when
+         the account was already provisioned.
+        failed_step (str): The step that failed ('role', 'policy' or 'attachment'). None on success.
+        error (Exception): The error raised by the failed step. None on success.
+    """
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+QUALYS_ROLE_NAME = "Role_For_QualysEC2Connector"
+QUALYS_POLICY_NAME = "IAM_Policy_For_EC2Connector"
+QUALYS_POLICY_DOCUMENT = {
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Sid": "",
+            "Effect": "Allow",
+            "Action": [
+                "ec2:DescribeInstances",
+                "ec2:DescribeAddresses",
+                "ec2:DescribeImages"
+            ],
+            "Resource": "*"
+        }
+    ]
+}
+
+
+def trust_policy_document(qualys_base_account_id, external_id):
+    """
+    Builds the trust policy of the role, allowing the Qualys base account to assume it with the connector ExternalId.
+
+    Args:
+        qualys_base_account_id (str): The Qualys Base Account ID.
+        external_id (str): The external ID of the connector.
+
+    Returns:
+        (dict): The trust policy document.
+    """
+    return {
         "Version": "2012-10-17",
         "Statement": [
             {
@@ -44,61 +236,238 @@ def setup_iam(qualys_base_account_id, external_id, account_id):
         ]
     }
 
+
+def _policy_document(document):
+    # IAM returns policy documents URL-encoded, which boto3 usually (but not always) decodes.
+    if isinstance(document, str):
+        document = json.loads(unquote(document))
+    return document
+
+
+def _error_code(error):
+    return error.response.get('Error', {}).get('Code')
+
+
+def _with_fresh_credentials(account_id, call, error_codes=REJECTED_CREDENTIALS_ERROR_CODES):
+    """
+    Runs a call made with the assumed-role session of an account. If AWS rejects the cached credentials, the session
+     is discarded and the call is run once more, with the role assumed again.
+
+    Args:
+        account_id (str): The ID of the account.
+        call: Function without arguments that makes the calls.
+        error_codes (tuple): The error codes of the rejected credentials. Defaults to REJECTED_CREDENTIALS_ERROR_CODES.
+
+    Returns:
+        The value returned by the call.
+    """
+    from botocore.exceptions import ClientError
     try:
-        role_res = iam_client.create_role(
-            RoleName=role_name,
-            AssumeRolePolicyDocument=json.dumps(trust_relationship_policy_another_iam_user),
-            Description="The ARN of the role that can be assumed by the Qualys EC2 Connector"
-        )
+        return call()
     except ClientError as error:
-        if error.response['Error']['Code'] == 'EntityAlreadyExists':
-            print('Role already exists!')
-            role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
-            pass
-        else:
-            print(f'Unexpected error occurred! Role could not be created. {error}')
-            return
+        if _error_code(error) not in error_codes:
+            raise
+        print(f"The credentials of account {account_id} were rejected ({_error_code(error)}), assuming its role again.")
+        assumed_roles.invalidate(account_id)
+        return call()
+
+
+def ensure_role(iam_client, account_id, trust_policy, changes):
+    """
+    Makes sure the role exists with the given trust policy. The role is read first, and it is only created, or its
+     trust policy updated, when needed.
+
+    Args:
+        iam_client: The IAM client of the target account.
+        account_id (str): The ID of the target account.
+        trust_policy (dict): The expected trust policy document.
+        changes (list): The write calls made are appended to it.
+
+    Returns:
+        (str): The ARN of the role.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        role = iam_client.get_role(RoleName=QUALYS_ROLE_NAME)['Role']
+    except ClientError as error:
+        if _error_code(error) != 'NoSuchEntity':
+            raise
     else:
-        role_arn = role_res['Role']['Arn']
+        if _policy_document(role['AssumeRolePolicyDocument']) != trust_policy:
+            iam_client.update_assume_role_policy(RoleName=QUALYS_ROLE_NAME, PolicyDocument=json.dumps(trust_policy))
+            changes.append('update_assume_role_policy')
+        return role['Arn']
 
-    policy_json = {
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Sid": "",
-                "Effect": "Allow",
-                "Action": [
-                    "ec2:DescribeInstances",
-                    "ec2:DescribeAddresses",
-                    "ec2:DescribeImages"
-                ],
-                "Resource": "*"
-            }
-        ]
-    }
+    try:
+        role = iam_client.create_role(
+            RoleName=QUALYS_ROLE_NAME,
+            AssumeRolePolicyDocument=json.dumps(trust_policy),
+            Description="The ARN of the role that can be assumed by the Qualys EC2 Connector"
+        )['Role']
+    except ClientError as error:
+        if _error_code(error) != 'EntityAlreadyExists':
+            raise
+        # Created concurrently since it was read, so it is checked again.
+        return ensure_role(iam_client, account_id, trust_policy, changes)
+    changes.append('create_role')
+    return role['Arn']
 
-    policy_name = "IAM_Policy_For_EC2Connector"
 
+def ensure_policy(iam_client, account_id, changes):
+    """
+    Makes sure the policy used by the Qualys connector exists. The policy is read first, and it is only created when
+     missing.
+
+    Args:
+        iam_client: The IAM client of the target account.
+        account_id (str): The ID of the target account.
+        changes (list): The write calls made are appended to it.
+
+    Returns:
+        (str): The ARN of the policy.
+    """
+    from botocore.exceptions import ClientError
+
+    policy_arn = f"arn:aws:iam::{account_id}:policy/{QUALYS_POLICY_NAME}"
     try:
-        policy_res = iam_client.create_policy(
-            PolicyName=policy_name,
-            PolicyDocument=json.dumps(policy_json)
-        )
-        policy_arn = policy_res['Policy']['Arn']
+        return iam_client.get_policy(PolicyArn=policy_arn)['Policy']['Arn']
     except ClientError as error:
-        if error.response['Error']['Code'] == 'EntityAlreadyExists':
-            policy_arn = f'arn:aws:iam::{account_id}:policy/{policy_name}'
-        else:
-            print('Unexpected error occurred', error.response['Error']['Code'])
-            return 'Role could not be created...'
+        if _error_code(error) != 'NoSuchEntity':
+            raise
+    try:
+        policy_arn = iam_client.create_policy(
+            PolicyName=QUALYS_POLICY_NAME,
+            PolicyDocument=json.dumps(QUALYS_POLICY_DOCUMENT)
+        )['Policy']['Arn']
+    except ClientError as error:
+        if _error_code(error) != 'EntityAlreadyExists':
+            raise
+        return policy_arn
+    changes.append('create_policy')
+    return policy_arn
+
+
+def ensure_attachment(iam_client, policy_arn, role_created, changes):
+    """
+    Makes sure the policy is attached to the role. The attached policies are listed first, unless the role was just
+     created (and so has none).
+
+    Args:
+        iam_client: The IAM client of the target account.
+        policy_arn (str): The ARN of the policy.
+        role_created (bool): Whether the role was just created.
+        changes (list): The write calls made are appended to it.
+    """
+    if not role_created:
+        paginator = iam_client.get_paginator('list_attached_role_policies')
+        for page in paginator.paginate(RoleName=QUALYS_ROLE_NAME):
+            if any(policy['PolicyArn'] == policy_arn for policy in page['AttachedPolicies']):
+                return
+    iam_client.attach_role_policy(RoleName=QUALYS_ROLE_NAME, PolicyArn=policy_arn)
+    changes.append('attach_role_policy')
+
+
+def setup_iam(qualys_base_account_id, external_id, account_id, invocation_id=None):
+    """
+    Sets up, on the target account, the role assumed by Qualys and its policy. The role and the policy are checked
+     (and created or updated, if needed) concurrently, then the policy is attached to the role. Resources that are
+     already as expected are only read, so setting up an already provisioned account costs a few reads.
+
+    Args:
+        qualys_base_account_id (str): The Qualys Base Account ID, trusted by the role.
+        external_id (str): The external ID of the connector, required by the role to be assumed.
+        account_id (str): The ID of the target account.
+        invocation_id (str): The ID of the invocation, used to name the assumed-role session. Defaults to None.
+
+    Returns:
+        (IAMSetupResult): The ARNs of the role and policy, the changes made, and the error if a step failed.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    role_changes = []
+    policy_changes = []
+    role_arn = policy_arn = None
+    step = 'role'
+
+    def run_steps():
+        nonlocal role_arn, policy_arn, step
+        step = 'role'
+        iam_client = assumed_roles.get_client(account_id, 'iam', invocation_id=invocation_id)
+        trust_policy = trust_policy_document(qualys_base_account_id, external_id)
+        role_future = _iam_executor.submit(tracing.propagate(ensure_role), iam_client, account_id, trust_policy,
+                                           role_changes)
+        policy_future = _iam_executor.submit(tracing.propagate(ensure_policy), iam_client, account_id, policy_changes)
+        role_arn = role_future.result()
+        step = 'policy'
+        policy_arn = policy_future.result()
+        step = 'attachment'
+        ensure_attachment(iam_client, policy_arn, 'create_role' in role_changes, role_changes)
 
     try:
+        _with_fresh_credentials(account_id, run_steps)
+    except (BotoCoreError, ClientError) as error:
+        print(f"IAM setup failed on {step} of account {account_id}: {error}")
+        return IAMSetupResult(role_arn, policy_arn, tuple(role_changes + policy_changes), step, error)
+    return IAMSetupResult(role_arn, policy_arn, tuple(role_changes + policy_changes), None, None)
 
-        iam_client.attach_role_policy(
-            RoleName=role_name,
-            PolicyArn=policy_arn
-        )
+
+def probe_region(account_id, region_name, invocation_id=None):
+    """
+    Checks whether an account runs EC2 instances in a region.
+
+    Args:
+        account_id (str): The ID of the account.
+        region_name (str): The region, eg: 'sa-east-1'.
+        invocation_id (str): The ID of the invocation, used to name the assumed-role session. Defaults to None.
+
+    Returns:
+        (bool): True if the region has instances (or could not be checked for another reason than a denial), False if
+         it has none. None if the calls to EC2 are denied in the region.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+    def describe_instances():
+        ec2_client = assumed_roles.get_client(account_id, 'ec2', invocation_id=invocation_id, region_name=region_name)
+        return bool(ec2_client.describe_instances(MaxResults=5)["Reservations"])
+
+    try:
+        # AccessDenied is not retried: in a region, it means EC2 is denied there (eg: by an SCP)
+        return _with_fresh_credentials(account_id, describe_instances, EXPIRED_CREDENTIALS_ERROR_CODES)
     except ClientError as error:
-        print(f"Fail on attachment {error}")
-    return role_arn
-    
\ No newline at end of file
+        if _error_code(error) in REGION_DENIED_ERROR_CODES:
+            return None
+        print(f"Could not probe {region_name} of account {account_id}: {error}")
+        return True
+    except BotoCoreError as error:
+        print(f"Could not probe {region_name} of account {account_id}: {error}")
+        return True
+
+
+def discover_regions(account_id, invocation_id=None, probe=False):
+    """
+    Discovers the regions the connector of an account should sync: the regions enabled on the account (the default
+     ones and the opted-in ones), read through the assumed-role session also used by setup_iam. With probe, the regions
+     are checked concurrently, and only the ones with EC2 instances are kept; if none has instances yet (eg: a new
+     account), the ones where EC2 is allowed (eg: not denied by an SCP) are kept.
+
+    Args:
+        account_id (str): The ID of the account.
+        invocation_id (str): The ID of the invocation, used to name the assumed-role session. Defaults to None.
+        probe (bool): if True, the regions are probed for EC2 instances. Defaults to False.
+
+    Returns:
+        (list): The region codes, sorted.
+    """
+    def describe_regions():
+        ec2_client = assumed_roles.get_client(account_id, 'ec2', invocation_id=invocation_id)
+        return ec2_client.describe_regions(AllRegions=False)["Regions"]
+
+    regions = sorted(region["RegionName"] for region in _with_fresh_credentials(account_id, describe_regions))
+    if not probe:
+        return regions
+    futures = {region: _region_executor.submit(tracing.propagate(probe_region), account_id, region, invocation_id)
+               for region in regions}
+    probes = {region: future.result() for region, future in futures.items()}
+    in_use = [region for region in regions if probes[region]]
+    allowed = [region for region in regions if probes[region] is not None]
+    return in_use or allowed or regions
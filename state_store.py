@@ -0,0 +1,225 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+import json
+import os
+import sqlite3
+import threading
+
+PROVISIONING_STEPS = ("create", "setup_iam", "activate", "notify")
+
+
+class ProvisioningState:
+    """
+    Class that represents the checkpoint of the provisioning of one account.
+
+    Attributes:
+        account_id (str): The ID of the account.
+        completed_steps (dict): Maps each completed step to the UTC time (ISO 8601) it was completed.
+        outputs (dict): The outputs of the completed steps, eg: {'connector_id': '123', 'role_arn': 'arn:...'}.
+    """
+
+    def __init__(self, account_id, completed_steps=None, outputs=None):
+        self.account_id = account_id
+        self.completed_steps = completed_steps or {}
+        self.outputs = outputs or {}
+
+    def is_done(self, step):
+        return step in self.completed_steps
+
+    def get(self, output, default=None):
+        return self.outputs.get(output, default)
+
+    def to_dict(self):
+        return {"account_id": self.account_id, "completed_steps": self.completed_steps, "outputs": self.outputs}
+
+
+class CheckpointConflictError(Exception):
+    """Raised when a step is saved for an account it was already saved for, eg: by a concurrent duplicate delivery."""
+    pass
+
+
+class ProvisioningStateStore(ABC):
+    """
+    Base class of the stores of provisioning checkpoints. The provisioning pipeline records each completed step, with
+     its outputs, so a rerun for the same account (a retry or a duplicate event) resumes after the last checkpoint.
+    """
+
+    @abstractmethod
+    def load(self, account_id):
+        """
+        Loads the checkpoint of an account.
+
+        Args:
+            account_id (str): The ID of the account.
+
+        Returns:
+            (ProvisioningState): The checkpoint. Empty if the account was never provisioned.
+        """
+
+    @abstractmethod
+    def save_step(self, account_id, step, **outputs):
+        """
+        Records a completed step of an account. The step is only recorded if it was not already, so when two runs
+         provision the same account at once, only one of them records each step.
+
+        Args:
+            account_id (str): The ID of the account.
+            step (str): The completed step, one of PROVISIONING_STEPS.
+            **outputs: The outputs of the step, eg: connector_id='123'.
+
+        Raises:
+            CheckpointConflictError: if the step was already recorded for the account.
+        """
+
+    @abstractmethod
+    def clear(self, account_id):
+        """
+        Removes the checkpoint of an account, eg: after its connector was deleted.
+
+        Args:
+            account_id (str): The ID of the account.
+        """
+
+    @staticmethod
+    def now():
+        return datetime.now(timezone.utc).isoformat()
+
+
+class SQLiteStateStore(ProvisioningStateStore):
+    """
+    Provisioning checkpoints stored in a local SQLite database. Meant for tests and local runs, since the /tmp of a
+     Lambda does not outlive its execution environment.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor method of class SQLiteStateStore.
+
+        Args:
+            path (str): Path of the database file (':memory:' for an in-memory database).
+        """
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.Lock()
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS provisioning_state (account_id TEXT PRIMARY KEY, state TEXT NOT NULL)"
+            )
+
+    def load(self, account_id):
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT state FROM provisioning_state WHERE account_id = ?", (account_id,)
+            ).fetchone()
+        if row is None:
+            return ProvisioningState(account_id)
+        state = json.loads(row[0])
+        return ProvisioningState(account_id, state["completed_steps"], state["outputs"])
+
+    def save_step(self, account_id, step, **outputs):
+        with self.__lock, self.__connection:
+            row = self.__connection.execute(
+                "SELECT state FROM provisioning_state WHERE account_id = ?", (account_id,)
+            ).fetchone()
+            state = json.loads(row[0]) if row else {"completed_steps": {}, "outputs": {}}
+            if step in state["completed_steps"]:
+                raise CheckpointConflictError(f"Step {step} of account {account_id} was already saved")
+            state["completed_steps"][step] = self.now()
+            state["outputs"].update(outputs)
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO provisioning_state (account_id, state) VALUES (?, ?)",
+                (account_id, json.dumps(state))
+            )
+
+    def clear(self, account_id):
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM provisioning_state WHERE account_id = ?", (account_id,))
+
+
+class DynamoDBStateStore(ProvisioningStateStore):
+    """
+    Provisioning checkpoints stored in a DynamoDB table, whose partition key is the string attribute 'account_id'.
+     Each completed step is stored as a 'step_<name>' attribute holding its completion time, and each output as an
+     attribute of its own, so saving a step is a single UpdateItem that never overwrites the other steps. The update
+     is conditioned on the step attribute not existing yet, so of two concurrent runs only one saves each step.
+    """
+
+    def __init__(self, table_name, dynamodb_client=None):
+        """
+        Constructor method of class DynamoDBStateStore.
+
+        Args:
+            table_name (str): Name of the DynamoDB table.
+            dynamodb_client: The DynamoDB client. Defaults to the client of the process (see role_assignment).
+        """
+        if dynamodb_client is None:
+            from role_assignment import get_boto_client
+            dynamodb_client = get_boto_client('dynamodb')
+        self.__table_name = table_name
+        self.__client = dynamodb_client
+
+    @staticmethod
+    def __to_attribute(value):
+        if value is None:
+            return {"NULL": True}
+        if isinstance(value, bool):
+            return {"BOOL": value}
+        return {"S": str(value)}
+
+    @staticmethod
+    def __from_attribute(attribute):
+        if "BOOL" in attribute:
+            return attribute["BOOL"]
+        if "NULL" in attribute:
+            return None
+        return attribute.get("S")
+
+    def load(self, account_id):
+        item = self.__client.get_item(
+            TableName=self.__table_name,
+            Key={"account_id": {"S": account_id}},
+            ConsistentRead=True
+        ).get("Item", {})
+        completed_steps = {}
+        outputs = {}
+        for name, attribute in item.items():
+            if name == "account_id":
+                continue
+            if name.startswith("step_"):
+                completed_steps[name[len("step_"):]] = self.__from_attribute(attribute)
+            else:
+                outputs[name] = self.__from_attribute(attribute)
+        return ProvisioningState(account_id, completed_steps, outputs)
+
+    def save_step(self, account_id, step, **outputs):
+        values = {f"step_{step}": self.now(), **outputs}
+        names = {f"#a{index}": name for index, name in enumerate(values)}
+        try:
+            self.__client.update_item(
+                TableName=self.__table_name,
+                Key={"account_id": {"S": account_id}},
+                UpdateExpression="SET " + ", ".join(f"#a{index} = :v{index}" for index in range(len(values))),
+                ConditionExpression="attribute_not_exists(#a0)",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={f":v{index}": self.__to_attribute(value)
+                                           for index, value in enumerate(values.values())}
+            )
+        except self.__client.exceptions.ConditionalCheckFailedException as err:
+            raise CheckpointConflictError(f"Step {step} of account {account_id} was already saved") from err
+
+    def clear(self, account_id):
+        self.__client.delete_item(TableName=self.__table_name, Key={"account_id": {"S": account_id}})
+
+
+def state_store_from_environment():
+    """
+    Builds the state store configured by the environment variables: a DynamoDB table if PROVISIONING_STATE_TABLE is
+     set, else a SQLite database if PROVISIONING_STATE_DB is set.
+
+    Returns:
+        (ProvisioningStateStore): The configured store. None if no store is configured.
+    """
+    if os.environ.get("PROVISIONING_STATE_TABLE"):
+        return DynamoDBStateStore(os.environ["PROVISIONING_STATE_TABLE"])
+    if os.environ.get("PROVISIONING_STATE_DB"):
+        return SQLiteStateStore(os.environ["PROVISIONING_STATE_DB"])
+    return None
@@ -0,0 +1,89 @@
+"""
+Tests of AsyncQualysClient against the local Qualys emulator (see benchmarks/qualys_emulator.py).
+"""
+from os.path import abspath, dirname
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from benchmarks.qualys_emulator import QualysEmulator  # noqa: E402
+from qualys_async import AsyncQualysClient  # noqa: E402
+
+os.environ.setdefault("QUALYS_API_USER", "test")
+os.environ.setdefault("QUALYS_API_PASSWORD", "test")
+os.environ.setdefault("QUALYS_BASE_ACCOUNT_ID", "000000000000")
+
+
+class AsyncQualysClientTest(unittest.IsolatedAsyncioTestCase):
+
+    def start_emulator(self, **kwargs):
+        emulator = QualysEmulator(seed=1, **kwargs).start()
+        self.addCleanup(emulator.stop)
+        return emulator
+
+    @staticmethod
+    def build_client(emulator, **kwargs):
+        return AsyncQualysClient(emulator.host, protocol="http", backoff_base=0.01, backoff_max=0.05, **kwargs)
+
+    async def test_iter_aws_connectors_follows_the_pages(self):
+        emulator = self.start_emulator(connectors=25)
+        async with self.build_client(emulator) as client:
+            connectors = await client.get_aws_connectors(page_size=10)
+        self.assertEqual(len(connectors), 25)
+        self.assertEqual(len({connector.id for connector in connectors}), 25)
+        self.assertEqual(emulator.requests["search"], 3)
+
+    async def test_get_aws_connector_by_name(self):
+        emulator = self.start_emulator(connectors=5)
+        name = emulator.store.search([])[2]["name"]
+        async with self.build_client(emulator) as client:
+            connector = await client.get_aws_connector_by_name(name)
+            missing = await client.get_aws_connector_by_name("missing")
+        self.assertEqual(connector.name, name)
+        self.assertIsNone(missing)
+
+    async def test_requests_in_flight_are_bounded(self):
+        emulator = self.start_emulator(connectors=5, latency=0.05)
+        async with self.build_client(emulator, max_in_flight=2) as client:
+            results = await asyncio.gather(*(client.create_aws_connector(f"account-{i}") for i in range(10)))
+        self.assertTrue(all(status for _, status in results))
+        self.assertEqual(emulator.requests["create"], 10)
+        self.assertEqual(emulator.max_running, 2)
+
+    async def test_idempotent_requests_are_retried_on_5xx(self):
+        emulator = self.start_emulator(error_rate=1.0)
+        async with self.build_client(emulator, max_retries=2) as client:
+            response = await client.delete_aws_connector("account")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(emulator.requests["delete"], 3)
+
+    async def test_creations_are_not_retried(self):
+        emulator = self.start_emulator(error_rate=1.0)
+        async with self.build_client(emulator, max_retries=2) as client:
+            response, status = await client.create_aws_connector("account")
+        self.assertFalse(status)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(emulator.requests["create"], 1)
+
+
+class AsyncQualysClientLoopTest(unittest.TestCase):
+
+    def test_client_can_be_used_on_several_event_loops(self):
+        # The semaphore is created in the running loop, so a client built outside of it (eg: at import time) works
+        # on every loop it is used on, even when its requests wait for the semaphore.
+        with QualysEmulator(connectors=5, latency=0.01) as emulator:
+            client = AsyncQualysClient(emulator.host, protocol="http", max_in_flight=1)
+
+            async def gather_creations():
+                async with client:
+                    return await asyncio.gather(*(client.create_aws_connector(f"account-{i}") for i in range(3)))
+
+            for _ in range(2):
+                self.assertTrue(all(status for _, status in asyncio.run(gather_creations())))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,269 @@
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+import json
+import os
+import threading
+import time
+
+# Metric name and unit of the numeric span fields published to CloudWatch. Other fields are published as properties,
+# searchable with CloudWatch Logs Insights.
+SPAN_METRICS = {
+    "Duration": "Milliseconds",
+    "Attempts": "Count",
+    "Polls": "Count",
+    "HttpRequests": "Count",
+    "HttpRetries": "Count",
+    "HttpThrottled": "Count",
+    "BytesSent": "Bytes",
+    "BytesReceived": "Bytes",
+}
+
+_current_span = ContextVar("current_span", default=None)
+
+
+def tracing_enabled():
+    return os.environ.get("TRACING_ENABLED", "true").lower() not in ("false", "0", "no")
+
+
+class Span:
+    """
+    Class that represents a timed stage of a trace, eg: the creation of a connector or one IAM call.
+
+    Attributes:
+        name (str): Name of the stage.
+        parent (Span): The enclosing span. None for the root span of a trace.
+        duration_ms (float): Duration of the stage. None while it runs.
+        fields (dict): The attributes (eg: HttpStatus) and counters (eg: BytesReceived) recorded on the span.
+    """
+
+    __slots__ = ("name", "parent", "trace", "started", "duration_ms", "fields")
+
+    def __init__(self, name, parent=None, trace=None, **fields):
+        self.name = name
+        self.parent = parent
+        self.trace = trace
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.fields = fields
+
+    def set(self, **fields):
+        """Records attributes on the span, replacing their previous values."""
+        self.fields.update(fields)
+
+    def add(self, **counters):
+        """Adds to counters of the span, eg: span.add(HttpRequests=1, BytesReceived=512)."""
+        for name, value in counters.items():
+            self.fields[name] = self.fields.get(name, 0) + value
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        if self.trace is not None:
+            self.trace.record(self)
+
+
+class Trace:
+    """
+    Class that represents the trace of one unit of work (eg: the provisioning of an account): the spans of its stages,
+     published as CloudWatch Embedded Metric Format (EMF) log lines once the work is done.
+
+    Attributes:
+        trace_id (str): ID shared by the spans, eg: the Lambda request ID.
+        properties (dict): Published with every span, eg: {'AccountId': '123456789012'}.
+        spans (list): The finished spans, in the order they finished.
+    """
+
+    def __init__(self, trace_id=None, **properties):
+        self.trace_id = trace_id
+        self.properties = properties
+        self.spans = []
+        self.__lock = threading.Lock()
+
+    def record(self, span):
+        with self.__lock:
+            self.spans.append(span)
+
+    def to_emf(self, namespace=None):
+        """
+        Renders the spans as EMF documents, one per span, with the stage name as dimension.
+
+        Args:
+            namespace (str): The CloudWatch namespace. Defaults to the METRICS_NAMESPACE environment variable, or
+             'QualysConnectorAutomation'.
+
+        Returns:
+            (list): The EMF documents.
+        """
+        namespace = namespace or os.environ.get("METRICS_NAMESPACE", "QualysConnectorAutomation")
+        timestamp = int(time.time() * 1000)
+        documents = []
+        with self.__lock:
+            spans = list(self.spans)
+        for span in spans:
+            document = dict(self.properties, **span.fields)
+            document.update(Stage=span.name, Duration=round(span.duration_ms, 3))
+            if span.parent is not None:
+                document["Parent"] = span.parent.name
+            if self.trace_id is not None:
+                document["TraceId"] = self.trace_id
+            metrics = [{"Name": name, "Unit": unit} for name, unit in SPAN_METRICS.items() if name in document]
+            document["_aws"] = {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [{"Namespace": namespace, "Dimensions": [["Stage"]], "Metrics": metrics}]
+            }
+            documents.append(document)
+        return documents
+
+    def emit(self):
+        """
+        Prints the EMF documents, one JSON line each, which the Lambda log agent turns into metrics. They are printed
+         with a single write, so the lines of concurrent traces are not interleaved.
+        """
+        lines = [json.dumps(document, default=str) for document in self.to_emf()]
+        print("\n".join(lines) + "\n", end="")
+
+
+@contextmanager
+def trace(name, trace_id=None, **properties):
+    """
+    Runs the enclosed code as a traced unit of work, whose spans are published when it ends. Inside another trace, it
+     is only a span of it, so the work is published once, by the outermost trace.
+
+    Args:
+        name (str): Name of the root span, eg: 'lambda_handler'.
+        trace_id (str): ID of the trace, eg: the Lambda request ID. Defaults to None.
+        **properties: Published with every span, eg: AccountId='123456789012'.
+
+    Yields:
+        (Span): The root span.
+    """
+    if _current_span.get() is not None or not tracing_enabled():
+        with span(name, **properties) as root:
+            yield root
+        return
+    current = Trace(trace_id, **properties)
+    root = Span(name, trace=current)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as error:
+        root.set(Error=type(error).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        root.finish()
+        current.emit()
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Times the enclosed code as a stage of the current trace. Outside a trace, the span is not recorded.
+
+    Args:
+        name (str): Name of the stage, eg: 'create'.
+        **fields: Attributes recorded on the span.
+
+    Yields:
+        (Span): The span, to record attributes and counters on.
+    """
+    parent = _current_span.get()
+    current = Span(name, parent, parent.trace if parent is not None else None, **fields)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as error:
+        current.set(Error=type(error).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+
+
+def current_span():
+    """
+    Returns the innermost span of the running code.
+
+    Returns:
+        (Span): The span. None outside a trace.
+    """
+    return _current_span.get()
+
+
+def propagate(function):
+    """
+    Binds a function to the current trace, so its spans are recorded when it runs on another thread (eg: submitted to
+     a ThreadPoolExecutor, which does not carry the context of the submitting thread).
+
+    Args:
+        function: The function.
+
+    Returns:
+        A function that runs the given one in a copy of the current context.
+    """
+    context = copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+
+def _before_aws_call(context, **kwargs):
+    context["trace_started"] = time.perf_counter()
+
+
+def _after_aws_call(model, http_response, context, **kwargs):
+    started = context.pop("trace_started", None)
+    parent = _current_span.get()
+    if started is None or parent is None or parent.trace is None:
+        return
+    call = Span(f"{model.service_model.service_name}.{model.name}", parent, parent.trace,
+                HttpStatus=getattr(http_response, "status_code", None))
+    call.started = started
+    call.finish()
+
+
+def instrument_boto_client(client):
+    """
+    Records a span for each call made by a boto3 client (eg: 'iam.GetRole'), with its HTTP status.
+
+    Args:
+        client: The boto3 client.
+
+    Returns:
+        The same client.
+    """
+    # The start is taken before the parameters are built, since a stubbed client answers from its before-call event.
+    client.meta.events.register("before-parameter-build", _before_aws_call)
+    client.meta.events.register("after-call", _after_aws_call)
+    return client
+
+
+@contextmanager
+def profiled(name):
+    """
+    Profiles the enclosed code with cProfile when the PROFILE_HANDLER environment variable is set, then prints the
+     slowest functions (PROFILE_TOP, default 25), or dumps the stats to the PROFILE_OUTPUT_DIRECTORY, if set (eg: to
+     download them from /tmp). Only the calling thread is profiled.
+
+    Args:
+        name (str): Name of the profiled code, used in the output.
+    """
+    if os.environ.get("PROFILE_HANDLER", "").lower() not in ("true", "1", "yes"):
+        yield
+        return
+    import cProfile
+    import io
+    import pstats
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        output_directory = os.environ.get("PROFILE_OUTPUT_DIRECTORY")
+        if output_directory:
+            path = os.path.join(output_directory, f"{name}-{int(time.time() * 1000)}.prof")
+            profile.dump_stats(path)
+            print(f"Profile of {name} saved to {path}")
+        else:
+            report = io.StringIO()
+            pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(
+                int(os.environ.get("PROFILE_TOP", 25)))
+            print(f"Profile of {name}:\n{report.getvalue()}")
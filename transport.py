@@ -0,0 +1,227 @@
+from requests.adapters import HTTPAdapter
+from contextlib import ExitStack
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+import random
+import threading
+import time
+import os
+import tracing
+
+
+def full_jitter_backoff(attempt, base, maximum):
+    """
+    Returns the delay before retrying a failed attempt, using exponential backoff with full jitter.
+
+    Args:
+        attempt (int): number of the attempt that failed, starting at 0.
+        base (float): base delay, in seconds.
+        maximum (float): maximum delay, in seconds.
+
+    Returns:
+        (float): seconds to wait before the next attempt.
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def retry_after_delay(response, default=None):
+    """
+    Returns the delay requested by the Retry-After header of a response (eg: 429 Too Many Requests), given either in
+     seconds or as an HTTP date.
+
+    Args:
+        response (requests.Response): the response.
+        default (float): value returned when the header is missing or invalid. Defaults to None.
+
+    Returns:
+        (float): seconds to wait before the next request.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+class HTTPTransport:
+    """
+    Class that represents the HTTP transport shared by the API clients. It keeps a connection-pooled session, so
+     consecutive requests to the same host reuse the same TLS connection, and retries failed requests with exponential
+     backoff and jitter.
+
+    Attributes:
+        __session (requests.Session): session holding the connection pools.
+        __connect_timeout (float): seconds to wait for the connection to be established.
+        __read_timeout (float): seconds to wait for the server to send data.
+        __max_retries (int): maximum number of retries of a failed request.
+        __backoff_base (float): base delay, in seconds, of the exponential backoff.
+        __backoff_max (float): maximum delay, in seconds, between two attempts.
+    """
+
+    retryable_status_codes = (500, 502, 503, 504)
+
+    def __init__(self, connect_timeout=5, read_timeout=60, max_retries=3, backoff_base=0.5, backoff_max=10,
+                 pool_connections=4, pool_maxsize=10):
+        """
+        Constructor method of class HTTPTransport.
+
+        Args:
+            connect_timeout (float): seconds to wait for the connection to be established. Defaults to 5.
+            read_timeout (float): seconds to wait for the server to send data. Defaults to 60.
+            max_retries (int): maximum number of retries of a failed request. Defaults to 3.
+            backoff_base (float): base delay, in seconds, of the exponential backoff. Defaults to 0.5.
+            backoff_max (float): maximum delay, in seconds, between two attempts. Defaults to 10.
+            pool_connections (int): number of hosts with a connection pool kept by the default adapter. Defaults to 4.
+            pool_maxsize (int): maximum number of connections kept per host by the default adapter. Defaults to 10.
+        """
+        self.__connect_timeout = connect_timeout
+        self.__read_timeout = read_timeout
+        self.__max_retries = max_retries
+        self.__backoff_base = backoff_base
+        self.__backoff_max = backoff_max
+        self.__session = requests.Session()
+        self.__session.mount("https://", HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize))
+        self.__session.mount("http://", HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize))
+        self.__mounted_hosts = set()
+        self.__lock = threading.Lock()
+
+    def mount_host(self, host, pool_maxsize, protocol="https"):
+        """
+        Gives a host its own connection pool, sized to the number of concurrent requests expected to it. Hosts that are
+         not mounted share the default adapter.
+
+        Args:
+            host (str): the host name, eg: 'qualysapi.qg3.apps.qualys.com'.
+            pool_maxsize (int): maximum number of connections kept to the host.
+            protocol (str): WEB protocol used in the communication. Defaults to 'https'.
+        """
+        prefix = f"{protocol}://{host}/"
+        with self.__lock:
+            if prefix in self.__mounted_hosts:
+                return
+            self.__session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+            self.__mounted_hosts.add(prefix)
+
+    def backoff_delay(self, attempt):
+        """
+        Returns the delay before the next attempt, using exponential backoff with full jitter.
+
+        Args:
+            attempt (int): number of the attempt that failed, starting at 0.
+
+        Returns:
+            (float): seconds to wait before the next attempt.
+        """
+        return full_jitter_backoff(attempt, self.__backoff_base, self.__backoff_max)
+
+    def request(self, method, url, idempotent=True, throttle=None, **kwargs):
+        """
+        Makes a request through the pooled session, retrying it on connection errors and 5xx responses. The requests,
+         retries, bytes and last HTTP status are recorded on the current tracing span. With a throttle, each attempt
+         waits for it, and a response rejected for exceeding the API limits is retried once the throttle allows it,
+         without counting as a retry. The throttle slot of a streamed response (stream=True) is held until the response
+         is closed, since its body is still being downloaded, so such responses must always be closed.
+
+        Args:
+            method (str): the HTTP method, eg: 'GET' or 'POST'.
+            url (str): the full URL of the request.
+            idempotent (bool): whether the request can be safely repeated. Non-idempotent requests are only retried
+             when the connection could not be established, so the server never receives them twice. Defaults to True.
+            throttle (AdaptiveThrottle): the throttle of the API limits of the requested server. Defaults to None.
+            **kwargs: any other argument accepted by requests.Session.request.
+
+        Returns:
+            response (requests.Response): the response of the last attempt.
+        """
+        kwargs.setdefault("timeout", (self.__connect_timeout, self.__read_timeout))
+        span = tracing.current_span()
+        attempt = 0
+        throttled = 0
+        while True:
+            if span is not None:
+                span.add(HttpRequests=1, HttpRetries=1 if attempt else 0, BytesSent=len(kwargs.get("data") or b""))
+            try:
+                with ExitStack() as slot:
+                    if throttle is not None:
+                        slot.enter_context(throttle.slot())
+                    response = self.__session.request(method, url, **kwargs)
+                    if kwargs.get("stream"):
+                        self.__release_on_close(response, slot.pop_all())
+            except requests.exceptions.ConnectTimeout:
+                if attempt >= self.__max_retries:
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not idempotent or attempt >= self.__max_retries:
+                    raise
+            else:
+                if span is not None:
+                    span.set(HttpStatus=response.status_code)
+                    if not kwargs.get("stream"):
+                        span.add(BytesReceived=len(response.content))
+                wait = throttle.update(response) if throttle is not None else None
+                if wait is not None and wait <= throttle.max_wait and throttled < throttle.max_waits:
+                    # The request was rejected before being processed, so it is retried whether it is idempotent or not
+                    if span is not None:
+                        span.add(HttpThrottled=1)
+                    response.close()
+                    throttled += 1
+                    continue
+                retryable = idempotent and response.status_code in self.retryable_status_codes
+                if not retryable or attempt >= self.__max_retries:
+                    return response
+                response.close()
+            time.sleep(self.backoff_delay(attempt))
+            attempt += 1
+
+    @staticmethod
+    def __release_on_close(response, slot):
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                # Closing the ExitStack again is a no-op, so the slot is only released once
+                slot.close()
+
+        response.close = close_and_release
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+_shared_transport = None
+_shared_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Returns the transport shared by all the clients of the process. It is created on the first call, so it persists
+     (with its open connections) across warm Lambda invocations.
+
+    Returns:
+        (HTTPTransport): the shared transport, configured from the HTTP_* environment variables.
+    """
+    global _shared_transport
+    with _shared_transport_lock:
+        if _shared_transport is None:
+            _shared_transport = HTTPTransport(
+                connect_timeout=float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5)),
+                read_timeout=float(os.environ.get("HTTP_READ_TIMEOUT", 60)),
+                max_retries=int(os.environ.get("HTTP_MAX_RETRIES", 3)),
+                pool_maxsize=int(os.environ.get("HTTP_POOL_MAXSIZE", 10))
+            )
+        return _shared_transport